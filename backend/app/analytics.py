@@ -0,0 +1,236 @@
+import os
+from datetime import datetime
+
+from sqlalchemy import and_, case, delete, func, insert, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import upsert
+from app.models import ChurnDaily, Payment, PaymentTotal, RevenueDaily, RollupDelta, Subscription, SubscriptionCount
+
+# Сводные таблицы аналитики обновляются приращениями: каждая сводка пользователя хранит его
+# счетчики (data["stats"]), и refresh_summaries записывает разницу старых и новых счетчиков
+# в analytics_rollup_deltas в той же транзакции (только INSERT, общие строки сводных таблиц
+# не блокируются). Воркер outbox сворачивает приращения в сводные таблицы (fold_rollup_deltas).
+# Запросы аналитики читают только сводные таблицы и отстают на интервал свертки.
+
+# platform_id в ключах сводных таблиц для подписок и платежей без платформы
+NO_PLATFORM = 0
+CHURN_STATUSES = ("cancelled", "expired")
+
+subscription_counts_table = SubscriptionCount.__table__
+payment_totals_table = PaymentTotal.__table__
+revenue_daily_table = RevenueDaily.__table__
+churn_daily_table = ChurnDaily.__table__
+rollup_deltas_table = RollupDelta.__table__
+
+# Сколько приращений сворачивается за одну транзакцию
+ANALYTICS_FOLD_BATCH_SIZE = int(os.getenv("ANALYTICS_FOLD_BATCH_SIZE", "1000"))
+
+
+def empty_stats() -> dict:
+    return {"subscriptions": [], "payments": []}
+
+
+def stats_queries(user_ids):
+    # Счетчики пользователей по (платформа, план, статус): подписки и платежи с суммами
+    subscriptions = (
+        select(
+            Subscription.user_id,
+            Subscription.platform_id,
+            Subscription.plan_name,
+            Subscription.status,
+            func.count(),
+        )
+        .where(Subscription.user_id.in_(user_ids))
+        .group_by(Subscription.user_id, Subscription.platform_id, Subscription.plan_name, Subscription.status)
+    )
+    payments = (
+        select(
+            Payment.user_id,
+            Subscription.platform_id,
+            Payment.plan_name,
+            Payment.status,
+            func.count(),
+            func.coalesce(func.sum(Payment.amount), 0),
+        )
+        .outerjoin(Subscription, Subscription.id == Payment.subscription_id)
+        .where(Payment.user_id.in_(user_ids))
+        .group_by(Payment.user_id, Subscription.platform_id, Payment.plan_name, Payment.status)
+    )
+    return subscriptions, payments
+
+
+def build_stats(user_ids, subscription_rows, payment_rows) -> dict:
+    stats = {user_id: empty_stats() for user_id in user_ids}
+    for user_id, platform_id, plan_name, status, count in subscription_rows:
+        stats[user_id]["subscriptions"].append([platform_id or NO_PLATFORM, plan_name or "", status or "", count])
+    for user_id, platform_id, plan_name, status, count, amount in payment_rows:
+        stats[user_id]["payments"].append(
+            [platform_id or NO_PLATFORM, plan_name or "", status or "", count, int(amount)]
+        )
+    for user_stats in stats.values():
+        user_stats["subscriptions"].sort()
+        user_stats["payments"].sort()
+    return stats
+
+
+def stats_deltas(old_stats: dict, new_stats: dict):
+    # Разница счетчиков по ключу (платформа, план, статус); нулевые разницы отбрасываются
+    subscriptions = {}
+    payments = {}
+    for sign, stats_by_user in ((-1, old_stats), (1, new_stats)):
+        for stats in stats_by_user.values():
+            stats = stats or empty_stats()
+            for platform_id, plan_name, status, count in stats["subscriptions"]:
+                key = (platform_id, plan_name, status)
+                subscriptions[key] = subscriptions.get(key, 0) + sign * count
+            for platform_id, plan_name, status, count, amount in stats["payments"]:
+                key = (platform_id, plan_name, status)
+                current = payments.get(key, (0, 0))
+                payments[key] = (current[0] + sign * count, current[1] + sign * amount)
+    subscriptions = {key: delta for key, delta in subscriptions.items() if delta}
+    payments = {key: delta for key, delta in payments.items() if delta != (0, 0)}
+    return subscriptions, payments
+
+
+async def record_rollup_deltas(db: AsyncSession, old_stats: dict, new_stats: dict):
+    # Вызывается из refresh_summaries: одна вставка строк приращений на транзакцию
+    subscriptions, payments = stats_deltas(old_stats, new_stats)
+    today = datetime.utcnow().date()
+    rows = [
+        {"kind": "subscriptions", "day": today, "platform_id": platform_id, "plan_name": plan_name,
+         "status": status, "count": delta, "amount": 0}
+        for (platform_id, plan_name, status), delta in sorted(subscriptions.items())
+    ] + [
+        {"kind": "payments", "day": today, "platform_id": platform_id, "plan_name": plan_name,
+         "status": status, "count": count, "amount": amount}
+        for (platform_id, plan_name, status), (count, amount) in sorted(payments.items())
+    ]
+    if rows:
+        await db.execute(insert(rollup_deltas_table).values(rows))
+
+
+def fold_deltas(rows):
+    # Приращения -> суммы по ключам сводных таблиц. Отток и выручка дня считаются по каждой
+    # строке отдельно (как по транзакции): cancelled/expired с ростом счетчика, confirmed с ростом платежей
+    subscriptions, payments, churn, revenue = {}, {}, {}, {}
+    for row in rows:
+        key = (row.platform_id, row.plan_name, row.status)
+        if row.kind == "subscriptions":
+            subscriptions[key] = subscriptions.get(key, 0) + row.count
+            if row.status in CHURN_STATUSES and row.count > 0:
+                churn_key = (row.day, *key)
+                churn[churn_key] = churn.get(churn_key, 0) + row.count
+        else:
+            count, amount = payments.get(key, (0, 0))
+            payments[key] = (count + row.count, amount + row.amount)
+            if row.status == "confirmed" and row.count > 0:
+                revenue_key = (row.day, row.platform_id, row.plan_name)
+                count, amount = revenue.get(revenue_key, (0, 0))
+                revenue[revenue_key] = (count + row.count, amount + row.amount)
+    subscriptions = {key: delta for key, delta in subscriptions.items() if delta}
+    payments = {key: delta for key, delta in payments.items() if delta != (0, 0)}
+    return subscriptions, payments, churn, revenue
+
+
+async def fold_rollup_deltas(db: AsyncSession, batch_size: int = ANALYTICS_FOLD_BATCH_SIZE) -> int:
+    # Пачка приращений прибавляется к сводным таблицам и удаляется в одной транзакции.
+    # SKIP LOCKED: параллельные воркеры сворачивают разные строки. Строки сводных таблиц
+    # обновляются в порядке ключей, чтобы воркеры не блокировали друг друга крест-накрест
+    rows = (await db.execute(
+        select(rollup_deltas_table).order_by(rollup_deltas_table.c.id).limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )).all()
+    if not rows:
+        await db.commit()
+        return 0
+    dialect_name = (await db.connection()).dialect.name
+    subscriptions, payments, churn, revenue = fold_deltas(rows)
+
+    if subscriptions:
+        await db.execute(upsert(
+            dialect_name, subscription_counts_table,
+            [{"platform_id": platform_id, "plan_name": plan_name, "status": status, "subscriptions": delta}
+             for (platform_id, plan_name, status), delta in sorted(subscriptions.items())],
+            ["platform_id", "plan_name", "status"],
+            increment_columns=["subscriptions"],
+        ))
+    if churn:
+        await db.execute(upsert(
+            dialect_name, churn_daily_table,
+            [{"day": day, "platform_id": platform_id, "plan_name": plan_name, "status": status,
+              "subscriptions": delta}
+             for (day, platform_id, plan_name, status), delta in sorted(churn.items())],
+            ["day", "platform_id", "plan_name", "status"],
+            increment_columns=["subscriptions"],
+        ))
+    if payments:
+        await db.execute(upsert(
+            dialect_name, payment_totals_table,
+            [{"platform_id": platform_id, "plan_name": plan_name, "status": status, "payments": count,
+              "amount": amount}
+             for (platform_id, plan_name, status), (count, amount) in sorted(payments.items())],
+            ["platform_id", "plan_name", "status"],
+            increment_columns=["payments", "amount"],
+        ))
+    if revenue:
+        await db.execute(upsert(
+            dialect_name, revenue_daily_table,
+            [{"day": day, "platform_id": platform_id, "plan_name": plan_name, "payments": count, "amount": amount}
+             for (day, platform_id, plan_name), (count, amount) in sorted(revenue.items())],
+            ["day", "platform_id", "plan_name"],
+            increment_columns=["payments", "amount"],
+        ))
+    await db.execute(delete(rollup_deltas_table).where(rollup_deltas_table.c.id.in_([row.id for row in rows])))
+    await db.commit()
+    return len(rows)
+
+
+def rebuild_rollups(conn):
+    # Полный пересчет сводных таблиц по истории (python -m app.migrations backfill-analytics).
+    # Дата отмены не хранится: отмененная подписка относится к дню окончания, если он уже прошел, иначе к сегодня
+    today = datetime.utcnow().date()
+    for table in (subscription_counts_table, payment_totals_table, revenue_daily_table, churn_daily_table):
+        conn.execute(delete(table))
+
+    platform_id = func.coalesce(Subscription.platform_id, NO_PLATFORM)
+    subscription_plan = func.coalesce(Subscription.plan_name, "")
+    subscription_status = func.coalesce(Subscription.status, "")
+    conn.execute(insert(subscription_counts_table).from_select(
+        ["platform_id", "plan_name", "status", "subscriptions"],
+        select(platform_id, subscription_plan, subscription_status, func.count())
+        .group_by(platform_id, subscription_plan, subscription_status),
+    ))
+
+    churn_day = case(
+        (and_(Subscription.status == "expired", Subscription.end_date.isnot(None)), Subscription.end_date),
+        (Subscription.end_date < today, Subscription.end_date),
+        else_=literal(today),
+    )
+    conn.execute(insert(churn_daily_table).from_select(
+        ["day", "platform_id", "plan_name", "status", "subscriptions"],
+        select(churn_day, platform_id, subscription_plan, Subscription.status, func.count())
+        .where(Subscription.status.in_(CHURN_STATUSES))
+        .group_by(churn_day, platform_id, subscription_plan, Subscription.status),
+    ))
+
+    payment_plan = func.coalesce(Payment.plan_name, "")
+    payment_status = func.coalesce(Payment.status, "")
+    conn.execute(insert(payment_totals_table).from_select(
+        ["platform_id", "plan_name", "status", "payments", "amount"],
+        select(platform_id, payment_plan, payment_status, func.count(), func.coalesce(func.sum(Payment.amount), 0))
+        .select_from(Payment)
+        .outerjoin(Subscription, Subscription.id == Payment.subscription_id)
+        .group_by(platform_id, payment_plan, payment_status),
+    ))
+
+    # День выручки - дата подтверждения; у платежей до появления confirmed_at - начало подписки
+    revenue_day = func.coalesce(func.date(Payment.confirmed_at), Subscription.start_date)
+    conn.execute(insert(revenue_daily_table).from_select(
+        ["day", "platform_id", "plan_name", "payments", "amount"],
+        select(revenue_day, platform_id, payment_plan, func.count(), func.coalesce(func.sum(Payment.amount), 0))
+        .select_from(Payment)
+        .outerjoin(Subscription, Subscription.id == Payment.subscription_id)
+        .where(Payment.status == "confirmed", revenue_day.isnot(None))
+        .group_by(revenue_day, platform_id, payment_plan),
+    ))
@@ -0,0 +1,119 @@
+import logging
+import os
+
+from fastapi import HTTPException
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Subscription, BulkSubscriptionRequest
+from app.summaries import refresh_summaries
+
+logger = logging.getLogger(__name__)
+
+# Сколько подписок меняет один UPDATE; каждая пачка коммитится отдельно, как в проходе истечения
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Действие -> статус, из которого подписка может быть изменена
+BULK_ACTIONS = {
+    "cancel": "active",
+    "extend": "active",
+    "expire": "active",
+}
+
+
+def bulk_filters(action: str, request: BulkSubscriptionRequest) -> list:
+    conditions = []
+    if request.subscription_ids:
+        conditions.append(Subscription.id.in_(request.subscription_ids))
+    if request.user_id is not None:
+        conditions.append(Subscription.user_id == request.user_id)
+    if request.platform_id is not None:
+        conditions.append(Subscription.platform_id == request.platform_id)
+    if request.plan_name is not None:
+        conditions.append(Subscription.plan_name == request.plan_name)
+    # Без условий отбора изменилась бы вся таблица
+    if not conditions:
+        raise HTTPException(status_code=400, detail="Specify subscription_ids, user_id, platform_id or plan_name")
+    return conditions + [Subscription.status == BULK_ACTIONS[action]]
+
+
+def bulk_values(action: str, days: int, dialect_name: str) -> dict:
+    if action == "cancel":
+        return {"status": "cancelled"}
+    if action == "expire":
+        return {"status": "expired"}
+    # Продление считается в SQL: у PostgreSQL date + integer, у SQLite даты хранятся строками
+    if dialect_name == "postgresql":
+        return {"end_date": Subscription.end_date + days}
+    return {"end_date": func.date(Subscription.end_date, f"+{days} days")}
+
+
+async def count_matching(db: AsyncSession, conditions) -> int:
+    return await db.scalar(select(func.count()).select_from(Subscription).where(*conditions))
+
+
+async def update_chunk(db: AsyncSession, conditions, values: dict, last_id: int, chunk_size: int, dialect_name: str):
+    # Следующая пачка по возрастанию id; возвращает (id, user_id) измененных строк
+    chunk_ids = (
+        select(Subscription.id)
+        .where(*conditions, Subscription.id > last_id)
+        .order_by(Subscription.id)
+        .limit(chunk_size)
+    )
+    if dialect_name == "postgresql":
+        # Один UPDATE ... WHERE id IN (SELECT ... LIMIT n) RETURNING на пачку
+        result = await db.execute(
+            update(Subscription)
+            .where(Subscription.id.in_(chunk_ids.scalar_subquery()), *conditions)
+            .values(**values)
+            .returning(Subscription.id, Subscription.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        return result.all()
+
+    # SQLite (SQLAlchemy 1.4 без RETURNING): отбор пачки и UPDATE по ее id с той же проверкой статуса
+    rows = (await db.execute(
+        select(Subscription.id, Subscription.user_id)
+        .where(*conditions, Subscription.id > last_id)
+        .order_by(Subscription.id)
+        .limit(chunk_size)
+    )).all()
+    if rows:
+        await db.execute(
+            update(Subscription)
+            .where(Subscription.id.in_([row.id for row in rows]), *conditions)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+    return rows
+
+
+async def bulk_update_subscriptions(
+    db: AsyncSession, action: str, request: BulkSubscriptionRequest, chunk_size: int = BULK_CHUNK_SIZE
+) -> dict:
+    conditions = bulk_filters(action, request)
+    if request.dry_run:
+        matched = await count_matching(db, conditions)
+        await db.rollback()
+        return {"action": action, "dry_run": True, "matched": matched, "updated": 0, "users": 0, "chunks": 0}
+
+    dialect_name = (await db.connection()).dialect.name
+    values = bulk_values(action, request.days, dialect_name)
+    updated = 0
+    chunks = 0
+    users = set()
+    last_id = 0
+    while True:
+        rows = await update_chunk(db, conditions, values, last_id, chunk_size, dialect_name)
+        if not rows:
+            break
+        user_ids = {row.user_id for row in rows}
+        await refresh_summaries(db, user_ids)
+        await db.commit()
+        updated += len(rows)
+        chunks += 1
+        users |= user_ids
+        last_id = max(row.id for row in rows)
+
+    logger.info(f"Bulk {action}: {updated} subscriptions of {len(users)} users updated in {chunks} chunks")
+    return {"action": action, "dry_run": False, "matched": updated, "updated": updated, "users": len(users), "chunks": chunks}
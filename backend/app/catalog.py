@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from fastapi import Request
+from fastapi.responses import ORJSONResponse, Response
+from sqlalchemy import select, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal
+from app.models import Platform, Plan
+from app.replicas import replica_router
+
+# Как часто каждый процесс перечитывает каталог. Об изменениях воркеры узнают сразу через
+# pg_notify (LISTEN в app/payment_events.py); TTL - запасной путь, пока LISTEN не подключен
+CATALOG_TTL_SECONDS = int(os.getenv("CATALOG_TTL_SECONDS", "300"))
+CATALOG_CHANNEL = "catalog_changed"
+
+# Планы по умолчанию, которыми заполняется пустая таблица plans
+DEFAULT_PLANS = {
+    1: [
+        {"name": "Базовый", "price": 1000, "duration_days": 30, "description": "Основные функции управления облачными ресурсами."},
+        {"name": "Профессиональный", "price": 2000, "duration_days": 30, "description": "Расширенные функции, включая автоматизацию процессов."},
+        {"name": "Премиум", "price": 3000, "duration_days": 30, "description": "Все функции, приоритетная поддержка и аналитические отчеты."},
+    ],
+    2: [
+        {"name": "Стартовый", "price": 1500, "duration_days": 30, "description": "Базовые инструменты управления продажами."},
+        {"name": "Продвинутый", "price": 2500, "duration_days": 30, "description": "Дополнительные функции аналитики и интеграции."},
+        {"name": "Экспертный", "price": 4000, "duration_days": 30, "description": "Полный набор инструментов и персональная поддержка."},
+    ],
+    3: [
+        {"name": "Аналитик", "price": 2000, "duration_days": 30, "description": "Доступ к основным аналитическим данным."},
+        {"name": "Стратег", "price": 3500, "duration_days": 30, "description": "Расширенные данные и прогнозы."},
+        {"name": "Гуру", "price": 5000, "duration_days": 30, "description": "Полный доступ ко всем данным и индивидуальные отчеты."},
+    ],
+    4: [
+        {"name": "Команда", "price": 1200, "duration_days": 30, "description": "Основные функции управления проектами для небольших команд."},
+        {"name": "Бизнес", "price": 2500, "duration_days": 30, "description": "Расширенные функции для средних компаний."},
+        {"name": "Корпоративный", "price": 4000, "duration_days": 30, "description": "Полный функционал для крупных организаций."},
+    ],
+    5: [
+        {"name": "Рекрутер", "price": 1000, "duration_days": 30, "description": "Инструменты для найма и отслеживания кандидатов."},
+        {"name": "Менеджер", "price": 2000, "duration_days": 30, "description": "Дополнительные функции адаптации и обучения."},
+        {"name": "Директор", "price": 3500, "duration_days": 30, "description": "Полный спектр HR-инструментов и аналитики."},
+    ],
+}
+
+# Общий список планов для /plans (не зависит от БД)
+GENERIC_PLANS = [
+    {"id": 1, "name": "Basic", "price": 10, "duration_days": 30},
+    {"id": 2, "name": "Pro", "price": 20, "duration_days": 60},
+    {"id": 3, "name": "Premium", "price": 30, "duration_days": 90},
+]
+
+
+def make_etag(content) -> str:
+    digest = hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return etag in [value.strip().removeprefix("W/") for value in header.split(",")] or header.strip() == "*"
+
+
+def cached_json_response(request: Request, content, etag: str, cache_control: str) -> Response:
+    # 304 без тела, если у клиента (или nginx) уже есть эта версия
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(content, headers=headers)
+
+
+class CatalogSnapshot:
+    def __init__(self, platforms, plans_by_platform):
+        self.platforms = platforms
+        self.platforms_by_id = {platform["id"]: platform for platform in platforms}
+        self.plans_by_platform = plans_by_platform
+        self.etag = make_etag([platforms, plans_by_platform])
+        self.loaded_at = time.monotonic()
+
+
+class CatalogCache:
+    # Каталог платформ и планов в памяти процесса; версия каталога - его ETag
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._snapshot = None
+        self._lock = asyncio.Lock()
+        self._read_primary = False
+
+    def invalidate(self):
+        # После изменения каталога перечитываем с primary: реплика может еще не получить изменение
+        self._snapshot = None
+        self._read_primary = True
+
+    def _is_fresh(self) -> bool:
+        return self._snapshot is not None and time.monotonic() - self._snapshot.loaded_at < self.ttl
+
+    async def get(self) -> CatalogSnapshot:
+        if self._is_fresh():
+            return self._snapshot
+        async with self._lock:
+            if not self._is_fresh():
+                read_primary, self._read_primary = self._read_primary, False
+                self._snapshot = await self._load(read_primary)
+        return self._snapshot
+
+    async def _load(self, read_primary: bool = False) -> CatalogSnapshot:
+        session = AsyncSessionLocal() if read_primary else await replica_router.open_session()
+        async with session as db:
+            platforms = (await db.execute(
+                select(Platform.id, Platform.name, Platform.description, Platform.image_url).order_by(Platform.id)
+            )).all()
+            plans = (await db.execute(
+                select(Plan.platform_id, Plan.name, Plan.price, Plan.duration_days, Plan.description)
+                .order_by(Plan.platform_id, Plan.id)
+            )).all()
+
+        plans_by_platform = {}
+        for plan in plans:
+            plans_by_platform.setdefault(plan.platform_id, []).append({
+                "name": plan.name,
+                "price": plan.price,
+                "duration_days": plan.duration_days,
+                "description": plan.description,
+            })
+        return CatalogSnapshot([dict(platform._mapping) for platform in platforms], plans_by_platform)
+
+
+catalog_cache = CatalogCache(ttl=CATALOG_TTL_SECONDS)
+
+
+async def notify_catalog_changed(db: AsyncSession):
+    # В транзакции изменения каталога: остальные воркеры получат уведомление после коммита,
+    # текущий сбрасывает кэш сам (catalog_cache.invalidate после коммита)
+    if (await db.connection()).dialect.name == "postgresql":
+        await db.execute(text("SELECT pg_notify(:channel, '')"), {"channel": CATALOG_CHANNEL})
+
+
+async def seed_default_plans():
+    # Заполняем таблицу plans планами по умолчанию для существующих платформ
+    async with AsyncSessionLocal() as db:
+        if await db.scalar(select(func.count(Plan.id))):
+            return
+        platform_ids = set((await db.execute(select(Platform.id))).scalars().all())
+        for platform_id, plans in DEFAULT_PLANS.items():
+            if platform_id in platform_ids:
+                db.add_all(Plan(platform_id=platform_id, **plan) for plan in plans)
+        await notify_catalog_changed(db)
+        await db.commit()
+    catalog_cache.invalidate()
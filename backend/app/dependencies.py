@@ -1,18 +1,19 @@
+import logging
 from fastapi import HTTPException, Depends
 from jose import jwt, JWTError
-from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordBearer
-from app.database import get_db
-from app.models import User
+from app.models import TokenClaims
+from app.revocation import revocation_list
 
 SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-# Функция для декодирования токена
-def verify_token(token: str):
+logger = logging.getLogger(__name__)
+
+# Функция для декодирования токена (token_type: access или refresh)
+async def verify_token(token: str, token_type: str = "access"):
     try:
-        print(f"Verifying token: {token}")  # Логируем токен для отладки
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
         # Проверка наличия обязательных данных в payload
@@ -22,29 +23,35 @@ def verify_token(token: str):
 
         if email is None or role is None:
             raise HTTPException(status_code=403, detail="Could not validate credentials")
+        # Refresh-токен не принимается вместо access-токена и наоборот
+        if payload.get("type", "access") != token_type:
+            raise HTTPException(status_code=403, detail="Could not validate credentials")
+        # Отозванная сессия: проверка по фильтру в памяти; к БД - только если фильтр сработал
+        if await revocation_list.is_revoked(payload.get("sid")):
+            raise HTTPException(status_code=401, detail="Token has been revoked")
 
         return payload
     except JWTError as e:
-        print(f"JWTError: {str(e)}")  # Логируем ошибку
+        logger.info(f"JWT verification failed: {e}")  # Сам токен не логируем
         raise HTTPException(status_code=403, detail="Could not validate credentials")
 
-# Функция для получения текущего пользователя
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    # Используем функцию verify_token для извлечения данных из токена
-    print(f"Received token: {token}")
-    payload = verify_token(token)
-    username: str = payload.get("sub")  # Используем username (если он есть в токене)
-    if username is None:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    print(f"Looking for user with username: {username}")
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
-
+# Данные пользователя из проверенного токена, без обращения к БД
+async def get_token_claims(token: str = Depends(oauth2_scheme)) -> TokenClaims:
+    payload = await verify_token(token)
+    user_id = payload.get("user_id")
+    if user_id is None:
+        # Токен выпущен до появления user_id в payload
+        raise HTTPException(status_code=401, detail="Token is outdated, please log in again")
+    return TokenClaims(id=user_id, username=payload["sub"], role=payload["role"], session_id=payload.get("sid"))
+
+# Проверка роли только по данным токена
+def require_role(role: str):
+    def checker(current_user: TokenClaims = Depends(get_token_claims)) -> TokenClaims:
+        if current_user.role != role:
+            raise HTTPException(status_code=403, detail="You don't have permission to access this resource")
+        return current_user
+    return checker
 
 # Функция для получения информации о текущем пользователе
-def get_current_user_info(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user = get_current_user(db=db, token=token)
-    return {"username": user.username, "role": user.role}
+def get_current_user_info(current_user: TokenClaims = Depends(get_token_claims)):
+    return {"username": current_user.username, "role": current_user.role}
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal, upsert
+from app.idempotency import purge_expired_keys
+from app.logging_config import setup_logging
+from app.models import ExpiryStats, Subscription
+from app.outbox import purge_processed_events
+from app.revocation import purge_expired_revocations
+from app.summaries import refresh_summaries
+
+logger = logging.getLogger(__name__)
+
+# Настройки движка истечения подписок
+EXPIRY_INTERVAL_SECONDS = int(os.getenv("EXPIRY_INTERVAL_SECONDS", "300"))
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "1000"))
+EXPIRY_SCHEDULER_ENABLED = os.getenv("EXPIRY_SCHEDULER_ENABLED", "1") == "1"
+
+# Итоги проходов хранятся в expiry_stats: проход выполняет сервис saas_expiry, а метрики
+# отдают воркеры API. Словарь - последние прочитанные из БД значения (load_expiry_metrics)
+expiry_metrics = {
+    "sweeps_total": 0,
+    "expired_total": 0,
+    "last_sweep_expired": 0,
+    "last_sweep_batches": 0,
+    "last_sweep_duration_seconds": 0.0,
+    "last_sweep_at": None,
+    "errors_total": 0,
+}
+
+expiry_stats_table = ExpiryStats.__table__
+EXPIRY_STATS_ID = 1
+
+
+async def record_sweep(db: AsyncSession, expired: int = 0, batches: int = 0, duration: float = 0.0,
+                       failed: bool = False):
+    # Счетчики прибавляются к строке expiry_stats; поля последнего прохода - только после успешного
+    row = {"id": EXPIRY_STATS_ID, "sweeps_total": 0, "expired_total": 0, "errors_total": 0,
+           "last_sweep_expired": 0, "last_sweep_batches": 0, "last_sweep_duration_seconds": 0.0}
+    if failed:
+        row["errors_total"] = 1
+        update_columns = ()
+    else:
+        row.update(sweeps_total=1, expired_total=expired, last_sweep_expired=expired, last_sweep_batches=batches,
+                   last_sweep_duration_seconds=duration, last_sweep_at=datetime.utcnow())
+        update_columns = ("last_sweep_expired", "last_sweep_batches", "last_sweep_duration_seconds", "last_sweep_at")
+    await db.execute(upsert(
+        (await db.connection()).dialect.name, expiry_stats_table, [row], ["id"],
+        update_columns=update_columns, increment_columns=("sweeps_total", "expired_total", "errors_total"),
+    ))
+    await db.commit()
+
+
+async def load_expiry_metrics(db: AsyncSession) -> dict:
+    row = (await db.execute(select(expiry_stats_table).where(expiry_stats_table.c.id == EXPIRY_STATS_ID))).first()
+    if row is not None:
+        expiry_metrics.update({name: row._mapping[name] for name in expiry_metrics})
+        last_sweep_at = expiry_metrics["last_sweep_at"]
+        expiry_metrics["last_sweep_at"] = last_sweep_at.isoformat() if last_sweep_at else None
+    return expiry_metrics
+
+
+async def expire_due_subscriptions(db: AsyncSession, today=None, batch_size: int = EXPIRY_BATCH_SIZE) -> int:
+    # Переводим просроченные активные подписки в "expired" пачками.
+    # Каждый UPDATE затрагивает не больше batch_size строк и коммитится отдельно,
+    # чтобы не держать блокировки на всей таблице. Отбор идет по индексу (status, end_date).
+    # Сводки затронутых пользователей пересчитываются в той же транзакции.
+    today = today or datetime.utcnow().date()
+    expired = 0
+    batches = 0
+    while True:
+        due = (await db.execute(
+            select(Subscription.id, Subscription.user_id)
+            .where(Subscription.status == "active", Subscription.end_date < today)
+            .limit(batch_size)
+        )).all()
+        if not due:
+            break
+        result = await db.execute(
+            update(Subscription)
+            .where(Subscription.id.in_([row.id for row in due]), Subscription.status == "active")
+            .values(status="expired")
+            .execution_options(synchronize_session=False)
+        )
+        await refresh_summaries(db, [row.user_id for row in due])
+        await db.commit()
+        batches += 1
+        expired += result.rowcount
+        if len(due) < batch_size:
+            break
+
+    return expired, batches
+
+
+async def run_expiry_sweep() -> int:
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        try:
+            expired, batches = await expire_due_subscriptions(db)
+            # Заодно удаляем устаревшие ключи идемпотентности, обработанные события outbox
+            # и истекшие записи отзыва токенов (воркеры API их только читают)
+            await purge_expired_keys(db)
+            purged = await purge_processed_events(db)
+            if purged:
+                logger.info(f"Purged {purged} processed outbox events")
+            purged = await purge_expired_revocations(db)
+            if purged:
+                logger.info(f"Purged {purged} expired revoked tokens and sessions")
+        except Exception:
+            await db.rollback()
+            logger.exception("Subscription expiry sweep failed")
+            try:
+                await record_sweep(db, failed=True)
+            except Exception:
+                logger.exception("Failed to record expiry sweep error")
+            raise
+
+        duration = round(time.perf_counter() - started, 4)
+        await record_sweep(db, expired, batches, duration)
+        await load_expiry_metrics(db)
+    logger.info(f"Expiry sweep finished: {expired} subscriptions expired", extra={
+        "expired": expired, "batches": batches, "duration_seconds": duration,
+    })
+    return expired
+
+
+async def run_expiry_scheduler(interval: int = EXPIRY_INTERVAL_SECONDS):
+    # Фоновая задача внутри процесса приложения: первый проход сразу при старте
+    while True:
+        try:
+            await run_expiry_sweep()
+        except Exception:
+            pass  # ошибка уже залогирована, пробуем на следующем проходе
+        await asyncio.sleep(interval)
+
+
+def main():
+    # Отдельный воркер: python -m app.expiry
+    setup_logging()
+    asyncio.run(run_expiry_scheduler())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from app.metrics import Gauge, password_hash_seconds, password_hash_wait_seconds, registry, snapshot
+
+# Инициализация CryptContext для хэширования пароля.
+# sha256_crypt оставлен для старых хэшей: они помечаются устаревшими и перехэшируются при входе.
+pwd_context = CryptContext(schemes=["bcrypt", "sha256_crypt"], deprecated="auto")
+
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "64"))
+
+
+class PasswordHasher:
+    # Выполняет bcrypt в отдельном пуле потоков (bcrypt отпускает GIL, поэтому потоки
+    # масштабируются по ядрам) и ограничивает очередь: при переполнении отвечает 503.
+    def __init__(self, workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _run(self, operation: str, fn, *args):
+        if self._pending >= self.max_pending:
+            raise HTTPException(status_code=503, detail="Server is busy, please retry later", headers={"Retry-After": "1"})
+        self._pending += 1
+        submitted = time.perf_counter()
+
+        def timed():
+            # Ожидание свободного потока и само хэширование измеряются отдельно
+            started = time.perf_counter()
+            password_hash_wait_seconds.observe(operation, value=started - submitted)
+            try:
+                return fn(*args)
+            finally:
+                password_hash_seconds.observe(operation, value=time.perf_counter() - started)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", pwd_context.hash, password)
+
+    async def verify_and_update(self, password: str, password_hash: str):
+        # Возвращает (пароль верный, новый хэш или None, если перехэширование не нужно)
+        return await self._run("verify", pwd_context.verify_and_update, password, password_hash)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher(workers=HASH_WORKERS, max_pending=HASH_QUEUE_SIZE)
+
+registry.add_collector(lambda: [
+    snapshot(Gauge, "password_hash_pending", "Hash/verify calls queued or running", {None: password_hasher.pending}),
+])
@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import IdempotencyKey
+
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+MAX_KEY_LENGTH = 255
+
+
+def validate_key(key: Optional[str]) -> Optional[str]:
+    if key is not None and not 0 < len(key) <= MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key header")
+    return key
+
+
+def request_fingerprint(*parts) -> str:
+    # Отпечаток параметров запроса: тот же ключ с другими параметрами - ошибка клиента, а не повтор
+    payload = json.dumps(jsonable_encoder(parts), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def get_stored_response(db: AsyncSession, scope: str, key: Optional[str], user_id: Optional[int] = None,
+                              request_hash: Optional[str] = None):
+    # Сохраненный ответ на запрос с тем же ключом; None, если ключа нет или он не передан
+    if key is None:
+        return None
+    result = await db.execute(
+        select(IdempotencyKey.response, IdempotencyKey.user_id, IdempotencyKey.request_hash)
+        .where(IdempotencyKey.key == key, IdempotencyKey.scope == scope)
+    )
+    stored = result.first()
+    if stored is None:
+        return None
+    if stored.user_id != user_id:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was used by another user")
+    if stored.request_hash is not None and stored.request_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was used with a different request")
+    return stored.response
+
+
+async def commit_with_key(db: AsyncSession, scope: str, key: Optional[str], response: dict, user_id: Optional[int] = None,
+                          request_hash: Optional[str] = None):
+    # Ключ записывается в той же транзакции, что и изменения. Если параллельный запрос
+    # с тем же ключом успел закоммитить раньше, наша транзакция откатывается целиком
+    # и возвращается его ответ.
+    response = jsonable_encoder(response)
+    if key is not None:
+        db.add(IdempotencyKey(key=key, scope=scope, user_id=user_id, request_hash=request_hash, response=response))
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        stored = await get_stored_response(db, scope, key, user_id, request_hash)
+        if stored is None:
+            raise
+        return stored
+    return response
+
+
+async def purge_expired_keys(db: AsyncSession) -> int:
+    cutoff = datetime.utcnow() - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+    result = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff))
+    await db.commit()
+    return result.rowcount
@@ -0,0 +1,80 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+
+# Активные счетчики; в тестах обычно один, поэтому список без блокировок
+_active_counters = []
+
+
+class RequestDbStats:
+    # SQL-запросы и время в БД в рамках одного HTTP-запроса (заполняется хуками ниже)
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+request_db_stats: ContextVar = ContextVar("request_db_stats", default=None)
+
+# Итоги по процессу: origin -> [число запросов, секунды]; background - фоновое истечение, старт и т.п.
+db_statement_totals = {"request": [0, 0.0], "background": [0, 0.0]}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    for counter in _active_counters:
+        counter.count += 1
+        counter.statements.append(statement)
+    # Время старта хранится на контексте выполнения: упавший запрос не оставляет его в соединении
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started
+    stats = request_db_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+    totals = db_statement_totals["request" if stats is not None else "background"]
+    totals[0] += 1
+    totals[1] += elapsed
+
+
+@contextmanager
+def count_queries():
+    # Считает SQL-запросы ко всем движкам приложения внутри блока:
+    #   with count_queries() as queries:
+    #       client.get("/api/subscriptions/active", headers=headers)
+    #   assert queries.count == 1
+    counter = QueryCounter()
+    _active_counters.append(counter)
+    try:
+        yield counter
+    finally:
+        _active_counters.remove(counter)
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    # Падает, если внутри блока выполнено больше limit запросов (например, из-за ленивой загрузки)
+    with count_queries() as counter:
+        yield counter
+    if counter.count > limit:
+        statements = "\n".join(counter.statements)
+        raise AssertionError(f"Expected at most {limit} queries, got {counter.count}:\n{statements}")
+
+
+def install_query_hooks(*engines):
+    for target in engines:
+        target = getattr(target, "sync_engine", target)
+        if not event.contains(target, "before_cursor_execute", _before_cursor_execute):
+            event.listen(target, "before_cursor_execute", _before_cursor_execute)
+            event.listen(target, "after_cursor_execute", _after_cursor_execute)
+
@@ -0,0 +1,205 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+# Настройки логирования (все процессы: API, воркеры, миграции)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Доля запросов, для которых пишутся INFO/DEBUG-записи: "/api/subscriptions/active=0.1,/api/auth=1"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_DEFAULT_SAMPLE_RATE = float(os.getenv("LOG_DEFAULT_SAMPLE_RATE", "1.0"))
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+# Контекст текущего запроса (задается middleware, читается фильтрами)
+request_id_var: ContextVar = ContextVar("request_id", default=None)
+sampled_var: ContextVar = ContextVar("log_sampled", default=True)
+
+# Стандартные атрибуты LogRecord; все остальные (extra=...) попадают в JSON как поля
+RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id", "color_message"}
+
+# Bearer-токены, JWT и токены в query string не должны попадать в логи
+REDACT_PATTERNS = [
+    (re.compile(r"(?i)(bearer\s+)[A-Za-z0-9\-_.~+/]+=*"), r"\1[REDACTED]"),
+    (re.compile(r"eyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*"), "[REDACTED_JWT]"),
+    (re.compile(r"(?i)(token|password)(['\"]?\s*[=:]\s*['\"]?)[^\s&'\",}]+"), r"\1\2[REDACTED]"),
+]
+
+
+def redact(value: str) -> str:
+    for pattern, replacement in REDACT_PATTERNS:
+        value = pattern.sub(replacement, value)
+    return value
+
+
+def parse_sample_rates(spec: str) -> dict:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        prefix, _, rate = item.partition("=")
+        rates[prefix.strip()] = float(rate)
+    return rates
+
+
+class RouteSampler:
+    # Решение о семплировании принимается один раз на запрос по самому длинному префиксу пути
+    def __init__(self, rates: dict, default: float):
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+        self.default = default
+
+    def rate_for(self, path: str) -> float:
+        for prefix, rate in self.rates:
+            if path.startswith(prefix):
+                return rate
+        return self.default
+
+    def should_sample(self, path: str) -> bool:
+        rate = self.rate_for(path)
+        return rate >= 1.0 or random.random() < rate
+
+
+class ContextFilter(logging.Filter):
+    # Добавляет request_id, отбрасывает несемплированные INFO/DEBUG и маскирует секреты.
+    # Работает в вызывающей задаче, до постановки записи в очередь
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and not sampled_var.get():
+            return False
+        record.request_id = request_id_var.get()
+        record.msg = redact(record.getMessage())
+        record.args = None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = redact(self.formatException(record.exc_info))
+        elif record.exc_text:
+            entry["exc_info"] = redact(record.exc_text)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    # При переполнении очереди запись отбрасывается, а не блокирует обработчик запроса
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Трейсбек превращаем в текст здесь: объекты исключения не передаются в поток-слушатель
+        record = logging.makeLogRecord(vars(record))
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+_listener = None
+sampler = RouteSampler(parse_sample_rates(LOG_SAMPLE_RATES), LOG_DEFAULT_SAMPLE_RATE)
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    # Все записи идут через очередь; запись в stdout делает отдельный поток QueueListener
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    # Логи uvicorn идут через тот же обработчик; access-лог пишет RequestContextMiddleware
+    for name in ("uvicorn", "uvicorn.error"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+    logging.getLogger("uvicorn.access").disabled = True
+
+    _listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    # Дописываем оставшиеся в очереди записи
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+access_logger = logging.getLogger("app.access")
+
+
+class RequestContextMiddleware:
+    # ASGI middleware: request_id (из X-Request-ID или новый), семплирование по маршруту и строка access-лога
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        path = scope["path"]
+        id_token = request_id_var.set(request_id)
+        sampled_token = sampled_var.set(sampler.should_sample(path))
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(REQUEST_ID_HEADER, request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            duration_ms = round((time.perf_counter() - started) * 1000, 3)
+            level = logging.ERROR if status_code >= 500 else logging.INFO
+            access_logger.log(level, f"{scope['method']} {path} {status_code}", extra={
+                "method": scope["method"],
+                "path": path,
+                "status": status_code,
+                "duration_ms": duration_ms,
+            })
+            sampled_var.reset(sampled_token)
+            request_id_var.reset(id_token)
@@ -1,15 +1,34 @@
+import asyncio
+import contextlib
 from app.routers import auth
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import payments, subscriptions
-from app.database import Base, engine
+from app.routers import payments, subscriptions, internal, analytics
+from app.database import engine, async_engine
+from app.expiry import EXPIRY_SCHEDULER_ENABLED, run_expiry_scheduler
+from app.hashing import password_hasher
+from app.outbox import OUTBOX_WORKER_ENABLED, run_outbox_worker
+from app.payment_events import listen_enabled, run_payment_listener
+from app.instrumentation import install_query_hooks
+from app.logging_config import setup_logging, shutdown_logging, RequestContextMiddleware
+from app.metrics import MetricsMiddleware, metrics_endpoint
+from app.ratelimit import RateLimitMiddleware
+from app.replicas import replica_router
+from app.revocation import REVOCATION_SYNC_ENABLED, load_revocation_list, run_revocation_sync
+from app.models import MessageResponse
 
-# Пересоздаем таблицы
-Base.metadata.create_all(bind=engine)
-print("База данных и таблицы успешно созданы.")
+# Структурные JSON-логи через неблокирующую очередь (LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES)
+setup_logging()
 
-app = FastAPI()
+# Счетчик SQL-запросов (используется в тестах и метриках)
+install_query_hooks(engine, async_engine, *(replica.engine for replica in replica_router.replicas))
 
+# Ответы сериализуются через orjson (модели ответов уже приводят данные к JSON-типам)
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Корзины токенов на IP и на аккаунт для входа и регистрации (429 до bcrypt и запросов к БД)
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://176.108.250.41"],  # Указываем домен фронтенда
@@ -17,10 +36,95 @@ app.add_middleware(
     allow_methods=["*"],  # Разрешаем все методы
     allow_headers=["*"],  # Разрешаем все заголовки
 )
-@app.get("/")
+# request_id, семплирование логов по маршруту и access-лог
+app.add_middleware(RequestContextMiddleware)
+# Метрики по маршрутам: счетчики, латентность, SQL-запросы и время в БД на запрос
+app.add_middleware(MetricsMiddleware)
+
+# Проверка здоровья и отставания реплик для чтения (REPLICA_DATABASE_URLS)
+@app.on_event("startup")
+async def start_replica_router():
+    await replica_router.start()
+
+# Список отозванных сессий загружается до приема запросов, затем дочитывается в фоне.
+# Загрузка идет до запуска остальных фоновых задач, чтобы не конкурировать с ними за первое соединение
+@app.on_event("startup")
+async def start_revocation_sync():
+    await load_revocation_list()
+    if REVOCATION_SYNC_ENABLED:
+        app.state.revocation_task = asyncio.create_task(run_revocation_sync())
+
+@app.on_event("shutdown")
+async def stop_revocation_sync():
+    task = getattr(app.state, "revocation_task", None)
+    if task:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+# Фоновое истечение подписок (можно отключить и запускать отдельно: python -m app.expiry)
+@app.on_event("startup")
+async def start_expiry_scheduler():
+    if EXPIRY_SCHEDULER_ENABLED:
+        app.state.expiry_task = asyncio.create_task(run_expiry_scheduler())
+
+@app.on_event("shutdown")
+async def stop_expiry_scheduler():
+    task = getattr(app.state, "expiry_task", None)
+    if task:
+        task.cancel()
+
+# Воркер outbox внутри процесса (в продакшене - отдельный сервис: python -m app.outbox)
+@app.on_event("startup")
+async def start_outbox_worker():
+    if OUTBOX_WORKER_ENABLED:
+        app.state.outbox_task = asyncio.create_task(run_outbox_worker())
+
+@app.on_event("shutdown")
+async def stop_outbox_worker():
+    # Дожидаемся отмены, чтобы воркер не остался посреди транзакции к моменту закрытия пула
+    task = getattr(app.state, "outbox_task", None)
+    if task:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+# LISTEN на статусы платежей для SSE-подписчиков этого процесса (только PostgreSQL)
+@app.on_event("startup")
+async def start_payment_listener():
+    if listen_enabled():
+        app.state.payment_listener_task = asyncio.create_task(run_payment_listener())
+
+@app.on_event("shutdown")
+async def stop_payment_listener():
+    task = getattr(app.state, "payment_listener_task", None)
+    if task:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+@app.on_event("shutdown")
+def stop_password_hasher():
+    password_hasher.shutdown()
+
+@app.on_event("shutdown")
+async def close_db_connections():
+    await replica_router.stop()
+    await async_engine.dispose()
+
+@app.on_event("shutdown")
+def stop_logging():
+    shutdown_logging()
+
+@app.get("/", response_model=MessageResponse)
 def read_root():
     return {"message": "Hello World"}
 
+# Метрики процесса в формате Prometheus
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 app.include_router(auth.router, prefix="/api/auth")
 app.include_router(subscriptions.router, prefix="/api/subscriptions", tags=["subscriptions"])
-app.include_router(payments.router, prefix="/api/payments")
\ No newline at end of file
+app.include_router(payments.router, prefix="/api/payments")
+app.include_router(internal.router, prefix="/api/internal", tags=["internal"])
+app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
@@ -0,0 +1,278 @@
+import logging
+import threading
+import time
+
+from starlette.responses import Response
+from starlette.routing import Match
+
+from app.database import AsyncSessionLocal, async_engine, pool_metrics
+from app.expiry import expiry_metrics, load_expiry_metrics
+from app.instrumentation import RequestDbStats, request_db_stats, db_statement_totals
+from app.logging_config import NonBlockingQueueHandler
+from app.outbox import outbox_metrics
+from app.replicas import replica_router
+
+logger = logging.getLogger(__name__)
+
+# Простой реестр метрик в текстовом формате Prometheus (без внешних зависимостей).
+# Метрики процесса: при нескольких воркерах каждый отдает свои значения.
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, *labels, value: float):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self._values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.labelnames, labels, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            base = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{base} {_format_value(total)}")
+            lines.append(f"{self.name}_count{base} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def add_collector(self, collector):
+        # collector() -> список метрик, значения которых читаются в момент запроса /metrics
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for metric in collector():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests_total = registry.counter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status"))
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_requests_in_progress = registry.gauge(
+    "http_requests_in_progress", "HTTP requests currently being processed", ("method", "route"))
+http_request_db_queries = registry.histogram(
+    "http_request_db_queries", "SQL statements executed per HTTP request", ("method", "route"), buckets=QUERY_COUNT_BUCKETS)
+http_request_db_seconds = registry.histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per HTTP request", ("method", "route"))
+password_hash_seconds = registry.histogram(
+    "password_hash_seconds", "bcrypt hash/verify time in the hasher pool", ("operation",), buckets=HASH_BUCKETS)
+password_hash_wait_seconds = registry.histogram(
+    "password_hash_wait_seconds", "Time a hash/verify call waited for a free hasher thread", ("operation",))
+rate_limited_requests_total = registry.counter(
+    "rate_limited_requests_total", "Requests rejected with 429 by the login/register rate limiter", ("rule", "limit"))
+
+
+def snapshot(metric_class, name: str, documentation: str, values: dict, labelname: str = None):
+    # Метрика, собранная из уже существующих счетчиков процесса в момент запроса /metrics
+    metric = metric_class(name, documentation, (labelname,) if labelname else ())
+    for label, value in values.items():
+        metric._values[(label,) if labelname else ()] = value
+    return metric
+
+
+def collect_process_metrics():
+    pool = pool_metrics.snapshot(async_engine.pool)
+    metrics = [
+        snapshot(Counter, "db_queries_total", "SQL statements by origin (request or background: expiry sweep, startup)",
+                 {origin: totals[0] for origin, totals in db_statement_totals.items()}, "origin"),
+        snapshot(Counter, "db_query_seconds_total", "Time spent in SQL statements by origin",
+                 {origin: totals[1] for origin, totals in db_statement_totals.items()}, "origin"),
+        snapshot(Counter, "db_pool_waits_total", "Connections taken from the pool", {None: pool["waits_total"]}),
+        snapshot(Counter, "db_pool_timeouts_total", "Pool checkout timeouts", {None: pool["timeouts_total"]}),
+        snapshot(Gauge, "db_pool_wait_seconds_max", "Longest pool checkout wait", {None: pool["wait_ms_max"] / 1000}),
+        # Итоги истечения общие для всех процессов: читаются из expiry_stats перед отдачей /metrics
+        snapshot(Counter, "expiry_sweeps_total", "Subscription expiry sweeps", {None: expiry_metrics["sweeps_total"]}),
+        snapshot(Counter, "expiry_expired_total", "Subscriptions expired by sweeps", {None: expiry_metrics["expired_total"]}),
+        snapshot(Counter, "expiry_errors_total", "Failed expiry sweeps", {None: expiry_metrics["errors_total"]}),
+        snapshot(Gauge, "expiry_last_sweep_duration_seconds", "Duration of the last expiry sweep",
+                 {None: expiry_metrics["last_sweep_duration_seconds"] or 0.0}),
+        snapshot(Counter, "outbox_events_processed_total", "Outbox events handled by this process",
+                 {None: outbox_metrics["processed_total"]}),
+        snapshot(Counter, "outbox_events_retried_total", "Outbox event attempts that failed and were rescheduled",
+                 {None: outbox_metrics["retried_total"]}),
+        snapshot(Counter, "outbox_events_failed_total", "Outbox events that exhausted their attempts",
+                 {None: outbox_metrics["failed_total"]}),
+        snapshot(Counter, "outbox_events_released_total", "Claimed outbox events returned to the queue before their lease ran out",
+                 {None: outbox_metrics["released_total"]}),
+        snapshot(Counter, "analytics_rollup_deltas_folded_total", "Analytics deltas folded into rollups by this process",
+                 {None: outbox_metrics["rollup_deltas_folded_total"]}),
+        snapshot(Counter, "log_records_dropped_total", "Log records dropped because the log queue was full",
+                 {None: NonBlockingQueueHandler.dropped}),
+    ]
+    replicas = replica_router.snapshot()
+    metrics.extend([
+        snapshot(Counter, "db_read_sessions_total", "Read-only sessions opened via the replica router",
+                 {None: replicas["reads_total"]}),
+        snapshot(Counter, "db_replica_fallbacks_total", "Read sessions sent to the primary because no replica was usable",
+                 {None: replicas["fallbacks_total"]}),
+        snapshot(Gauge, "db_replica_usable", "1 if the replica is healthy and within the lag limit",
+                 {replica["name"]: int(replica["usable"]) for replica in replicas["replicas"]}, "replica"),
+        snapshot(Gauge, "db_replica_lag_seconds", "Replication lag from the last health check",
+                 {replica["name"]: replica["lag_seconds"] for replica in replicas["replicas"]
+                  if replica["lag_seconds"] is not None}, "replica"),
+    ])
+    if "checked_out" in pool:
+        metrics.append(snapshot(Gauge, "db_pool_checked_out", "Connections currently checked out", {None: pool["checked_out"]}))
+    return metrics
+
+
+registry.add_collector(collect_process_metrics)
+
+
+def resolve_route(scope) -> str:
+    # Шаблон маршрута (/api/subscriptions/{user_id}), а не сырой путь - иначе метки неограниченны
+    app = scope.get("app")
+    router = getattr(app, "router", None)
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    # ASGI middleware: счетчики, латентность, запросы в работе и SQL-статистика по маршрутам
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        route = resolve_route(scope)
+        stats = RequestDbStats()
+        stats_token = request_db_stats.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_progress.inc(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_progress.dec(method, route)
+            http_request_duration_seconds.observe(method, route, value=time.perf_counter() - started)
+            http_requests_total.inc(method, route, str(status_code))
+            http_request_db_queries.observe(method, route, value=stats.queries)
+            http_request_db_seconds.observe(method, route, value=stats.seconds)
+            request_db_stats.reset(stats_token)
+
+
+async def metrics_endpoint(request):
+    try:
+        async with AsyncSessionLocal() as db:
+            await load_expiry_metrics(db)
+    except Exception as e:
+        # Без БД отдаются метрики процесса и последние прочитанные итоги истечения
+        logger.warning(f"Failed to load expiry stats for /metrics: {e}")
+    return Response(registry.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,98 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select, text
+
+from app.database import engine
+from app.migrations import (
+    m0001_baseline,
+    m0002_payment_public_token,
+    m0003_hot_query_indexes,
+    m0004_idempotency_keys,
+    m0005_subscription_summaries,
+    m0006_outbox_events,
+    m0007_analytics_rollups,
+    m0008_token_revocation,
+    m0009_analytics_rollup_deltas,
+    m0010_outbox_retention_index,
+    m0011_idempotency_request_hash,
+    m0012_expiry_stats,
+)
+
+logger = logging.getLogger(__name__)
+
+# Версионированные миграции схемы, применяются по порядку ровно один раз.
+# Модуль миграции задает VERSION, DESCRIPTION, upgrade(conn) и, при необходимости,
+# TRANSACTIONAL = False (например, для CREATE INDEX CONCURRENTLY в PostgreSQL).
+MIGRATIONS = [
+    m0001_baseline,
+    m0002_payment_public_token,
+    m0003_hot_query_indexes,
+    m0004_idempotency_keys,
+    m0005_subscription_summaries,
+    m0006_outbox_events,
+    m0007_analytics_rollups,
+    m0008_token_revocation,
+    m0009_analytics_rollup_deltas,
+    m0010_outbox_retention_index,
+    m0011_idempotency_request_hash,
+    m0012_expiry_stats,
+]
+
+# Ключ advisory-блокировки, чтобы миграции не запускались параллельно из нескольких процессов
+MIGRATION_LOCK_ID = 724011
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def applied_versions(bind=engine) -> set:
+    metadata.create_all(bind=bind)
+    with bind.connect() as conn:
+        return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def run_migrations(bind=engine):
+    is_postgres = bind.dialect.name == "postgresql"
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        if is_postgres:
+            lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            done = applied_versions(bind)
+            for migration in MIGRATIONS:
+                if migration.VERSION in done:
+                    continue
+                logger.info(f"Applying migration {migration.VERSION}: {migration.DESCRIPTION}")
+                _apply(bind, migration)
+        finally:
+            if is_postgres:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+
+def _apply(bind, migration):
+    record = schema_migrations.insert().values(
+        version=migration.VERSION,
+        description=migration.DESCRIPTION,
+        applied_at=datetime.utcnow(),
+    )
+    if getattr(migration, "TRANSACTIONAL", True):
+        with bind.begin() as conn:
+            migration.upgrade(conn)
+            conn.execute(record)
+    else:
+        # Миграция без транзакции должна быть идемпотентной: при сбое ее запустят повторно
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            migration.upgrade(conn)
+            conn.execute(record)
+
+
+def status(bind=engine):
+    done = applied_versions(bind)
+    return [(migration.VERSION, migration.DESCRIPTION, migration.VERSION in done) for migration in MIGRATIONS]
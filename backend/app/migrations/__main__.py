@@ -0,0 +1,53 @@
+# Применение миграций: python -m app.migrations [upgrade|status|backfill-analytics]
+# Выполняется один раз перед запуском воркеров приложения (сервис saas_migrate в docker-compose)
+import asyncio
+import sys
+
+from sqlalchemy import text
+
+from app.analytics import rebuild_rollups, rollup_deltas_table
+from app.catalog import seed_default_plans
+from app.database import engine
+from app.logging_config import setup_logging, shutdown_logging
+from app.migrations import run_migrations, status
+from app.summaries import rebuild_summaries
+
+
+def backfill_analytics(bind=engine):
+    # Пересчет сводок и сводных таблиц аналитики по истории в одной транзакции.
+    # В PostgreSQL запись сводок блокируется до снимка REPEATABLE READ: сводки и сводные
+    # таблицы считаются по одному снимку, а приращения после коммита ложатся поверх них
+    with bind.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        with conn.begin():
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("LOCK TABLE subscription_summaries IN EXCLUSIVE MODE"))
+            rebuild_summaries(conn)
+            rebuild_rollups(conn)
+            # Несвернутые приращения из снимка уже учтены в пересчитанных таблицах
+            conn.execute(rollup_deltas_table.delete())
+
+
+def main():
+    setup_logging()
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    try:
+        if command == "upgrade":
+            run_migrations()
+            # Планы по умолчанию для пустой таблицы plans
+            asyncio.run(seed_default_plans())
+        elif command == "backfill-analytics":
+            backfill_analytics()
+        elif command == "status":
+            for version, description, applied in status():
+                print(f"{version:04d} {'applied' if applied else 'pending':8} {description}")
+        else:
+            raise SystemExit(f"Unknown command: {command}")
+    finally:
+        # Дописываем логи из очереди перед выходом
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+from sqlalchemy import text
+
+# Общие операции со схемой для миграций. Таблицы и индексы миграции описывают сами
+# (замороженные копии на момент миграции), а не берут из app.models.
+
+
+def create_index(conn, index):
+    # Индексы с postgresql_concurrently=True создаются в миграциях с TRANSACTIONAL = False.
+    # Прерванный CREATE INDEX CONCURRENTLY оставляет индекс INVALID: он есть в каталоге,
+    # checkfirst его пропускает, но планировщик его не использует - такой индекс пересоздается
+    if conn.dialect.name == "postgresql":
+        invalid = conn.execute(
+            text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+            {"name": index.name},
+        ).scalar()
+        if invalid:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+    index.create(bind=conn, checkfirst=True)
@@ -0,0 +1,66 @@
+from sqlalchemy import Column, Date, ForeignKey, Integer, MetaData, String, Table
+
+VERSION = 1
+DESCRIPTION = "baseline schema (users, platforms, plans, subscriptions, payments)"
+
+# Схема на момент миграции; дальнейшие изменения таблиц - в следующих миграциях
+metadata = MetaData()
+
+Table(
+    "users",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String, unique=True, index=True),
+    Column("email", String, unique=True, index=True),
+    Column("password_hash", String),
+    Column("role", String),
+)
+
+Table(
+    "platforms",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, nullable=False),
+    Column("description", String, nullable=False),
+    Column("image_url", String, nullable=False),
+)
+
+Table(
+    "plans",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("platform_id", Integer, ForeignKey("platforms.id"), nullable=False, index=True),
+    Column("name", String, nullable=False),
+    Column("price", Integer, nullable=False),
+    Column("duration_days", Integer, nullable=False),
+    Column("description", String, nullable=False),
+)
+
+Table(
+    "subscriptions",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("plan_name", String),
+    Column("start_date", Date),
+    Column("end_date", Date),
+    Column("status", String),
+    Column("platform_id", Integer, ForeignKey("platforms.id")),
+)
+
+Table(
+    "payments",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("public_token", String, unique=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("subscription_id", Integer, ForeignKey("subscriptions.id")),
+    Column("plan_name", String, nullable=False),
+    Column("amount", Integer, nullable=False),
+    Column("status", String),
+)
+
+
+def upgrade(conn):
+    # Существующие таблицы (созданные раньше через create_all) не трогаются
+    metadata.create_all(bind=conn)
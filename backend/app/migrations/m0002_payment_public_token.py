@@ -0,0 +1,18 @@
+from sqlalchemy import text
+
+VERSION = 2
+DESCRIPTION = "payments.public_token and payments_id_seq past legacy random ids"
+
+
+def upgrade(conn):
+    if conn.dialect.name != "postgresql":
+        return  # в новых базах колонка уже создана базовой миграцией
+
+    conn.execute(text("ALTER TABLE payments ADD COLUMN IF NOT EXISTS public_token VARCHAR"))
+    conn.execute(text("UPDATE payments SET public_token = md5(random()::text || id::text) WHERE public_token IS NULL"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_payments_public_token ON payments (public_token)"))
+    # Раньше id были случайными: сдвигаем последовательность за максимальный существующий id
+    conn.execute(text(
+        "SELECT setval('payments_id_seq', GREATEST((SELECT COALESCE(MAX(id), 1) FROM payments), "
+        "(SELECT last_value FROM payments_id_seq)))"
+    ))
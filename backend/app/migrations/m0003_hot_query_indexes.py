@@ -0,0 +1,51 @@
+from sqlalchemy import Column, Date, Index, Integer, MetaData, String, Table, text
+
+from app.migrations.ddl import create_index
+
+VERSION = 3
+DESCRIPTION = "composite and partial indexes for subscription and payment lookups"
+
+# Индексы строятся CONCURRENTLY, чтобы не блокировать запись в большие таблицы
+TRANSACTIONAL = False
+
+metadata = MetaData()
+
+subscriptions = Table(
+    "subscriptions",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer),
+    Column("plan_name", String),
+    Column("end_date", Date),
+    Column("status", String),
+    Column("platform_id", Integer),
+)
+
+payments = Table(
+    "payments",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("subscription_id", Integer),
+)
+
+INDEXES = [
+    Index("ix_subscriptions_status_end_date", subscriptions.c.status, subscriptions.c.end_date,
+          postgresql_concurrently=True),
+    Index("ix_subscriptions_user_id_status", subscriptions.c.user_id, subscriptions.c.status,
+          postgresql_concurrently=True),
+    Index(
+        "ix_subscriptions_active_user_id_platform_id", subscriptions.c.user_id, subscriptions.c.platform_id,
+        postgresql_where=text("status = 'active'"),
+        sqlite_where=text("status = 'active'"),
+        postgresql_concurrently=True,
+    ),
+    Index("ix_subscriptions_user_id_plan_name", subscriptions.c.user_id, subscriptions.c.plan_name,
+          postgresql_concurrently=True),
+    Index("ix_payments_subscription_id_id", payments.c.subscription_id, payments.c.id,
+          postgresql_concurrently=True),
+]
+
+
+def upgrade(conn):
+    for index in INDEXES:
+        create_index(conn, index)
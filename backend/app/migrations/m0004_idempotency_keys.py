@@ -0,0 +1,20 @@
+from sqlalchemy import JSON, Column, DateTime, Integer, MetaData, String, Table
+
+VERSION = 4
+DESCRIPTION = "idempotency_keys table"
+
+metadata = MetaData()
+
+idempotency_keys = Table(
+    "idempotency_keys",
+    metadata,
+    Column("key", String, primary_key=True),
+    Column("scope", String, primary_key=True),
+    Column("user_id", Integer, nullable=True),
+    Column("response", JSON, nullable=False),
+    Column("created_at", DateTime, nullable=False, index=True),
+)
+
+
+def upgrade(conn):
+    idempotency_keys.create(bind=conn, checkfirst=True)
@@ -0,0 +1,135 @@
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import JSON, Column, DateTime, ForeignKey, Integer, MetaData, Table, column, select, table
+
+from app.database import upsert
+
+VERSION = 5
+DESCRIPTION = "subscription_summaries table with backfill"
+
+# Заполнение пачками с коммитом после каждой: миграция идемпотентна и может быть перезапущена
+TRANSACTIONAL = False
+BACKFILL_BATCH_SIZE = 1000
+# Формат сводки на момент миграции (последующие изменения формата пересчитывают сводки сами)
+EXPIRED_HISTORY_LIMIT = 20
+
+metadata = MetaData()
+
+# Только для внешнего ключа, таблица не создается
+Table("users", metadata, Column("id", Integer, primary_key=True))
+
+summaries_table = Table(
+    "subscription_summaries",
+    metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("data", JSON, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+
+users = table("users", column("id"))
+subscriptions = table(
+    "subscriptions",
+    column("id"), column("user_id"), column("platform_id"), column("plan_name"),
+    column("start_date"), column("end_date"), column("status"),
+)
+payments = table(
+    "payments",
+    column("id"), column("user_id"), column("public_token"), column("subscription_id"),
+    column("plan_name"), column("amount"), column("status"),
+)
+
+
+def empty_summary() -> dict:
+    return {"active": [], "expired": [], "pending_payments": []}
+
+
+def summary_queries(user_ids):
+    subscription_rows = select(
+        subscriptions.c.id,
+        subscriptions.c.user_id,
+        subscriptions.c.platform_id,
+        subscriptions.c.plan_name,
+        subscriptions.c.start_date,
+        subscriptions.c.end_date,
+        subscriptions.c.status,
+    ).where(subscriptions.c.user_id.in_(user_ids), subscriptions.c.status.in_(("active", "expired")))
+    pending_payments = (
+        select(
+            payments.c.id,
+            payments.c.user_id,
+            payments.c.public_token,
+            payments.c.subscription_id,
+            payments.c.plan_name,
+            payments.c.amount,
+            subscriptions.c.platform_id,
+        )
+        .select_from(payments.join(subscriptions, subscriptions.c.id == payments.c.subscription_id))
+        .where(payments.c.user_id.in_(user_ids), payments.c.status == "pending", subscriptions.c.status == "pending")
+        .order_by(payments.c.id)
+    )
+    return subscription_rows, pending_payments
+
+
+def build_summaries(user_ids, subscription_rows, payment_rows) -> dict:
+    summaries = {user_id: empty_summary() for user_id in user_ids}
+    active_by_platform = {user_id: {} for user_id in user_ids}
+    for row in subscription_rows:
+        item = {
+            "subscription_id": row.id,
+            "platform_id": row.platform_id,
+            "plan_name": row.plan_name,
+            "start_date": row.start_date,
+            "end_date": row.end_date,
+        }
+        if row.status == "active":
+            current = active_by_platform[row.user_id].get(row.platform_id)
+            if current is None or (row.end_date, row.id) > (current["end_date"], current["subscription_id"]):
+                active_by_platform[row.user_id][row.platform_id] = item
+        else:
+            summaries[row.user_id]["expired"].append(item)
+
+    for user_id, summary in summaries.items():
+        summary["active"] = sorted(active_by_platform[user_id].values(), key=lambda item: (item["platform_id"] or 0))
+        summary["expired"] = sorted(
+            summary["expired"], key=lambda item: (item["end_date"], item["subscription_id"]), reverse=True
+        )[:EXPIRED_HISTORY_LIMIT]
+
+    for row in payment_rows:
+        summaries[row.user_id]["pending_payments"].append({
+            "payment_id": row.id,
+            "token": row.public_token,
+            "subscription_id": row.subscription_id,
+            "platform_id": row.platform_id,
+            "plan_name": row.plan_name,
+            "amount": row.amount,
+        })
+    return jsonable_encoder(summaries)
+
+
+def user_batches(conn, batch_size: int = BACKFILL_BATCH_SIZE):
+    last_id = 0
+    while True:
+        user_ids = conn.execute(
+            select(users.c.id).where(users.c.id > last_id).order_by(users.c.id).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            return
+        yield user_ids
+        last_id = user_ids[-1]
+
+
+def upgrade(conn):
+    summaries_table.create(bind=conn, checkfirst=True)
+
+    for user_ids in user_batches(conn):
+        subscription_rows, pending_payments = summary_queries(user_ids)
+        summaries = build_summaries(
+            user_ids, conn.execute(subscription_rows).all(), conn.execute(pending_payments).all()
+        )
+        # Уже существующие сводки (записанные приложением во время миграции) не перезаписываются
+        conn.execute(upsert(
+            conn.dialect.name, summaries_table,
+            [{"user_id": user_id, "data": data, "updated_at": datetime.utcnow()} for user_id, data in summaries.items()],
+            ["user_id"],
+        ))
@@ -0,0 +1,29 @@
+from sqlalchemy import JSON, Column, DateTime, Index, Integer, MetaData, String, Table, text
+
+VERSION = 6
+DESCRIPTION = "outbox_events table for payment side effects"
+
+metadata = MetaData()
+
+outbox_events = Table(
+    "outbox_events",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("event_type", String, nullable=False),
+    Column("payload", JSON, nullable=False),
+    Column("status", String, nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("available_at", DateTime, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("processed_at", DateTime, nullable=True),
+    Column("last_error", String, nullable=True),
+    Index(
+        "ix_outbox_events_pending_available_at", "available_at",
+        postgresql_where=text("status = 'pending'"),
+        sqlite_where=text("status = 'pending'"),
+    ),
+)
+
+
+def upgrade(conn):
+    outbox_events.create(bind=conn, checkfirst=True)
@@ -0,0 +1,194 @@
+from datetime import datetime
+
+from sqlalchemy import (
+    BigInteger, Column, Date, Integer, MetaData, String, Table, and_, case, column, delete, func, insert,
+    inspect, literal, select, table, text,
+)
+
+from app.database import upsert
+from app.migrations.m0005_subscription_summaries import (
+    build_summaries, summaries_table, summary_queries, user_batches,
+)
+
+VERSION = 7
+DESCRIPTION = "payments.confirmed_at and analytics rollup tables with backfill"
+
+# platform_id в ключах сводных таблиц для подписок и платежей без платформы
+NO_PLATFORM = 0
+CHURN_STATUSES = ("cancelled", "expired")
+
+metadata = MetaData()
+
+subscription_counts = Table(
+    "analytics_subscription_counts",
+    metadata,
+    Column("platform_id", Integer, primary_key=True),
+    Column("plan_name", String, primary_key=True),
+    Column("status", String, primary_key=True),
+    Column("subscriptions", Integer, nullable=False),
+)
+
+payment_totals = Table(
+    "analytics_payment_totals",
+    metadata,
+    Column("platform_id", Integer, primary_key=True),
+    Column("plan_name", String, primary_key=True),
+    Column("status", String, primary_key=True),
+    Column("payments", Integer, nullable=False),
+    Column("amount", BigInteger, nullable=False),
+)
+
+revenue_daily = Table(
+    "analytics_revenue_daily",
+    metadata,
+    Column("day", Date, primary_key=True),
+    Column("platform_id", Integer, primary_key=True),
+    Column("plan_name", String, primary_key=True),
+    Column("payments", Integer, nullable=False),
+    Column("amount", BigInteger, nullable=False),
+)
+
+churn_daily = Table(
+    "analytics_churn_daily",
+    metadata,
+    Column("day", Date, primary_key=True),
+    Column("platform_id", Integer, primary_key=True),
+    Column("plan_name", String, primary_key=True),
+    Column("status", String, primary_key=True),
+    Column("subscriptions", Integer, nullable=False),
+)
+
+subscriptions = table(
+    "subscriptions",
+    column("id"), column("user_id"), column("platform_id"), column("plan_name"),
+    column("start_date"), column("end_date"), column("status"),
+)
+payments = table(
+    "payments",
+    column("id"), column("user_id"), column("subscription_id"), column("plan_name"),
+    column("amount"), column("status"), column("confirmed_at"),
+)
+
+
+def stats_queries(user_ids):
+    # Счетчики пользователей по (платформа, план, статус): подписки и платежи с суммами
+    subscription_stats = (
+        select(
+            subscriptions.c.user_id,
+            subscriptions.c.platform_id,
+            subscriptions.c.plan_name,
+            subscriptions.c.status,
+            func.count(),
+        )
+        .where(subscriptions.c.user_id.in_(user_ids))
+        .group_by(subscriptions.c.user_id, subscriptions.c.platform_id, subscriptions.c.plan_name,
+                  subscriptions.c.status)
+    )
+    payment_stats = (
+        select(
+            payments.c.user_id,
+            subscriptions.c.platform_id,
+            payments.c.plan_name,
+            payments.c.status,
+            func.count(),
+            func.coalesce(func.sum(payments.c.amount), 0),
+        )
+        .select_from(payments.outerjoin(subscriptions, subscriptions.c.id == payments.c.subscription_id))
+        .where(payments.c.user_id.in_(user_ids))
+        .group_by(payments.c.user_id, subscriptions.c.platform_id, payments.c.plan_name, payments.c.status)
+    )
+    return subscription_stats, payment_stats
+
+
+def build_stats(user_ids, subscription_rows, payment_rows) -> dict:
+    stats = {user_id: {"subscriptions": [], "payments": []} for user_id in user_ids}
+    for user_id, platform_id, plan_name, status, count in subscription_rows:
+        stats[user_id]["subscriptions"].append([platform_id or NO_PLATFORM, plan_name or "", status or "", count])
+    for user_id, platform_id, plan_name, status, count, amount in payment_rows:
+        stats[user_id]["payments"].append(
+            [platform_id or NO_PLATFORM, plan_name or "", status or "", count, int(amount)]
+        )
+    for user_stats in stats.values():
+        user_stats["subscriptions"].sort()
+        user_stats["payments"].sort()
+    return stats
+
+
+def rebuild_summaries(conn):
+    # Сводки всех пользователей пересчитываются вместе со счетчиками stats
+    for user_ids in user_batches(conn):
+        subscription_rows, pending_payments = summary_queries(user_ids)
+        summaries = build_summaries(
+            user_ids, conn.execute(subscription_rows).all(), conn.execute(pending_payments).all()
+        )
+        subscription_stats, payment_stats = stats_queries(user_ids)
+        stats = build_stats(user_ids, conn.execute(subscription_stats).all(), conn.execute(payment_stats).all())
+        for user_id, summary in summaries.items():
+            summary["stats"] = stats[user_id]
+        conn.execute(upsert(
+            conn.dialect.name, summaries_table,
+            [{"user_id": user_id, "data": data, "updated_at": datetime.utcnow()} for user_id, data in summaries.items()],
+            ["user_id"],
+            update_columns=["data", "updated_at"],
+        ))
+
+
+def rebuild_rollups(conn):
+    # Дата отмены не хранится: отмененная подписка относится к дню окончания, если он уже прошел, иначе к сегодня
+    today = datetime.utcnow().date()
+    for rollup in (subscription_counts, payment_totals, revenue_daily, churn_daily):
+        conn.execute(delete(rollup))
+
+    platform_id = func.coalesce(subscriptions.c.platform_id, NO_PLATFORM)
+    subscription_plan = func.coalesce(subscriptions.c.plan_name, "")
+    subscription_status = func.coalesce(subscriptions.c.status, "")
+    conn.execute(insert(subscription_counts).from_select(
+        ["platform_id", "plan_name", "status", "subscriptions"],
+        select(platform_id, subscription_plan, subscription_status, func.count())
+        .select_from(subscriptions)
+        .group_by(platform_id, subscription_plan, subscription_status),
+    ))
+
+    churn_day = case(
+        (and_(subscriptions.c.status == "expired", subscriptions.c.end_date.isnot(None)), subscriptions.c.end_date),
+        (subscriptions.c.end_date < today, subscriptions.c.end_date),
+        else_=literal(today),
+    )
+    conn.execute(insert(churn_daily).from_select(
+        ["day", "platform_id", "plan_name", "status", "subscriptions"],
+        select(churn_day, platform_id, subscription_plan, subscriptions.c.status, func.count())
+        .select_from(subscriptions)
+        .where(subscriptions.c.status.in_(CHURN_STATUSES))
+        .group_by(churn_day, platform_id, subscription_plan, subscriptions.c.status),
+    ))
+
+    payment_plan = func.coalesce(payments.c.plan_name, "")
+    payment_status = func.coalesce(payments.c.status, "")
+    payments_with_platform = payments.outerjoin(subscriptions, subscriptions.c.id == payments.c.subscription_id)
+    conn.execute(insert(payment_totals).from_select(
+        ["platform_id", "plan_name", "status", "payments", "amount"],
+        select(platform_id, payment_plan, payment_status, func.count(), func.coalesce(func.sum(payments.c.amount), 0))
+        .select_from(payments_with_platform)
+        .group_by(platform_id, payment_plan, payment_status),
+    ))
+
+    # День выручки - дата подтверждения; у платежей до появления confirmed_at - начало подписки
+    revenue_day = func.coalesce(func.date(payments.c.confirmed_at), subscriptions.c.start_date)
+    conn.execute(insert(revenue_daily).from_select(
+        ["day", "platform_id", "plan_name", "payments", "amount"],
+        select(revenue_day, platform_id, payment_plan, func.count(), func.coalesce(func.sum(payments.c.amount), 0))
+        .select_from(payments_with_platform)
+        .where(payments.c.status == "confirmed", revenue_day.isnot(None))
+        .group_by(revenue_day, platform_id, payment_plan),
+    ))
+
+
+def upgrade(conn):
+    # Проверка - для баз, где колонка уже создана приложением через create_all
+    if "confirmed_at" not in {column["name"] for column in inspect(conn).get_columns("payments")}:
+        conn.execute(text("ALTER TABLE payments ADD COLUMN confirmed_at TIMESTAMP"))
+    metadata.create_all(bind=conn)
+
+    # Счетчики в сводках пользователей и сводные таблицы по истории
+    rebuild_summaries(conn)
+    rebuild_rollups(conn)
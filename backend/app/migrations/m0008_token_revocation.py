@@ -0,0 +1,34 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData, String, Table
+
+VERSION = 8
+DESCRIPTION = "auth_sessions and revoked_tokens for refresh tokens and revocation"
+
+metadata = MetaData()
+
+# Только для внешнего ключа, таблица не создается
+Table("users", metadata, Column("id", Integer, primary_key=True))
+
+auth_sessions = Table(
+    "auth_sessions",
+    metadata,
+    Column("id", String, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("refresh_jti", String, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("expires_at", DateTime, nullable=False),
+    Column("revoked_at", DateTime, nullable=True),
+)
+
+revoked_tokens = Table(
+    "revoked_tokens",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("token_id", String, nullable=False, unique=True),
+    Column("expires_at", DateTime, nullable=False, index=True),
+    Column("created_at", DateTime, nullable=False, index=True),
+)
+
+
+def upgrade(conn):
+    auth_sessions.create(bind=conn, checkfirst=True)
+    revoked_tokens.create(bind=conn, checkfirst=True)
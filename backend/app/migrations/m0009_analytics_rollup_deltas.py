@@ -0,0 +1,23 @@
+from sqlalchemy import BigInteger, Column, Date, Integer, MetaData, String, Table
+
+VERSION = 9
+DESCRIPTION = "analytics_rollup_deltas for asynchronous rollup updates"
+
+metadata = MetaData()
+
+rollup_deltas = Table(
+    "analytics_rollup_deltas",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("kind", String, nullable=False),
+    Column("day", Date, nullable=False),
+    Column("platform_id", Integer, nullable=False),
+    Column("plan_name", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("count", Integer, nullable=False),
+    Column("amount", BigInteger, nullable=False),
+)
+
+
+def upgrade(conn):
+    rollup_deltas.create(bind=conn, checkfirst=True)
@@ -0,0 +1,30 @@
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, text
+
+from app.migrations.ddl import create_index
+
+VERSION = 10
+DESCRIPTION = "partial index on processed outbox events for retention purge"
+
+# Индекс строится CONCURRENTLY: outbox_events растет вместе с числом платежей
+TRANSACTIONAL = False
+
+metadata = MetaData()
+
+outbox_events = Table(
+    "outbox_events",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("status", String),
+    Column("processed_at", DateTime),
+)
+
+INDEX = Index(
+    "ix_outbox_events_processed_processed_at", outbox_events.c.processed_at,
+    postgresql_where=text("status = 'processed'"),
+    sqlite_where=text("status = 'processed'"),
+    postgresql_concurrently=True,
+)
+
+
+def upgrade(conn):
+    create_index(conn, INDEX)
@@ -0,0 +1,10 @@
+from sqlalchemy import inspect, text
+
+VERSION = 11
+DESCRIPTION = "idempotency_keys.request_hash"
+
+
+def upgrade(conn):
+    # Миграция 4 создает таблицу без колонки; проверка - для баз, где таблица уже создана с ней
+    if "request_hash" not in {column["name"] for column in inspect(conn).get_columns("idempotency_keys")}:
+        conn.execute(text("ALTER TABLE idempotency_keys ADD COLUMN request_hash VARCHAR"))
@@ -0,0 +1,23 @@
+from sqlalchemy import BigInteger, Column, DateTime, Float, Integer, MetaData, Table
+
+VERSION = 12
+DESCRIPTION = "expiry_stats with persisted expiry sweep totals"
+
+metadata = MetaData()
+
+expiry_stats = Table(
+    "expiry_stats",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("sweeps_total", BigInteger, nullable=False),
+    Column("expired_total", BigInteger, nullable=False),
+    Column("errors_total", BigInteger, nullable=False),
+    Column("last_sweep_expired", Integer, nullable=False),
+    Column("last_sweep_batches", Integer, nullable=False),
+    Column("last_sweep_duration_seconds", Float, nullable=False),
+    Column("last_sweep_at", DateTime, nullable=True),
+)
+
+
+def upgrade(conn):
+    expiry_stats.create(bind=conn, checkfirst=True)
@@ -1,23 +1,36 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Date
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, DateTime, Float, Index, JSON, BigInteger, text
 from sqlalchemy.orm import relationship
-from datetime import date
+from datetime import date, datetime
+from typing import List, Optional
+import secrets
 from app.database import Base
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+# Публичный токен платежа для ссылок на оплату (id последовательный и легко угадывается)
+def generate_payment_token() -> str:
+    return secrets.token_urlsafe(16)
 
 class Payment(Base):
     __tablename__ = "payments"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True)  # выдается последовательностью БД
+    public_token = Column(String, unique=True, index=True, default=generate_payment_token)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     subscription_id = Column(Integer, ForeignKey("subscriptions.id"))
     plan_name = Column(String, nullable=False)
     amount = Column(Integer, nullable=False)
     status = Column(String, default="pending")
+    confirmed_at = Column(DateTime, nullable=True)  # день выручки в аналитике
 
     # Связь с пользователем и подпиской
     user = relationship("User", back_populates="payments")
     subscription = relationship("Subscription", back_populates="payments")
 
+    __table_args__ = (
+        # Платежи подписки и последний платеж (ORDER BY id DESC)
+        Index("ix_payments_subscription_id_id", "subscription_id", "id"),
+    )
+
 class PaymentRequest(BaseModel):
     user_id: int
     plan_name: str
@@ -33,7 +46,7 @@ class PaymentRecord(BaseModel):
     subscription_id: int  # добавленное поле для подписки
 
 class ConfirmPaymentRequest(BaseModel):
-    payment_id: int
+    token: str  # публичный токен платежа из ссылки на оплату
 
 class User(Base):
     __tablename__ = "users"
@@ -60,6 +73,19 @@ class UserLogin(BaseModel):
     email: str
     password: str
 
+# Данные пользователя из JWT (user_id и роль подписаны в токене)
+class TokenClaims(BaseModel):
+    id: int
+    username: str
+    role: str
+    session_id: Optional[str] = None  # sid: сессия входа, к которой относится токен
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+class RoleUpdateRequest(BaseModel):
+    role: str
+
 class Subscription(Base):
     __tablename__ = "subscriptions"
 
@@ -76,9 +102,33 @@ class Subscription(Base):
     payments = relationship("Payment", back_populates="subscription")  # Изменение: payments = relationship
     platform = relationship("Platform", back_populates="subscriptions")
 
+    __table_args__ = (
+        # Индекс для фонового истечения подписок (status = 'active' AND end_date < :today)
+        Index("ix_subscriptions_status_end_date", "status", "end_date"),
+        # Списки подписок пользователя по статусу (/active, /expired)
+        Index("ix_subscriptions_user_id_status", "user_id", "status"),
+        # Активная подписка пользователя на платформе: частичный индекс только по активным строкам
+        Index(
+            "ix_subscriptions_active_user_id_platform_id", "user_id", "platform_id",
+            postgresql_where=text("status = 'active'"),
+            sqlite_where=text("status = 'active'"),
+        ),
+        # Поиск подписки пользователя по плану (создание платежа, проверка дублей)
+        Index("ix_subscriptions_user_id_plan_name", "user_id", "plan_name"),
+    )
+
 class SubscriptionCancelRequest(BaseModel):
     subscription_id: int  # Идентификатор подписки, которую нужно отменить
 
+# Массовая операция администратора: условия отбора объединяются через AND
+class BulkSubscriptionRequest(BaseModel):
+    subscription_ids: Optional[List[int]] = None
+    user_id: Optional[int] = None
+    platform_id: Optional[int] = None
+    plan_name: Optional[str] = None
+    days: int = Field(30, ge=1, le=3650)  # только для extend
+    dry_run: bool = False  # только посчитать подходящие подписки
+
 class SubscriptionCreate(BaseModel):
     plan_name: str
     duration_days: int
@@ -103,7 +153,446 @@ class Platform(Base):
     image_url = Column(String, nullable=False)
 
     subscriptions = relationship("Subscription", back_populates="platform")
+    plans = relationship("Plan", back_populates="platform")
+
+# Тарифные планы платформ (раньше были литералами в коде)
+class Plan(Base):
+    __tablename__ = "plans"
+
+    id = Column(Integer, primary_key=True, index=True)
+    platform_id = Column(Integer, ForeignKey("platforms.id"), nullable=False, index=True)
+    name = Column(String, nullable=False)
+    price = Column(Integer, nullable=False)
+    duration_days = Column(Integer, nullable=False)
+    description = Column(String, nullable=False)
+
+    platform = relationship("Platform", back_populates="plans")
 
 class PlatformSubscriptionRequest(BaseModel):
     plan_name: str
     duration_days: int
+
+class PlanItem(BaseModel):
+    name: str
+    price: int
+    duration_days: int
+    description: str
+
+# Сводка подписок пользователя для страницы профиля: активный план по платформам, история
+# истекших и ожидающие оплаты. Обновляется в транзакциях записи (app/summaries.py)
+class SubscriptionSummary(Base):
+    __tablename__ = "subscription_summaries"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    data = Column(JSON, nullable=False)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+# Сохраненные ответы по ключам идемпотентности (повтор запроса возвращает тот же результат)
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    scope = Column(String, primary_key=True)  # эндпоинт, для которого выдан ключ
+    user_id = Column(Integer, nullable=True)
+    request_hash = Column(String, nullable=True)  # отпечаток запроса; NULL у ключей до его появления
+    response = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+# Сводные таблицы аналитики (app/analytics.py). Транзакции записи добавляют приращения
+# в analytics_rollup_deltas, воркер outbox сворачивает их сюда; platform_id = 0 - подписки без платформы
+class SubscriptionCount(Base):
+    __tablename__ = "analytics_subscription_counts"
+
+    platform_id = Column(Integer, primary_key=True)
+    plan_name = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    subscriptions = Column(Integer, nullable=False, default=0)
+
+class PaymentTotal(Base):
+    __tablename__ = "analytics_payment_totals"
+
+    platform_id = Column(Integer, primary_key=True)
+    plan_name = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    payments = Column(Integer, nullable=False, default=0)
+    amount = Column(BigInteger, nullable=False, default=0)
+
+class RevenueDaily(Base):
+    __tablename__ = "analytics_revenue_daily"
+
+    day = Column(Date, primary_key=True)
+    platform_id = Column(Integer, primary_key=True)
+    plan_name = Column(String, primary_key=True)
+    payments = Column(Integer, nullable=False, default=0)
+    amount = Column(BigInteger, nullable=False, default=0)
+
+class ChurnDaily(Base):
+    __tablename__ = "analytics_churn_daily"
+
+    day = Column(Date, primary_key=True)
+    platform_id = Column(Integer, primary_key=True)
+    plan_name = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)  # cancelled | expired
+    subscriptions = Column(Integer, nullable=False, default=0)
+
+# Приращения сводных таблиц: только вставки из транзакций записи (без блокировок общих строк).
+# kind = subscriptions (count) | payments (count, amount); day - день транзакции для выручки и оттока
+class RollupDelta(Base):
+    __tablename__ = "analytics_rollup_deltas"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    day = Column(Date, nullable=False)
+    platform_id = Column(Integer, nullable=False)
+    plan_name = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    count = Column(Integer, nullable=False)
+    amount = Column(BigInteger, nullable=False, default=0)
+
+# Transactional outbox: побочные эффекты (активация подписки, уведомления, вебхуки) записываются
+# в той же транзакции, что и изменение платежа, и выполняются воркером (app/outbox.py)
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True)
+    event_type = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending | processed | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # не раньше этого времени
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+
+    __table_args__ = (
+        # Очередь воркера: только необработанные события, по времени готовности
+        Index(
+            "ix_outbox_events_pending_available_at", "available_at",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'"),
+        ),
+        # Удаление обработанных событий старше срока хранения
+        Index(
+            "ix_outbox_events_processed_processed_at", "processed_at",
+            postgresql_where=text("status = 'processed'"),
+            sqlite_where=text("status = 'processed'"),
+        ),
+    )
+
+# Итоги проходов истечения подписок (одна строка, id = 1). Проход выполняет отдельный сервис,
+# поэтому итоги хранятся в БД, и API читает их оттуда (/api/internal/expiry, /metrics)
+class ExpiryStats(Base):
+    __tablename__ = "expiry_stats"
+
+    id = Column(Integer, primary_key=True)
+    sweeps_total = Column(BigInteger, nullable=False, default=0)
+    expired_total = Column(BigInteger, nullable=False, default=0)
+    errors_total = Column(BigInteger, nullable=False, default=0)
+    last_sweep_expired = Column(Integer, nullable=False, default=0)
+    last_sweep_batches = Column(Integer, nullable=False, default=0)
+    last_sweep_duration_seconds = Column(Float, nullable=False, default=0.0)
+    last_sweep_at = Column(DateTime, nullable=True)
+
+# Сессия входа: выдается при логине, refresh-токен сессии меняется при каждом обновлении
+# (в строке хранится jti действующего refresh-токена)
+class AuthSession(Base):
+    __tablename__ = "auth_sessions"
+
+    id = Column(String, primary_key=True)  # sid в токенах
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    refresh_jti = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
+
+# Список отзыва: id отозванных сессий до истечения их токенов. Каждый воркер держит его
+# в памяти как фильтр Блума и дочитывает новые строки по id (app/revocation.py)
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True)
+    token_id = Column(String, nullable=False, unique=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+# Модели ответов API: FastAPI проверяет ответ по модели и сериализует его в pydantic-core,
+# без обхода jsonable_encoder
+class MessageResponse(BaseModel):
+    message: str
+
+class UserInfo(BaseModel):
+    username: str
+    role: str
+
+class RegisterResponse(BaseModel):
+    message: str
+    user: UserInfo
+
+class TokenResponse(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str
+    user_id: int
+    role: str
+
+class UserRecord(BaseModel):
+    id: int
+    username: str
+    email: str
+    role: str
+
+class UserPage(BaseModel):
+    users: List[UserRecord]
+    next_cursor: Optional[str] = None
+
+class SubscriptionItem(BaseModel):
+    id: int
+    plan_name: str
+    start_date: date
+    end_date: date
+    status: str
+
+class SubscriptionItemsResponse(BaseModel):
+    subscriptions: List[SubscriptionItem]
+
+class SubscriptionListItem(SubscriptionItem):
+    platform_name: Optional[str] = None
+
+class ActiveSubscriptionsResponse(BaseModel):
+    subscriptions: List[SubscriptionListItem]
+
+class ExpiredSubscriptionsResponse(BaseModel):
+    expired_subscriptions: List[SubscriptionListItem]
+
+class SubscriptionListResponse(BaseModel):
+    subscriptions: List[SubscriptionResponse]
+
+class SubscriptionCreatedResponse(BaseModel):
+    message: str
+    subscription: SubscriptionItem
+
+class BulkSubscriptionResponse(BaseModel):
+    action: str
+    dry_run: bool
+    matched: int
+    updated: int
+    users: int
+    chunks: int
+
+class SubscriptionStatusResponse(BaseModel):
+    message: str
+    status: str
+
+class SubscriptionCancelledResponse(BaseModel):
+    msg: str
+
+class SubscriptionExtendedResponse(BaseModel):
+    message: str
+    subscription: SubscriptionResponse
+
+class PlatformSubscription(SubscriptionResponse):
+    platform_id: int
+
+class PlatformSubscriptionResponse(BaseModel):
+    message: str
+    subscription: PlatformSubscription
+    payment_url: str
+
+class GenericPlan(BaseModel):
+    id: int
+    name: str
+    price: int
+    duration_days: int
+
+class GenericPlansResponse(BaseModel):
+    plans: List[GenericPlan]
+
+class PlatformItem(BaseModel):
+    id: int
+    name: str
+    description: str
+    image_url: str
+
+class PlatformsResponse(BaseModel):
+    platforms: List[PlatformItem]
+
+class PlatformPlan(PlanItem):
+    is_active: bool
+
+class CurrentSubscription(BaseModel):
+    plan_name: str
+    end_date: date
+
+class PlatformDetailsResponse(BaseModel):
+    platform: PlatformItem
+    plans: List[PlatformPlan]
+    current_subscription: Optional[CurrentSubscription] = None
+
+class PlansUpdatedResponse(BaseModel):
+    message: str
+    plans: int
+
+class SummarySubscription(BaseModel):
+    subscription_id: int
+    platform_id: Optional[int] = None
+    platform_name: str
+    plan_name: str
+    start_date: date
+    end_date: date
+
+class SummaryPendingPayment(BaseModel):
+    payment_id: int
+    token: str
+    subscription_id: Optional[int] = None
+    platform_id: Optional[int] = None
+    platform_name: str
+    plan_name: str
+    amount: int
+
+class SubscriptionSummaryResponse(BaseModel):
+    active: List[SummarySubscription]
+    expired: List[SummarySubscription]
+    pending_payments: List[SummaryPendingPayment]
+
+class PaymentItem(BaseModel):
+    id: int
+    user_id: int
+    subscription_id: Optional[int] = None
+    plan_name: str
+    amount: int
+    status: str
+
+class PaymentPage(BaseModel):
+    payments: List[PaymentItem]
+    next_cursor: Optional[str] = None
+
+class CheckoutSessionResponse(BaseModel):
+    url: str
+    payment_id: int
+    token: str
+
+class PaymentConfirmedResponse(BaseModel):
+    message: str
+    payment_id: int
+
+class ExpiryMetricsResponse(BaseModel):
+    sweeps_total: int
+    expired_total: int
+    last_sweep_expired: int
+    last_sweep_batches: int
+    last_sweep_duration_seconds: float
+    last_sweep_at: Optional[str] = None
+    errors_total: int
+
+class PoolMetricsResponse(BaseModel):
+    pool: str
+    waits_total: int
+    wait_ms_avg: float
+    wait_ms_max: float
+    timeouts_total: int
+    # Только для QueuePool (у NullPool счетчиков соединений нет)
+    size: Optional[int] = None
+    max_overflow: Optional[int] = None
+    checked_out: Optional[int] = None
+    checked_in: Optional[int] = None
+    overflow: Optional[int] = None
+
+class ReplicaStatus(BaseModel):
+    name: str
+    healthy: bool
+    usable: bool
+    lag_seconds: Optional[float] = None
+    checked_at: Optional[float] = None
+    last_error: Optional[str] = None
+
+class ReplicaRouterStatus(BaseModel):
+    replicas: List[ReplicaStatus]
+    max_lag_seconds: float
+    reads_total: int
+    fallbacks_total: int
+
+class OutboxMetricsResponse(BaseModel):
+    batches_total: int
+    processed_total: int
+    retried_total: int
+    failed_total: int
+    last_batch_at: Optional[str] = None
+    released_total: int
+    rollup_deltas_folded_total: int
+    pending: int
+    failed: int
+    rollup_deltas_pending: int
+
+class RevocationMetricsResponse(BaseModel):
+    entries: int
+    capacity: int
+    size_bytes: int
+    hashes: int
+    last_id: int
+    db_checks_total: int
+    false_positives_total: int
+    syncs_total: int
+    rebuilds_total: int
+    last_sync_at: Optional[str] = None
+    last_rebuild_at: Optional[str] = None
+
+class PaymentEventsMetricsResponse(BaseModel):
+    payments: int
+    subscribers: int
+    published_total: int
+    listening: bool
+
+class RevenueDay(BaseModel):
+    day: date
+    platform_id: Optional[int] = None
+    platform_name: str
+    plan_name: str
+    payments: int
+    amount: int
+
+class RevenueResponse(BaseModel):
+    start: date
+    end: date
+    days: List[RevenueDay]
+    total_payments: int
+    total_amount: int
+
+class SubscriberCounts(BaseModel):
+    platform_id: Optional[int] = None
+    platform_name: str
+    plan_name: str
+    active: int = 0
+    pending: int = 0
+    cancelled: int = 0
+    expired: int = 0
+
+class SubscribersResponse(BaseModel):
+    plans: List[SubscriberCounts]
+    active_total: int
+
+class ChurnDay(BaseModel):
+    day: date
+    platform_id: Optional[int] = None
+    platform_name: str
+    plan_name: str
+    cancelled: int = 0
+    expired: int = 0
+
+class ChurnResponse(BaseModel):
+    start: date
+    end: date
+    days: List[ChurnDay]
+    cancelled_total: int
+    expired_total: int
+
+class PendingBacklogItem(BaseModel):
+    platform_id: Optional[int] = None
+    platform_name: str
+    plan_name: str
+    payments: int
+    amount: int
+
+class PendingBacklogResponse(BaseModel):
+    plans: List[PendingBacklogItem]
+    total_payments: int
+    total_amount: int
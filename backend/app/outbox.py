@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.analytics import ANALYTICS_FOLD_BATCH_SIZE, fold_rollup_deltas
+from app.database import AsyncSessionLocal
+from app.logging_config import setup_logging, shutdown_logging
+from app.models import OutboxEvent, Subscription
+from app.payment_events import publish_payment_status
+from app.summaries import refresh_summaries
+
+logger = logging.getLogger(__name__)
+
+# Настройки воркера outbox (python -m app.outbox; воркеров может быть несколько)
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", "0.5"))
+OUTBOX_WORKER_ENABLED = os.getenv("OUTBOX_WORKER_ENABLED", "1") == "1"
+# Событие, взятое воркером, скрыто от других воркеров на это время (при падении воркера - берется снова)
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_MAX_BACKOFF_SECONDS = int(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "600"))
+# Адреса вебхуков через запятую; каждое событие платежа доставляется на каждый адрес отдельно
+WEBHOOK_URLS = [url.strip() for url in os.getenv("WEBHOOK_URLS", "").split(",") if url.strip()]
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "5"))
+# Новое событие пачки начинается, только если до конца аренды остается больше этого запаса
+# (самый долгий обработчик - вебхук); остальные события пачки возвращаются в очередь
+OUTBOX_LEASE_MARGIN_SECONDS = float(os.getenv("OUTBOX_LEASE_MARGIN_SECONDS", str(WEBHOOK_TIMEOUT_SECONDS * 2)))
+# Обработанные события хранятся столько часов, затем удаляются (проход истечения, app/expiry.py)
+OUTBOX_RETENTION_HOURS = int(os.getenv("OUTBOX_RETENTION_HOURS", "168"))
+OUTBOX_PURGE_BATCH_SIZE = int(os.getenv("OUTBOX_PURGE_BATCH_SIZE", "1000"))
+
+# Метрики воркера текущего процесса (читаются через /api/internal/outbox и /metrics)
+outbox_metrics = {
+    "batches_total": 0,
+    "processed_total": 0,
+    "retried_total": 0,
+    "failed_total": 0,
+    "last_batch_at": None,
+    "released_total": 0,
+    "rollup_deltas_folded_total": 0,
+}
+
+
+def enqueue_event(db: AsyncSession, event_type: str, payload: dict):
+    # Событие попадает в БД вместе с остальными изменениями транзакции (или не попадает вовсе)
+    db.add(OutboxEvent(event_type=event_type, payload=payload, status="pending", attempts=0,
+                       available_at=datetime.utcnow()))
+
+
+def fan_out(db: AsyncSession, event_type: str, payload: dict):
+    # Уведомление пользователю и доставка на каждый вебхук - отдельные события со своими повторами
+    enqueue_event(db, "notification", {"event": event_type, **payload})
+    for url in WEBHOOK_URLS:
+        enqueue_event(db, "webhook", {"url": url, "event": event_type, "data": payload})
+
+
+async def handle_payment_created(db: AsyncSession, payload: dict):
+    fan_out(db, "payment.created", payload)
+
+
+async def handle_payment_confirmed(db: AsyncSession, payload: dict):
+    # Активация подписки после подтверждения платежа (раньше выполнялась в confirm_payment)
+    result = await db.execute(
+        select(Subscription).where(Subscription.id == payload["subscription_id"]).with_for_update()
+    )
+    subscription = result.scalars().first()
+    if subscription:
+        subscription.status = "active"
+        if subscription.end_date < datetime.utcnow().date():
+            subscription.end_date = (datetime.utcnow() + timedelta(days=30)).date()
+        logger.info(f"Payment {payload['payment_id']} confirmed. Subscription {subscription.id} activated.")
+    else:
+        logger.warning(f"No subscription found for payment {payload['payment_id']}")
+    await refresh_summaries(db, [payload["user_id"]])
+    # Страница оплаты узнает об активации через SSE (после коммита события)
+    await publish_payment_status(db, payload["payment_id"], "confirmed", subscription.status if subscription else None)
+    fan_out(db, "payment.confirmed", payload)
+
+
+async def send_notification(db: AsyncSession, payload: dict):
+    # Канала доставки (почта и т.п.) пока нет: уведомление пишется в лог
+    logger.info(f"Notification for user {payload.get('user_id')}: {payload['event']}", extra={"notification": payload})
+
+
+_webhook_client = None
+
+
+async def deliver_webhook(db: AsyncSession, payload: dict):
+    global _webhook_client
+    if _webhook_client is None:
+        _webhook_client = httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SECONDS)
+    # Таймаут httpx действует на каждую фазу отдельно; общий срок ограничивает время события в аренде
+    response = await asyncio.wait_for(
+        _webhook_client.post(payload["url"], json={"event": payload["event"], "data": payload["data"]}),
+        WEBHOOK_TIMEOUT_SECONDS,
+    )
+    response.raise_for_status()
+
+
+# Тип события -> обработчик. Обработчик выполняется в транзакции, которая помечает событие обработанным
+OUTBOX_HANDLERS = {
+    "payment.created": handle_payment_created,
+    "payment.confirmed": handle_payment_confirmed,
+    "notification": send_notification,
+    "webhook": deliver_webhook,
+}
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(OUTBOX_MAX_BACKOFF_SECONDS, 2 ** attempts))
+
+
+async def claim_batch(db: AsyncSession, batch_size: int = OUTBOX_BATCH_SIZE):
+    # Готовые события берутся с SKIP LOCKED: параллельные воркеры получают разные строки.
+    # Взятые события откладываются на время аренды, и блокировки снимаются сразу после коммита
+    now = datetime.utcnow()
+    rows = (await db.execute(
+        select(OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.payload, OutboxEvent.attempts)
+        .where(OutboxEvent.status == "pending", OutboxEvent.available_at <= now)
+        .order_by(OutboxEvent.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )).all()
+    if rows:
+        await db.execute(
+            update(OutboxEvent)
+            .where(OutboxEvent.id.in_([row.id for row in rows]))
+            .values(available_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS), attempts=OutboxEvent.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
+    return rows
+
+
+async def process_event(db: AsyncSession, row) -> bool:
+    # Каждое событие - своя транзакция: сбой одного не откатывает остальные
+    attempts = row.attempts + 1
+    try:
+        handler = OUTBOX_HANDLERS.get(row.event_type)
+        if handler is None:
+            raise ValueError(f"Unknown outbox event type {row.event_type}")
+        await handler(db, row.payload)
+        await db.execute(
+            update(OutboxEvent).where(OutboxEvent.id == row.id)
+            .values(status="processed", processed_at=datetime.utcnow(), last_error=None)
+        )
+        await db.commit()
+        return True
+    except Exception as e:
+        await db.rollback()
+        failed = attempts >= OUTBOX_MAX_ATTEMPTS
+        logger.warning(f"Outbox event {row.id} ({row.event_type}) failed, attempt {attempts}: {e}")
+        await db.execute(
+            update(OutboxEvent).where(OutboxEvent.id == row.id).values(
+                status="failed" if failed else "pending",
+                available_at=datetime.utcnow() + retry_delay(attempts),
+                last_error=str(e)[:1000],
+            )
+        )
+        await db.commit()
+        outbox_metrics["failed_total" if failed else "retried_total"] += 1
+        return False
+
+
+async def release_events(db: AsyncSession, rows):
+    # Необработанные события пачки снова доступны другим воркерам; попытка не засчитывается
+    await db.execute(
+        update(OutboxEvent)
+        .where(OutboxEvent.id.in_([row.id for row in rows]), OutboxEvent.status == "pending")
+        .values(available_at=datetime.utcnow(), attempts=OutboxEvent.attempts - 1)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    outbox_metrics["released_total"] += len(rows)
+
+
+async def drain_outbox(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    # Обрабатывает готовые события пачками, пока они есть; возвращает число обработанных.
+    # Событие обрабатывается только в пределах аренды: иначе другой воркер может взять
+    # его повторно и доставить уведомление или вебхук второй раз
+    processed = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            deadline = time.monotonic() + OUTBOX_LEASE_SECONDS - OUTBOX_LEASE_MARGIN_SECONDS
+            rows = await claim_batch(db, batch_size)
+            if not rows:
+                break
+            outbox_metrics["batches_total"] += 1
+            outbox_metrics["last_batch_at"] = datetime.utcnow().isoformat()
+            for index, row in enumerate(rows):
+                if time.monotonic() >= deadline:
+                    await release_events(db, rows[index:])
+                    break
+                if await process_event(db, row):
+                    processed += 1
+                    outbox_metrics["processed_total"] += 1
+            if len(rows) < batch_size:
+                break
+    return processed
+
+
+async def purge_processed_events(db: AsyncSession, batch_size: int = OUTBOX_PURGE_BATCH_SIZE) -> int:
+    # Удаление обработанных событий старше срока хранения пачками, каждая - своя транзакция.
+    # Проваленные события остаются для разбора
+    cutoff = datetime.utcnow() - timedelta(hours=OUTBOX_RETENTION_HOURS)
+    purged = 0
+    while True:
+        ids = (await db.execute(
+            select(OutboxEvent.id)
+            .where(OutboxEvent.status == "processed", OutboxEvent.processed_at < cutoff)
+            .limit(batch_size)
+        )).scalars().all()
+        if ids:
+            await db.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(ids)))
+        await db.commit()
+        purged += len(ids)
+        if len(ids) < batch_size:
+            return purged
+
+
+async def drain_rollup_deltas(batch_size: int = ANALYTICS_FOLD_BATCH_SIZE) -> int:
+    # Свертка приращений аналитики в сводные таблицы вне транзакций запросов
+    folded = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            count = await fold_rollup_deltas(db, batch_size)
+            folded += count
+            outbox_metrics["rollup_deltas_folded_total"] += count
+            if count < batch_size:
+                break
+    return folded
+
+
+async def run_outbox_worker(interval: float = OUTBOX_POLL_INTERVAL_SECONDS):
+    # Первый проход через interval, а не сразу: при старте приложения не конкурируем
+    # за первое соединение с проходом истечения подписок
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await drain_outbox()
+        except Exception:
+            logger.exception("Outbox drain failed")
+        try:
+            await drain_rollup_deltas()
+        except Exception:
+            logger.exception("Analytics rollup fold failed")
+
+
+def main():
+    # Отдельный воркер: python -m app.outbox
+    setup_logging()
+    try:
+        asyncio.run(run_outbox_worker())
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
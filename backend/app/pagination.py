@@ -0,0 +1,88 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import tuple_
+
+from app.dependencies import SECRET_KEY
+from app.replicas import replica_router
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+CURSOR_SIGNATURE_BYTES = 12
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _signature(payload: bytes) -> bytes:
+    return hmac.new(SECRET_KEY.encode(), payload, hashlib.sha256).digest()[:CURSOR_SIGNATURE_BYTES]
+
+
+# Курсор непрозрачен для клиента: base64 от последнего отданного id (и ключа сортировки)
+# с подписью, поэтому измененный или собранный вручную курсор отклоняется
+def encode_cursor(last_id: int, key=None) -> str:
+    position = {"id": last_id} if key is None else {"id": last_id, "key": key}
+    payload = json.dumps(position, separators=(",", ":")).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_signature(payload))}"
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        payload, signature = (_b64decode(part) for part in cursor.split("."))
+        if not hmac.compare_digest(signature, _signature(payload)):
+            raise ValueError("bad signature")
+        position = json.loads(payload)
+        position["id"] = int(position["id"])
+        return position
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def paginate(db, query, id_column, limit: int, cursor: str = None, sort_column=None):
+    # Keyset-пагинация по возрастанию id: WHERE id > :last ORDER BY id LIMIT :limit.
+    # С sort_column (строка или число) - по (sort_column, id): id разводит одинаковые ключи
+    if cursor:
+        position = decode_cursor(cursor)
+        if sort_column is None:
+            query = query.where(id_column > position["id"])
+        elif "key" not in position:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        else:
+            query = query.where(tuple_(sort_column, id_column) > tuple_(position["key"], position["id"]))
+    order_by = (id_column,) if sort_column is None else (sort_column, id_column)
+    result = await db.execute(query.order_by(*order_by).limit(limit + 1))
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]._mapping
+        next_cursor = encode_cursor(last[id_column], None if sort_column is None else last[sort_column])
+    return rows, next_cursor
+
+
+def ndjson_response(query, to_dict, filename: str) -> StreamingResponse:
+    # Выгрузка в NDJSON через серверный курсор: память не растет с размером таблицы.
+    # Сессия открывается внутри генератора, так как живет дольше обработчика.
+    async def generate():
+        async with await replica_router.open_session() as db:
+            result = await db.stream(query)
+            async for rows in result.partitions(EXPORT_BATCH_SIZE):
+                yield "".join(json.dumps(to_dict(row), default=str, ensure_ascii=False) + "\n" for row in rows)
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
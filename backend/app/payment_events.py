@@ -0,0 +1,148 @@
+import asyncio
+import json
+import logging
+import os
+
+import asyncpg
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.catalog import CATALOG_CHANNEL, catalog_cache
+from app.database import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Статусы платежей для страниц оплаты (SSE, app/routers/payments.py). Изменения публикуются
+# через pg_notify в транзакции изменения; каждый воркер слушает канал одним соединением (LISTEN)
+# и раздает события своим подписчикам. В SQLite событие раздается только в своем процессе после коммита.
+# Тем же соединением воркер слушает изменения каталога (app/catalog.py) и сбрасывает его кэш
+PAYMENT_EVENTS_CHANNEL = "payment_status"
+PAYMENT_EVENTS_LISTEN_ENABLED = os.getenv("PAYMENT_EVENTS_LISTEN_ENABLED", "1") == "1"
+# Проверка соединения LISTEN; пропущенные за время переподключения события подписчики перечитывают из БД
+PAYMENT_EVENTS_LISTEN_PING_SECONDS = float(os.getenv("PAYMENT_EVENTS_LISTEN_PING_SECONDS", "30"))
+PAYMENT_EVENTS_RECONNECT_MAX_SECONDS = float(os.getenv("PAYMENT_EVENTS_RECONNECT_MAX_SECONDS", "30"))
+# Очередь подписчика: медленный клиент теряет самые старые события, а не память воркера
+SUBSCRIBER_QUEUE_SIZE = 16
+
+# Ключ session.info с событиями, которые ждут коммита (SQLite)
+PENDING_EVENTS_KEY = "payment_status_events"
+
+
+class PaymentStatusHub:
+    # payment_id -> очереди открытых SSE-соединений этого процесса
+    def __init__(self):
+        self._subscribers = {}
+        self.published_total = 0
+        self.listening = False
+
+    def subscribe(self, payment_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(payment_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, payment_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(payment_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[payment_id]
+
+    @staticmethod
+    def _put(queue: asyncio.Queue, message: dict):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    def publish(self, message: dict):
+        for queue in self._subscribers.get(message["payment_id"], ()):
+            self._put(queue, message)
+        self.published_total += 1
+
+    def resync_all(self):
+        # После переподключения LISTEN: каждый подписчик перечитывает статус из БД
+        for payment_id, queues in self._subscribers.items():
+            for queue in queues:
+                self._put(queue, {"payment_id": payment_id, "resync": True})
+
+    def snapshot(self) -> dict:
+        return {
+            "payments": len(self._subscribers),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "published_total": self.published_total,
+            "listening": self.listening,
+        }
+
+
+payment_status_hub = PaymentStatusHub()
+
+
+async def publish_payment_status(db: AsyncSession, payment_id: int, status: str, subscription_status=None):
+    # Событие уходит подписчикам только после коммита текущей транзакции
+    message = {"payment_id": payment_id, "status": status, "subscription_status": subscription_status}
+    if (await db.connection()).dialect.name == "postgresql":
+        await db.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": PAYMENT_EVENTS_CHANNEL, "payload": json.dumps(message)},
+        )
+    else:
+        db.sync_session.info.setdefault(PENDING_EVENTS_KEY, []).append(message)
+
+
+@event.listens_for(Session, "after_commit")
+def publish_committed_events(session):
+    for message in session.info.pop(PENDING_EVENTS_KEY, ()):
+        payment_status_hub.publish(message)
+
+
+@event.listens_for(Session, "after_rollback")
+def drop_rolled_back_events(session):
+    session.info.pop(PENDING_EVENTS_KEY, None)
+
+
+def on_notification(connection, pid, channel, payload):
+    try:
+        payment_status_hub.publish(json.loads(payload))
+    except (ValueError, KeyError):
+        logger.warning(f"Malformed payment status notification: {payload[:200]}")
+
+
+def on_catalog_changed(connection, pid, channel, payload):
+    catalog_cache.invalidate()
+
+
+def listen_enabled() -> bool:
+    return PAYMENT_EVENTS_LISTEN_ENABLED and make_url(DATABASE_URL).get_backend_name() == "postgresql"
+
+
+async def run_payment_listener():
+    # Отдельное соединение вне пула: LISTEN держит его все время работы воркера
+    url = make_url(DATABASE_URL)
+    delay = 1.0
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(
+                user=url.username, password=url.password, host=url.host, port=url.port, database=url.database
+            )
+            await connection.add_listener(PAYMENT_EVENTS_CHANNEL, on_notification)
+            await connection.add_listener(CATALOG_CHANNEL, on_catalog_changed)
+            payment_status_hub.listening = True
+            payment_status_hub.resync_all()
+            # Изменения каталога за время без LISTEN пропущены: перечитываем его
+            catalog_cache.invalidate()
+            delay = 1.0
+            while True:
+                await asyncio.sleep(PAYMENT_EVENTS_LISTEN_PING_SECONDS)
+                await connection.fetchval("SELECT 1")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Payment status listener disconnected: {e}")
+        finally:
+            payment_status_hub.listening = False
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, PAYMENT_EVENTS_RECONNECT_MAX_SECONDS)
@@ -0,0 +1,153 @@
+import json
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from fastapi.responses import ORJSONResponse
+
+from app.metrics import rate_limited_requests_total
+
+# Ограничение входа и регистрации (каждый запрос - это bcrypt): корзина токенов на IP и на аккаунт.
+# Корзина вмещает BURST запросов и пополняется со скоростью PER_MINUTE в минуту
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", "20"))
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "10"))
+RATE_LIMIT_ACCOUNT_BURST = int(os.getenv("RATE_LIMIT_ACCOUNT_BURST", "5"))
+RATE_LIMIT_ACCOUNT_PER_MINUTE = float(os.getenv("RATE_LIMIT_ACCOUNT_PER_MINUTE", "5"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# Ограничиваемые маршруты -> имя правила (у входа и регистрации отдельные корзины)
+RATE_LIMITED_ROUTES = {
+    ("POST", "/api/auth/login"): "login",
+    ("POST", "/api/auth/register"): "register",
+}
+
+# Тело входа и регистрации больше этого отклоняется с 413, не дочитываясь до конца
+MAX_BODY_BYTES = 64 * 1024
+
+
+class BucketLimit:
+    def __init__(self, burst: int, per_minute: float):
+        self.capacity = burst
+        self.per_second = per_minute / 60
+
+
+class TokenBucketStore(ABC):
+    # Хранилище корзин. Общий для всех воркеров бэкенд (Redis и т.п.) реализует take атомарно
+    @abstractmethod
+    async def take(self, key: str, limit: BucketLimit) -> float:
+        # 0 - токен выдан; иначе - через сколько секунд появится следующий токен
+        ...
+
+
+class MemoryTokenBucketStore(TokenBucketStore):
+    # Корзины в памяти процесса (у каждого воркера свои). take не уступает event loop,
+    # поэтому атомарен без блокировок; давно не использованные ключи вытесняются (LRU)
+    def __init__(self, maxsize: int = RATE_LIMIT_MAX_KEYS):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+
+    async def take(self, key: str, limit: BucketLimit) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (limit.capacity, now))
+        tokens = min(limit.capacity, tokens + (now - updated_at) * limit.per_second)
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0.0
+        else:
+            retry_after = (1 - tokens) / limit.per_second
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class RateLimiter:
+    def __init__(self, store: TokenBucketStore):
+        self.store = store
+        self.ip_limit = BucketLimit(RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_PER_MINUTE)
+        self.account_limit = BucketLimit(RATE_LIMIT_ACCOUNT_BURST, RATE_LIMIT_ACCOUNT_PER_MINUTE)
+
+    async def check_ip(self, rule: str, ip: str) -> float:
+        return await self.store.take(f"{rule}:ip:{ip}", self.ip_limit)
+
+    async def check_account(self, rule: str, account: str) -> float:
+        return await self.store.take(f"{rule}:account:{account}", self.account_limit)
+
+
+# Другое хранилище подключается заменой rate_limiter.store при старте приложения
+rate_limiter = RateLimiter(MemoryTokenBucketStore())
+
+
+def account_from_body(body: bytes):
+    # Аккаунт - email из тела запроса (и у входа, и у регистрации); ошибки формата вернет сам обработчик
+    try:
+        email = json.loads(body).get("email")
+    except (ValueError, AttributeError):
+        return None
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+
+def too_many_requests(retry_after: float) -> ORJSONResponse:
+    return ORJSONResponse(
+        {"detail": "Too many requests, try again later"},
+        status_code=429,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def body_too_large() -> ORJSONResponse:
+    return ORJSONResponse({"detail": "Request body too large"}, status_code=413)
+
+
+class RateLimitMiddleware:
+    # ASGI middleware: отказ 429 до чтения пользователя из БД и до bcrypt.
+    # Сначала корзина IP (тело еще не прочитано), затем корзина аккаунта
+    def __init__(self, app, limiter: RateLimiter = rate_limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        rule = RATE_LIMITED_ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if rule is None or not RATE_LIMIT_ENABLED:
+            return await self.app(scope, receive, send)
+
+        # IP клиента; за nginx его подставляет uvicorn из X-Forwarded-For (FORWARDED_ALLOW_IPS)
+        client = scope.get("client")
+        ip = client[0] if client else "unknown"
+        retry_after = await self.limiter.check_ip(rule, ip)
+        if retry_after:
+            rate_limited_requests_total.inc(rule, "ip")
+            return await too_many_requests(retry_after)(scope, receive, send)
+
+        # Тело читается целиком (не больше MAX_BODY_BYTES) и затем передается обработчику без изменений
+        messages = []
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            body += message.get("body", b"")
+            if len(body) > MAX_BODY_BYTES:
+                return await body_too_large()(scope, receive, send)
+            more_body = message.get("more_body", False)
+
+        account = account_from_body(body)
+        if account is not None:
+            retry_after = await self.limiter.check_account(rule, account)
+            if retry_after:
+                rate_limited_requests_total.inc(rule, "account")
+                return await too_many_requests(retry_after)(scope, receive, send)
+
+        async def replay():
+            return messages.pop(0) if messages else await receive()
+
+        await self.app(scope, replay, send)
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime, timedelta
+from hashlib import blake2b
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal, upsert
+from app.models import AuthSession, RevokedToken
+
+logger = logging.getLogger(__name__)
+
+# Список отзыва токенов в памяти воркера. verify_token проверяет sid токена по фильтру Блума
+# без обращения к БД; строки revoked_tokens дочитываются фоновой задачей по возрастанию id.
+# Срабатывание фильтра подтверждается запросом к revoked_tokens: ложное срабатывание не отказывает
+# действующему токену. Истекшие строки удаляет один процесс - проход истечения (app/expiry.py)
+REVOCATION_SYNC_INTERVAL_SECONDS = float(os.getenv("REVOCATION_SYNC_INTERVAL_SECONDS", "2"))
+# Полная пересборка фильтра: из него уходят истекшие записи (удалять биты фильтр Блума не умеет)
+REVOCATION_REBUILD_INTERVAL_SECONDS = int(os.getenv("REVOCATION_REBUILD_INTERVAL_SECONDS", "300"))
+# Строки, закоммиченные позже строк с большим id, подбираются повторным чтением последних секунд
+REVOCATION_SYNC_LOOKBACK_SECONDS = int(os.getenv("REVOCATION_SYNC_LOOKBACK_SECONDS", "30"))
+REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", "100000"))
+# Каждое ложное срабатывание - лишний запрос к БД, поэтому вероятность мала
+REVOCATION_FALSE_POSITIVE_RATE = float(os.getenv("REVOCATION_FALSE_POSITIVE_RATE", "0.000001"))
+REVOCATION_SYNC_ENABLED = os.getenv("REVOCATION_SYNC_ENABLED", "1") == "1"
+REVOCATION_PURGE_BATCH_SIZE = int(os.getenv("REVOCATION_PURGE_BATCH_SIZE", "1000"))
+
+
+class BloomFilter:
+    # Биты в bytearray; k позиций из 128-битного хэша ключа двойным хешированием
+    def __init__(self, capacity: int, false_positive_rate: float):
+        self.capacity = capacity
+        self.size = max(64, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    @staticmethod
+    def _hash(key: str):
+        digest = int.from_bytes(blake2b(key.encode(), digest_size=16).digest(), "big")
+        return digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1
+
+    def add(self, key: str):
+        h1, h2 = self._hash(key)
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % self.size
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        # Для неотозванного ключа проверка обычно заканчивается на первом же нулевом бите
+        h1, h2 = self._hash(key)
+        bits = self.bits
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % self.size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class RevocationList:
+    def __init__(self, capacity: int = REVOCATION_BLOOM_CAPACITY,
+                 false_positive_rate: float = REVOCATION_FALSE_POSITIVE_RATE):
+        self.min_capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.filter = BloomFilter(capacity, false_positive_rate)
+        self.last_id = 0
+        # sid, на которых фильтр сработал ложно (проверено по БД); сбрасывается при пересборке
+        self.false_positives = set()
+        self.db_checks_total = 0
+        self.false_positives_total = 0
+        self.syncs_total = 0
+        self.rebuilds_total = 0
+        self.last_sync_at = None
+        self.last_rebuild_at = None
+        self.rebuilt_monotonic = None
+
+    async def is_revoked(self, token_id) -> bool:
+        if token_id is None or token_id not in self.filter or token_id in self.false_positives:
+            return False
+        self.db_checks_total += 1
+        async with AsyncSessionLocal() as db:
+            revoked = await db.scalar(select(RevokedToken.id).where(RevokedToken.token_id == token_id))
+        if revoked is None:
+            self.false_positives.add(token_id)
+            self.false_positives_total += 1
+            return False
+        return True
+
+    def add(self, token_ids):
+        # Отзыв в этом воркере виден сразу, в остальных - после следующей синхронизации
+        for token_id in token_ids:
+            self.filter.add(token_id)
+            self.false_positives.discard(token_id)
+
+    async def sync(self, db: AsyncSession):
+        now = datetime.utcnow()
+        rows = (await db.execute(
+            select(RevokedToken.id, RevokedToken.token_id).where(or_(
+                RevokedToken.id > self.last_id,
+                RevokedToken.created_at >= now - timedelta(seconds=REVOCATION_SYNC_LOOKBACK_SECONDS),
+            ))
+        )).all()
+        for row in rows:
+            # Отозванные в этом воркере уже добавлены в фильтр через add
+            if row.token_id not in self.filter:
+                self.filter.add(row.token_id)
+            self.false_positives.discard(row.token_id)
+            self.last_id = max(self.last_id, row.id)
+        self.syncs_total += 1
+        self.last_sync_at = now.isoformat()
+
+    async def rebuild(self, db: AsyncSession):
+        # Новый фильтр из неистекших записей подменяет старый целиком (только чтение)
+        now = datetime.utcnow()
+        rows = (await db.execute(
+            select(RevokedToken.id, RevokedToken.token_id).where(RevokedToken.expires_at > now)
+        )).all()
+        await db.commit()
+        new_filter = BloomFilter(max(self.min_capacity, 2 * len(rows)), self.false_positive_rate)
+        for row in rows:
+            new_filter.add(row.token_id)
+        self.filter = new_filter
+        self.false_positives = set()
+        self.last_id = max([self.last_id] + [row.id for row in rows])
+        self.rebuilds_total += 1
+        self.last_rebuild_at = self.last_sync_at = now.isoformat()
+        self.rebuilt_monotonic = time.monotonic()
+
+    def rebuild_due(self) -> bool:
+        return (self.rebuilt_monotonic is None
+                or time.monotonic() - self.rebuilt_monotonic >= REVOCATION_REBUILD_INTERVAL_SECONDS)
+
+    def snapshot(self) -> dict:
+        return {
+            "entries": self.filter.count,
+            "capacity": self.filter.capacity,
+            "size_bytes": len(self.filter.bits),
+            "hashes": self.filter.hashes,
+            "last_id": self.last_id,
+            "db_checks_total": self.db_checks_total,
+            "false_positives_total": self.false_positives_total,
+            "syncs_total": self.syncs_total,
+            "rebuilds_total": self.rebuilds_total,
+            "last_sync_at": self.last_sync_at,
+            "last_rebuild_at": self.last_rebuild_at,
+        }
+
+
+revocation_list = RevocationList()
+
+
+async def revoke_sessions(db: AsyncSession, sessions) -> list:
+    # Отзыв сессий в текущей транзакции; после коммита вызывающий передает
+    # возвращенные sid в revocation_list.add
+    sessions = [session for session in sessions if session.revoked_at is None]
+    if not sessions:
+        return []
+    now = datetime.utcnow()
+    for session in sessions:
+        session.revoked_at = now
+    dialect_name = (await db.connection()).dialect.name
+    await db.execute(upsert(
+        dialect_name, RevokedToken.__table__,
+        [{"token_id": session.id, "expires_at": session.expires_at, "created_at": now} for session in sessions],
+        ["token_id"],
+    ))
+    return [session.id for session in sessions]
+
+
+async def revoke_user_sessions(db: AsyncSession, user_id: int) -> list:
+    # Все действующие сессии пользователя (смена роли, принудительный выход)
+    result = await db.execute(
+        select(AuthSession).where(
+            AuthSession.user_id == user_id,
+            AuthSession.revoked_at.is_(None),
+            AuthSession.expires_at > datetime.utcnow(),
+        ).with_for_update()
+    )
+    return await revoke_sessions(db, result.scalars().all())
+
+
+async def purge_expired_revocations(db: AsyncSession, batch_size: int = REVOCATION_PURGE_BATCH_SIZE) -> int:
+    # Удаление истекших записей отзыва и сессий пачками (вызывается проходом истечения, а не
+    # каждым воркером API): токены таких сессий уже отклоняются по exp
+    now = datetime.utcnow()
+    purged = 0
+    for model in (RevokedToken, AuthSession):
+        while True:
+            ids = (await db.execute(
+                select(model.id).where(model.expires_at <= now).limit(batch_size)
+            )).scalars().all()
+            if ids:
+                await db.execute(delete(model).where(model.id.in_(ids)))
+            await db.commit()
+            purged += len(ids)
+            if len(ids) < batch_size:
+                break
+    return purged
+
+
+async def load_revocation_list():
+    async with AsyncSessionLocal() as db:
+        await revocation_list.rebuild(db)
+    logger.info(f"Revocation list loaded: {revocation_list.filter.count} entries")
+
+
+async def run_revocation_sync(interval: float = REVOCATION_SYNC_INTERVAL_SECONDS):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with AsyncSessionLocal() as db:
+                if revocation_list.rebuild_due():
+                    await revocation_list.rebuild(db)
+                else:
+                    await revocation_list.sync(db)
+        except Exception:
+            logger.exception("Revocation list sync failed")
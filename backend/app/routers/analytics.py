@@ -0,0 +1,154 @@
+from datetime import date, datetime, timedelta
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.analytics import NO_PLATFORM
+from app.catalog import catalog_cache
+from app.dependencies import require_role
+from app.replicas import get_read_db
+from app.models import ChurnDaily, PaymentTotal, RevenueDaily, SubscriptionCount, TokenClaims
+from app.models import ChurnResponse, PendingBacklogResponse, RevenueResponse, SubscribersResponse
+
+router = APIRouter()
+
+# Период по умолчанию и максимальный период для дневных отчетов
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 366
+
+# Все отчеты читают только сводные таблицы (app/analytics.py), без агрегации по подпискам и платежам;
+# изменения попадают в них после свертки приращений воркером outbox
+
+def date_range(start: Optional[date], end: Optional[date]):
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range must not exceed {MAX_RANGE_DAYS} days")
+    return start, end
+
+async def platform_key(platform_id: int):
+    # platform_id сводной таблицы -> (platform_id ответа, название платформы)
+    if platform_id == NO_PLATFORM:
+        return None, ""
+    catalog = await catalog_cache.get()
+    platform = catalog.platforms_by_id.get(platform_id)
+    return platform_id, platform["name"] if platform else f"Platform {platform_id}"
+
+def rollup_filters(model, platform_id: Optional[int], plan_name: Optional[str]) -> list:
+    conditions = []
+    if platform_id is not None:
+        conditions.append(model.platform_id == platform_id)
+    if plan_name is not None:
+        conditions.append(model.plan_name == plan_name)
+    return conditions
+
+# Подтвержденная выручка по дням, платформам и планам
+@router.get("/revenue", response_model=RevenueResponse)
+async def get_revenue(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    platform_id: Optional[int] = None,
+    plan_name: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: TokenClaims = Depends(require_role("admin"))
+):
+    start, end = date_range(start, end)
+    result = await db.execute(
+        select(RevenueDaily.day, RevenueDaily.platform_id, RevenueDaily.plan_name, RevenueDaily.payments, RevenueDaily.amount)
+        .where(RevenueDaily.day.between(start, end), *rollup_filters(RevenueDaily, platform_id, plan_name))
+        .order_by(RevenueDaily.day, RevenueDaily.platform_id, RevenueDaily.plan_name)
+    )
+    days = []
+    for row in result.all():
+        row_platform_id, platform_name = await platform_key(row.platform_id)
+        days.append({"day": row.day, "platform_id": row_platform_id, "platform_name": platform_name,
+                     "plan_name": row.plan_name, "payments": row.payments, "amount": row.amount})
+    return {
+        "start": start,
+        "end": end,
+        "days": days,
+        "total_payments": sum(day["payments"] for day in days),
+        "total_amount": sum(day["amount"] for day in days),
+    }
+
+# Текущее число подписок по статусам для каждой платформы и плана
+@router.get("/subscribers", response_model=SubscribersResponse)
+async def get_subscribers(
+    platform_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: TokenClaims = Depends(require_role("admin"))
+):
+    result = await db.execute(
+        select(SubscriptionCount.platform_id, SubscriptionCount.plan_name, SubscriptionCount.status, SubscriptionCount.subscriptions)
+        .where(SubscriptionCount.subscriptions != 0, *rollup_filters(SubscriptionCount, platform_id, None))
+        .order_by(SubscriptionCount.platform_id, SubscriptionCount.plan_name)
+    )
+    plans = {}
+    for row in result.all():
+        if row.status not in ("active", "pending", "cancelled", "expired"):
+            continue
+        key = (row.platform_id, row.plan_name)
+        if key not in plans:
+            row_platform_id, platform_name = await platform_key(row.platform_id)
+            plans[key] = {"platform_id": row_platform_id, "platform_name": platform_name, "plan_name": row.plan_name}
+        plans[key][row.status] = row.subscriptions
+    return {
+        "plans": list(plans.values()),
+        "active_total": sum(plan.get("active", 0) for plan in plans.values()),
+    }
+
+# Отток по дням: отмененные и истекшие подписки
+@router.get("/churn", response_model=ChurnResponse)
+async def get_churn(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    platform_id: Optional[int] = None,
+    plan_name: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: TokenClaims = Depends(require_role("admin"))
+):
+    start, end = date_range(start, end)
+    result = await db.execute(
+        select(ChurnDaily.day, ChurnDaily.platform_id, ChurnDaily.plan_name, ChurnDaily.status, ChurnDaily.subscriptions)
+        .where(ChurnDaily.day.between(start, end), *rollup_filters(ChurnDaily, platform_id, plan_name))
+        .order_by(ChurnDaily.day, ChurnDaily.platform_id, ChurnDaily.plan_name)
+    )
+    days = {}
+    for row in result.all():
+        key = (row.day, row.platform_id, row.plan_name)
+        if key not in days:
+            row_platform_id, platform_name = await platform_key(row.platform_id)
+            days[key] = {"day": row.day, "platform_id": row_platform_id, "platform_name": platform_name,
+                         "plan_name": row.plan_name}
+        days[key][row.status] = row.subscriptions
+    return {
+        "start": start,
+        "end": end,
+        "days": list(days.values()),
+        "cancelled_total": sum(day.get("cancelled", 0) for day in days.values()),
+        "expired_total": sum(day.get("expired", 0) for day in days.values()),
+    }
+
+# Неоплаченные платежи: число и сумма по платформам и планам
+@router.get("/pending-payments", response_model=PendingBacklogResponse)
+async def get_pending_payments(
+    db: AsyncSession = Depends(get_read_db),
+    current_user: TokenClaims = Depends(require_role("admin"))
+):
+    result = await db.execute(
+        select(PaymentTotal.platform_id, PaymentTotal.plan_name, PaymentTotal.payments, PaymentTotal.amount)
+        .where(PaymentTotal.status == "pending", PaymentTotal.payments != 0)
+        .order_by(PaymentTotal.platform_id, PaymentTotal.plan_name)
+    )
+    plans = []
+    for row in result.all():
+        row_platform_id, platform_name = await platform_key(row.platform_id)
+        plans.append({"platform_id": row_platform_id, "platform_name": platform_name, "plan_name": row.plan_name,
+                      "payments": row.payments, "amount": row.amount})
+    return {
+        "plans": plans,
+        "total_payments": sum(plan["payments"] for plan in plans),
+        "total_amount": sum(plan["amount"] for plan in plans),
+    }
@@ -1,35 +1,52 @@
+import uuid
 from functools import wraps
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from app.database import get_db
-from app.models import User, UserCreate, UserLogin, Subscription, SubscriptionCancelRequest
-from passlib.context import CryptContext
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
+from app.replicas import get_read_db
+from app.models import User, UserCreate, UserLogin, Subscription, SubscriptionCancelRequest, TokenClaims, RoleUpdateRequest
+from app.models import AuthSession, RefreshTokenRequest
+from app.models import MessageResponse, RegisterResponse, TokenResponse, UserInfo, UserPage, SubscriptionItemsResponse
 from datetime import datetime, timedelta
 from jose import jwt
-from app.dependencies import verify_token, get_current_user
-from app.routers.subscriptions import oauth2_scheme
-
-# Инициализация CryptContext для хэширования пароля
-pwd_context = CryptContext(schemes=["bcrypt", "sha256_crypt"], deprecated="auto")
+from app.dependencies import get_token_claims, require_role, verify_token
+from app.hashing import password_hasher
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate, ndjson_response
+from app.revocation import revocation_list, revoke_sessions, revoke_user_sessions
+from app.summaries import refresh_summaries
 
 router = APIRouter()
 
 SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = 14
 
-# Хешируем пароль
-def hash_password(password: str):
-    return pwd_context.hash(password)
+# Хешируем пароль (в пуле хэширования, не блокируя event loop)
+async def hash_password(password: str):
+    return await password_hasher.hash(password)
 
 # Функция для генерации JWT
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Пара токенов сессии: access-токен и refresh-токен с jti, записанным в сессии
+def issue_tokens(user: User, session: AuthSession) -> dict:
+    claims = {"sub": user.username, "user_id": user.id, "role": user.role, "sid": session.id}
+    access_token = create_access_token(data=claims)
+    refresh_token = jwt.encode(
+        {**claims, "type": "refresh", "jti": session.refresh_jti, "exp": session.expires_at},
+        SECRET_KEY, algorithm=ALGORITHM,
+    )
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer",
+            "user_id": user.id, "role": user.role}
+
 def role_required(role: str):
     def wrapper(fn):
         @wraps(fn)
@@ -43,49 +60,105 @@ def role_required(role: str):
     return wrapper
 
 # Регистрация пользователя
-@router.post("/register")
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
-    existing_user = db.query(User).filter(User.email == user.email).first()
+@router.post("/register", response_model=RegisterResponse)
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(User).where(User.email == user.email))
+    existing_user = result.scalars().first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
+    # Соединение возвращается в пул на время ожидания bcrypt
+    await db.commit()
 
-    hashed_password = hash_password(user.password)
+    hashed_password = await hash_password(user.password)
 
     new_user = User(username=user.username, email=user.email, password_hash=hashed_password, role="user")
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
 
     return {"message": "User registered successfully", "user": {"username": new_user.username, "role": new_user.role}}
 
 # Авторизация пользователя и получение токена
-@router.post("/login")
-def login_user(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if not db_user or not pwd_context.verify(user.password, db_user.password_hash):
+@router.post("/login", response_model=TokenResponse)
+async def login_user(user: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(User).where(User.email == user.email))
+    db_user = result.scalars().first()
+    if not db_user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    # Транзакция чтения завершается до bcrypt: очередь хэширования не держит соединения пула
+    # (db_user остается загруженным, expire_on_commit=False)
+    await db.commit()
+
+    is_valid, new_hash = await password_hasher.verify_and_update(user.password, db_user.password_hash)
+    if not is_valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    access_token = create_access_token(data={"sub": db_user.username, "role": db_user.role})
-    return {"access_token": access_token, "token_type": "bearer", "user_id": db_user.id, "role": db_user.role}
+    # Старые хэши (sha256_crypt) прозрачно переводим на bcrypt
+    if new_hash:
+        db_user.password_hash = new_hash
 
-@router.get("/me/")
-def get_current_user_info(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user_data = verify_token(token)
-    user = db.query(User).filter(User.email == user_data["sub"]).first()
+    # Новая сессия входа; user_id и роль в токене позволяют авторизовать запросы без обращения к БД
+    session = AuthSession(
+        id=uuid.uuid4().hex,
+        user_id=db_user.id,
+        refresh_jti=uuid.uuid4().hex,
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+    db.add(session)
+    tokens = issue_tokens(db_user, session)
+    await db.commit()
+    return tokens
+
+# Новая пара токенов по refresh-токену, без пароля и bcrypt. Refresh-токен одноразовый:
+# повторное предъявление уже замененного токена отзывает всю сессию
+@router.post("/refresh", response_model=TokenResponse)
+async def refresh_tokens(request: RefreshTokenRequest, db: AsyncSession = Depends(get_async_db)):
+    payload = await verify_token(request.refresh_token, token_type="refresh")
+    result = await db.execute(select(AuthSession).where(AuthSession.id == payload.get("sid")).with_for_update())
+    session = result.scalars().first()
+    if not session or session.revoked_at is not None or session.expires_at <= datetime.utcnow():
+        raise HTTPException(status_code=401, detail="Session has expired, please log in again")
+
+    if session.refresh_jti != payload.get("jti"):
+        revoked = await revoke_sessions(db, [session])
+        await db.commit()
+        revocation_list.add(revoked)
+        raise HTTPException(status_code=401, detail="Session has expired, please log in again")
+
+    # Роль берется из БД: после ее смены новые токены выдаются уже с новой ролью
+    user = await db.get(User, session.user_id)
     if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return {"username": user.username, "role": user.role}
+        raise HTTPException(status_code=401, detail="Session has expired, please log in again")
+    session.refresh_jti = uuid.uuid4().hex
+    tokens = issue_tokens(user, session)
+    await db.commit()
+    return tokens
 
-@router.get("/admin-only/")
+# Выход: сессия отзывается вместе с ее access- и refresh-токенами
+@router.post("/logout", response_model=MessageResponse)
+async def logout_user(db: AsyncSession = Depends(get_async_db), current_user: TokenClaims = Depends(get_token_claims)):
+    if current_user.session_id:
+        result = await db.execute(
+            select(AuthSession).where(AuthSession.id == current_user.session_id).with_for_update()
+        )
+        revoked = await revoke_sessions(db, result.scalars().all())
+        await db.commit()
+        revocation_list.add(revoked)
+    return {"message": "Logged out"}
+
+@router.get("/me/", response_model=UserInfo)
+def get_current_user_info(current_user: TokenClaims = Depends(get_token_claims)):
+    return {"username": current_user.username, "role": current_user.role}
+
+@router.get("/admin-only/", response_model=MessageResponse)
 def admin_only(token: str = Depends(role_required("admin"))):
     return {"message": "You are an admin!"}
 
-@router.post("/users/{user_id}/subscriptions/cancel")
+@router.post("/users/{user_id}/subscriptions/cancel", response_model=MessageResponse)
 async def cancel_user_subscription(
     user_id: int,
     request: SubscriptionCancelRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: TokenClaims = Depends(get_token_claims)
 ):
 
     subscription_id = request.subscription_id
@@ -95,10 +168,11 @@ async def cancel_user_subscription(
         raise HTTPException(status_code=403, detail="You don't have permission to access this resource")
 
     # Проверка существования подписки
-    subscription = db.query(Subscription).filter(
+    result = await db.execute(select(Subscription).where(
         Subscription.id == subscription_id,
         Subscription.user_id == user_id
-    ).first()
+    ))
+    subscription = result.scalars().first()
 
     if not subscription:
         raise HTTPException(status_code=404, detail="Subscription not found")
@@ -109,19 +183,29 @@ async def cancel_user_subscription(
 
     # Отмена подписки
     subscription.status = "cancelled"
-    db.commit()
+    await refresh_summaries(db, [user_id])
+    await db.commit()
 
     return {"message": f"Subscription {subscription_id} cancelled successfully"}
 
 # Эндпоинт для получения подписок пользователя (доступен только администраторам)
-@router.get("/users/{user_id}/subscriptions")
-async def get_user_subscriptions(user_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.get("/users/{user_id}/subscriptions", response_model=SubscriptionItemsResponse)
+async def get_user_subscriptions(user_id: int, db: AsyncSession = Depends(get_read_db), current_user: TokenClaims = Depends(get_token_claims)):
     # Проверка роли текущего пользователя
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="You don't have permission to access this resource")
 
-    # Получение подписок пользователя
-    subscriptions = db.query(Subscription).filter(Subscription.user_id == user_id).all()
+    # Получение подписок пользователя (только нужные колонки, без ORM-объектов)
+    result = await db.execute(
+        select(
+            Subscription.id,
+            Subscription.plan_name,
+            Subscription.start_date,
+            Subscription.end_date,
+            Subscription.status,
+        ).where(Subscription.user_id == user_id)
+    )
+    subscriptions = result.all()
 
     if not subscriptions:
         return {"subscriptions": []}
@@ -140,18 +224,70 @@ async def get_user_subscriptions(user_id: int, db: Session = Depends(get_db), cu
         ]
     }
 
-@router.get("/users")
-async def get_users(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+# Колонки пользователя для списков и выгрузки
+USER_COLUMNS = (User.id, User.username, User.email, User.role)
+
+def user_to_dict(user):
+    return {"id": user.id, "username": user.username, "email": user.email, "role": user.role}
+
+@router.get("/users", response_model=UserPage)
+async def get_users(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: TokenClaims = Depends(get_token_claims)
+):
     # Проверка роли текущего пользователя
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="You don't have permission to access this resource")
 
-    # Получение списка всех пользователей
-    users = db.query(User).all()
+    # Страница пользователей по курсору
+    users, next_cursor = await paginate(db, select(*USER_COLUMNS), User.id, limit, cursor)
 
     return {
-        "users": [
-            {"id": user.id, "username": user.username, "email": user.email, "role": user.role}
-            for user in users
-        ]
+        "users": [user_to_dict(user) for user in users],
+        "next_cursor": next_cursor
     }
+
+# Полная выгрузка пользователей в NDJSON
+@router.get("/users/export")
+async def export_users(current_user: TokenClaims = Depends(get_token_claims)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="You don't have permission to access this resource")
+
+    return ndjson_response(select(*USER_COLUMNS).order_by(User.id), user_to_dict, "users.ndjson")
+
+# Смена роли пользователя (только для администраторов)
+@router.put("/users/{user_id}/role", response_model=MessageResponse)
+async def update_user_role(
+    user_id: int,
+    request: RoleUpdateRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: TokenClaims = Depends(get_token_claims)
+):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="You don't have permission to access this resource")
+
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    user.role = request.role
+    # Токены со старой ролью отзываются, пользователь входит заново
+    revoked = await revoke_user_sessions(db, user_id)
+    await db.commit()
+    revocation_list.add(revoked)
+
+    return {"message": f"Role of user {user_id} changed to {request.role}"}
+
+# Принудительный выход пользователя из всех сессий (только для администраторов)
+@router.post("/users/{user_id}/revoke-tokens", response_model=MessageResponse)
+async def revoke_user_tokens(
+    user_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: TokenClaims = Depends(require_role("admin"))
+):
+    revoked = await revoke_user_sessions(db, user_id)
+    await db.commit()
+    revocation_list.add(revoked)
+    return {"message": f"{len(revoked)} sessions of user {user_id} revoked"}
@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import async_engine, pool_metrics
+from app.dependencies import require_role
+from app.expiry import load_expiry_metrics
+from app.outbox import outbox_metrics
+from app.replicas import replica_router, get_read_db
+from app.payment_events import payment_status_hub
+from app.revocation import revocation_list
+from app.models import ExpiryMetricsResponse, PoolMetricsResponse, ReplicaRouterStatus, OutboxEvent, OutboxMetricsResponse
+from app.models import RollupDelta
+from app.models import RevocationMetricsResponse, PaymentEventsMetricsResponse
+
+# Метрики процесса доступны только администраторам
+router = APIRouter(dependencies=[Depends(require_role("admin"))])
+
+# Итоги фонового истечения подписок (пишет сервис истечения, читаются из БД)
+@router.get("/expiry", response_model=ExpiryMetricsResponse)
+async def get_expiry_metrics(db: AsyncSession = Depends(get_read_db)):
+    return await load_expiry_metrics(db)
+
+# Насыщенность пула соединений текущего процесса
+@router.get("/pool", response_model=PoolMetricsResponse, response_model_exclude_none=True)
+def get_pool_metrics():
+    return pool_metrics.snapshot(async_engine.pool)
+
+# Состояние реплик для чтения: здоровье, отставание, число переключений на primary
+@router.get("/replicas", response_model=ReplicaRouterStatus)
+def get_replica_metrics():
+    return replica_router.snapshot()
+
+# Фильтр отозванных сессий этого процесса: размер, синхронизация с revoked_tokens
+@router.get("/revocation", response_model=RevocationMetricsResponse)
+def get_revocation_metrics():
+    return revocation_list.snapshot()
+
+# Открытые SSE-соединения статусов платежей этого процесса и состояние LISTEN
+@router.get("/payment-events", response_model=PaymentEventsMetricsResponse)
+def get_payment_events_metrics():
+    return payment_status_hub.snapshot()
+
+# Очередь outbox: метрики воркера этого процесса, число необработанных и проваленных событий
+# и несвернутых приращений аналитики
+@router.get("/outbox", response_model=OutboxMetricsResponse)
+async def get_outbox_metrics(db: AsyncSession = Depends(get_read_db)):
+    result = await db.execute(
+        select(OutboxEvent.status, func.count())
+        .where(OutboxEvent.status.in_(("pending", "failed")))
+        .group_by(OutboxEvent.status)
+    )
+    counts = dict(result.all())
+    deltas = await db.scalar(select(func.count()).select_from(RollupDelta))
+    return {**outbox_metrics, "pending": counts.get("pending", 0), "failed": counts.get("failed", 0),
+            "rollup_deltas_pending": deltas}
@@ -1,85 +1,234 @@
-from datetime import datetime, timedelta
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from app.database import get_db
-from app.models import Payment, Subscription, PaymentRequest, PaymentRecord, ConfirmPaymentRequest
-import random
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, Header
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal, get_async_db
+from app.replicas import get_read_db
+from app.dependencies import require_role
+from app.idempotency import validate_key, get_stored_response, commit_with_key, request_fingerprint
+from app.outbox import enqueue_event
+from app.models import Payment, Subscription, PaymentRequest, PaymentRecord, ConfirmPaymentRequest, TokenClaims
+from app.models import PaymentPage, CheckoutSessionResponse, PaymentConfirmedResponse
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate, ndjson_response
+from app.payment_events import payment_status_hub, publish_payment_status
+from app.summaries import refresh_summaries
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-# Запрос для получения всех платежей
-@router.get("/")
-def list_all_payments(db: Session = Depends(get_db)):
-    payments = db.query(Payment).all()
-    if not payments:
-        return {"message": "No payments found"}
-    return payments
+# Поток статуса платежа (SSE): сколько он может быть открыт и как часто шлется keepalive
+PAYMENT_EVENTS_TIMEOUT_SECONDS = int(os.getenv("PAYMENT_EVENTS_TIMEOUT_SECONDS", "600"))
+PAYMENT_EVENTS_KEEPALIVE_SECONDS = float(os.getenv("PAYMENT_EVENTS_KEEPALIVE_SECONDS", "15"))
 
-@router.post("/create-checkout-session")
-def create_checkout_session(payment: PaymentRequest, db: Session = Depends(get_db)):  # Исправлено
+# Колонки платежа для списков и выгрузки
+PAYMENT_COLUMNS = (Payment.id, Payment.user_id, Payment.subscription_id, Payment.plan_name, Payment.amount, Payment.status)
+
+def payment_to_dict(payment):
+    return {
+        "id": payment.id,
+        "user_id": payment.user_id,
+        "subscription_id": payment.subscription_id,
+        "plan_name": payment.plan_name,
+        "amount": payment.amount,
+        "status": payment.status,
+    }
+
+# Список платежей постранично (только для администраторов)
+@router.get("/", response_model=PaymentPage)
+async def list_all_payments(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: TokenClaims = Depends(require_role("admin"))
+):
+    payments, next_cursor = await paginate(db, select(*PAYMENT_COLUMNS), Payment.id, limit, cursor)
+    return {"payments": [payment_to_dict(payment) for payment in payments], "next_cursor": next_cursor}
+
+# Полная выгрузка платежей в NDJSON
+@router.get("/export")
+async def export_payments(current_user: TokenClaims = Depends(require_role("admin"))):
+    return ndjson_response(select(*PAYMENT_COLUMNS).order_by(Payment.id), payment_to_dict, "payments.ndjson")
+
+# Создание платежа в текущей транзакции (без коммита), id выдает последовательность БД.
+# Уведомления и вебхуки о новом платеже выполняет воркер outbox
+async def add_payment(db: AsyncSession, user_id: int, plan_name: str, amount: int, subscription_id: int) -> Payment:
+    new_payment = Payment(
+        user_id=user_id,
+        plan_name=plan_name,
+        amount=amount,
+        status="pending",
+        subscription_id=subscription_id
+    )
+    db.add(new_payment)
+    await db.flush()
+    enqueue_event(db, "payment.created", {
+        "payment_id": new_payment.id,
+        "user_id": user_id,
+        "subscription_id": subscription_id,
+        "plan_name": plan_name,
+        "amount": amount,
+    })
+    return new_payment
+
+# Фейковый URL оплаты: передается непредсказуемый токен, а не последовательный id
+def checkout_url(payment: Payment) -> str:
+    return f"http://176.108.250.41:80/checkout.html?token={payment.public_token}"
+
+@router.post("/create-checkout-session", response_model=CheckoutSessionResponse)
+async def create_checkout_session(
+    payment: PaymentRequest,
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None)
+):
     # Логируем входящие данные
-    print(
+    logger.info(
         f"Received payment request: user_id={payment.user_id}, plan_name={payment.plan_name}, amount={payment.amount}"
     )
+    validate_key(idempotency_key)
+    request_hash = request_fingerprint(payment)
+    stored = await get_stored_response(db, "create-checkout-session", idempotency_key, payment.user_id, request_hash)
+    if stored is not None:
+        return stored
+
     # Проверяем корректность суммы
     if payment.amount <= 0:
         raise HTTPException(status_code=400, detail="Invalid payment amount")
     # Привязка к подписке
-    subscription = db.query(Subscription).filter(
+    result = await db.execute(select(Subscription.id).where(
         Subscription.user_id == payment.user_id,
         Subscription.plan_name == payment.plan_name
-    ).first()
-    if not subscription:
+    ))
+    subscription_id = result.scalars().first()
+    if not subscription_id:
         raise HTTPException(status_code=404, detail="Subscription not found")
-    subscription_id = subscription.id  # Получаем ID подписки
-    print(f"Found subscription_id: {subscription_id}")
-    # Генерация платежа
-    payment_id = random.randint(100000, 999999)
-    new_payment = Payment(
-        id=payment_id,
-        user_id=payment.user_id,
-        plan_name=payment.plan_name,
-        amount=payment.amount,
-        status="pending",
-        subscription_id=subscription_id  # Используем ID подписки
-    )
+    logger.debug(f"Found subscription_id: {subscription_id}")
+
     try:
-        db.add(new_payment)
-        db.commit()
-        db.refresh(new_payment)  # Обновляем объект из базы
+        new_payment = await add_payment(db, payment.user_id, payment.plan_name, payment.amount, subscription_id)
+        await refresh_summaries(db, [payment.user_id])
+        url = checkout_url(new_payment)
+        response = await commit_with_key(db, "create-checkout-session", idempotency_key, {
+            "url": url, "payment_id": new_payment.id, "token": new_payment.public_token
+        }, payment.user_id, request_hash)
+    except HTTPException:
+        # Ошибки ключа идемпотентности (422) отдаются клиенту как есть
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
-        print(f"Error creating payment: {e}")
+        await db.rollback()
+        logger.exception(f"Error creating payment: {e}")
         raise HTTPException(status_code=500, detail="Failed to create payment")
 
-    # Генерация фейкового URL
-    fake_url = f"http://176.108.250.41:80/checkout.html?payment_id={payment_id}"
-    print(f"Payment created successfully. Redirect URL: {fake_url}")
-    return {"url": fake_url, "payment_id": payment_id}
+    logger.info(f"Payment {response['payment_id']} created for user {payment.user_id}")
+    return response
 
-@router.post("/confirm-payment")
-def confirm_payment(request: ConfirmPaymentRequest, db: Session = Depends(get_db)):
-    print(f"Confirming payment with payment_id {request.payment_id}")
+@router.post("/confirm-payment", response_model=PaymentConfirmedResponse)
+async def confirm_payment(
+    request: ConfirmPaymentRequest,
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None)
+):
+    validate_key(idempotency_key)
+    # Ключи подтверждения не привязаны к пользователю: повтор допустим только для того же токена
+    request_hash = request_fingerprint(request)
+    stored = await get_stored_response(db, "confirm-payment", idempotency_key, request_hash=request_hash)
+    if stored is not None:
+        return stored
 
-    # Поиск платежа в БД
-    payment = db.query(Payment).filter(Payment.id == request.payment_id).first()
+    # Поиск платежа по публичному токену с блокировкой строки: параллельные подтверждения
+    # одного платежа выполняются по очереди, и только первое меняет данные
+    result = await db.execute(select(Payment).where(Payment.public_token == request.token).with_for_update())
+    payment = result.scalars().first()
 
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
+    logger.info(f"Confirming payment with payment_id {payment.id}")
+
+    response = {"message": "Payment confirmed, subscription activation pending", "payment_id": payment.id}
+    if payment.status == "confirmed":
+        # Повторное подтверждение: ничего не пишем
+        await db.rollback()
+        return response
 
-    # Обновление статуса платежа
+    # Статус платежа и событие outbox пишутся в одной транзакции; активацию подписки,
+    # пересчет сводки, уведомления и вебхуки выполняет воркер (app/outbox.py)
     payment.status = "confirmed"
-    db.commit()
-
-    # Обновление статуса подписки, если платеж подтвержден
-    subscription = db.query(Subscription).filter(Subscription.id == payment.subscription_id).first()
-    if subscription:
-        subscription.status = "active"
-        if subscription.end_date < datetime.utcnow().date():
-            subscription.end_date = datetime.utcnow() + timedelta(days=30)
-        db.commit()
-        print(f"Payment {request.payment_id} confirmed. Subscription {subscription.id} activated.")
-    else:
-        print(f"No subscription found for payment {request.payment_id}")
-
-    return {"message": "Payment confirmed and subscription activated"}
+    payment.confirmed_at = datetime.utcnow()
+    enqueue_event(db, "payment.confirmed", {
+        "payment_id": payment.id,
+        "user_id": payment.user_id,
+        "subscription_id": payment.subscription_id,
+    })
+    # Статус подписки станет известен после активации воркером
+    await publish_payment_status(db, payment.id, "confirmed")
+
+    response = await commit_with_key(db, "confirm-payment", idempotency_key, response, request_hash=request_hash)
+    logger.info(f"Payment {payment.id} confirmed, subscription activation queued")
+    return response
+
+# Текущий статус платежа и его подписки; платеж ищется по id и публичному токену
+async def load_payment_status(payment_id: int, token: str):
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(Payment.status, Subscription.status)
+            .outerjoin(Subscription, Subscription.id == Payment.subscription_id)
+            .where(Payment.id == payment_id, Payment.public_token == token)
+        )).first()
+    if row is None:
+        return None
+    return {"payment_id": payment_id, "status": row[0], "subscription_status": row[1]}
+
+def payment_status_final(message: dict) -> bool:
+    return message["status"] == "confirmed" and message["subscription_status"] == "active"
+
+def sse_message(message: dict) -> str:
+    return f"event: status\ndata: {json.dumps(message)}\n\n"
+
+async def payment_status_stream(payment_id: int, token: str, queue: asyncio.Queue, message: dict):
+    # Соединение ждет событий из очереди без запросов к БД; закрывается после активации подписки
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + PAYMENT_EVENTS_TIMEOUT_SECONDS
+    try:
+        yield "retry: 5000\n\n"
+        yield sse_message(message)
+        while not payment_status_final(message):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                message = await asyncio.wait_for(queue.get(), min(PAYMENT_EVENTS_KEEPALIVE_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if message.get("resync"):
+                message = await load_payment_status(payment_id, token)
+                if message is None:
+                    return
+            yield sse_message(message)
+    finally:
+        payment_status_hub.unsubscribe(payment_id, queue)
+
+# Статус платежа для страницы оплаты (Server-Sent Events). Доступ - по публичному токену платежа из ссылки
+@router.get("/{payment_id}/events")
+async def payment_events(payment_id: int, token: str):
+    # Подписка оформляется до чтения статуса, чтобы не пропустить изменение между ними
+    queue = payment_status_hub.subscribe(payment_id)
+    try:
+        message = await load_payment_status(payment_id, token)
+    except Exception:
+        payment_status_hub.unsubscribe(payment_id, queue)
+        raise
+    if message is None:
+        payment_status_hub.unsubscribe(payment_id, queue)
+        raise HTTPException(status_code=404, detail="Payment not found")
+    return StreamingResponse(
+        payment_status_stream(payment_id, token, queue, message),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
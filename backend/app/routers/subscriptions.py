@@ -1,15 +1,27 @@
 import logging
 from functools import wraps
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Header
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, delete, func, and_, case
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import Subscription, Payment, SubscriptionCancelRequest, SubscriptionResponse
 from datetime import datetime, timedelta
-from app.database import get_db
-from app.dependencies import get_current_user
-from app.dependencies import get_current_user_info
-from app.models import User, Platform, PlatformSubscriptionRequest, SubscriptionCreate
-from app.routers.payments import PaymentRequest
+from app.database import get_async_db
+from app.replicas import get_read_db
+from app.catalog import GENERIC_PLANS, catalog_cache, cached_json_response, make_etag, notify_catalog_changed
+from app.dependencies import get_token_claims, require_role
+from app.models import Platform, Plan, PlanItem, PlatformSubscriptionRequest, SubscriptionCreate, TokenClaims
+from app.models import (
+    GenericPlansResponse, SubscriptionCreatedResponse, SubscriptionStatusResponse, SubscriptionCancelledResponse,
+    ActiveSubscriptionsResponse, ExpiredSubscriptionsResponse, SubscriptionExtendedResponse, PlatformSubscriptionResponse,
+    PlatformDetailsResponse, PlansUpdatedResponse, PlatformsResponse, SubscriptionSummaryResponse, SubscriptionListResponse,
+    BulkSubscriptionRequest, BulkSubscriptionResponse,
+)
+from app.idempotency import validate_key, get_stored_response, commit_with_key, request_fingerprint
+from app.routers.payments import add_payment, checkout_url
+from app.summaries import load_summary, refresh_summaries
+from app.bulk import bulk_update_subscriptions
 
 router = APIRouter()
 
@@ -18,25 +30,23 @@ logger = logging.getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_current_user_role(token: str = Depends(oauth2_scheme)):
-    user = get_current_user_info(token)
-    return user.role
+def get_current_user_role(current_user: TokenClaims = Depends(get_token_claims)):
+    return current_user.role
 
-@router.get("/plans")
-def get_subscription_plans():
+# Общий список планов не меняется, поэтому ETag считается один раз
+GENERIC_PLANS_RESPONSE = {"plans": GENERIC_PLANS}
+GENERIC_PLANS_ETAG = make_etag(GENERIC_PLANS_RESPONSE)
+
+@router.get("/plans", response_model=GenericPlansResponse)
+def get_subscription_plans(request: Request):
     # Список доступных планов подписки
-    plans = [
-        {"id": 1, "name": "Basic", "price": 10, "duration_days": 30},
-        {"id": 2, "name": "Pro", "price": 20, "duration_days": 60},
-        {"id": 3, "name": "Premium", "price": 30, "duration_days": 90},
-    ]
-    return {"plans": plans}
+    return cached_json_response(request, GENERIC_PLANS_RESPONSE, GENERIC_PLANS_ETAG, "public, max-age=3600")
 
-@router.post("/")
-def create_subscription(
+@router.post("/", response_model=SubscriptionCreatedResponse)
+async def create_subscription(
     subscription: SubscriptionCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: TokenClaims = Depends(get_token_claims)
 ):
     logger.info(f"Received request for subscription creation: {subscription}")
 
@@ -45,16 +55,17 @@ def create_subscription(
         raise HTTPException(status_code=401, detail="Unauthorized")
 
     # Проверка на существующую подписку
-    existing_subscription = db.query(Subscription).filter(
+    result = await db.execute(select(Subscription).where(
         Subscription.user_id == current_user.id,
         Subscription.plan_name == subscription.plan_name,
         Subscription.status == "active"
-    ).first()
+    ))
+    existing_subscription = result.scalars().first()
     if existing_subscription:
         raise HTTPException(status_code=400, detail="User already has an active subscription for this plan")
 
     # Расчет даты начала и окончания подписки
-    start_date = datetime.utcnow()
+    start_date = datetime.utcnow().date()
     end_date = start_date + timedelta(days=subscription.duration_days)
 
     # Создание нового объекта подписки
@@ -68,12 +79,11 @@ def create_subscription(
 
     try:
         db.add(new_subscription)
-        db.commit()
-        db.refresh(new_subscription)
+        await db.commit()
         logger.info(f"Subscription created successfully for user: {current_user.id}")
     except Exception as e:
         logger.error(f"Failed to create subscription for user {current_user.id}: {str(e)}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Internal server error while creating subscription")
 
     return {
@@ -87,25 +97,27 @@ def create_subscription(
         }
     }
 
-def get_user_subscriptions(
-        db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_user),
+async def get_user_subscriptions(
+        db: AsyncSession = Depends(get_async_db),
+        current_user: TokenClaims = Depends(get_token_claims),
 ):
     # Получаем все подписки текущего пользователя
-    subscriptions = db.query(Subscription).filter(Subscription.user_id == current_user.id).all()
+    result = await db.execute(select(Subscription).where(Subscription.user_id == current_user.id))
+    subscriptions = result.scalars().all()
 
     if not subscriptions:
         raise HTTPException(status_code=404, detail="No subscriptions found for this user")
 
     return {"subscriptions": subscriptions}
 
-@router.post("/check-status/{subscription_id}")
-def check_subscription_status(subscription_id: int, db: Session = Depends(get_db)):
+@router.post("/check-status/{subscription_id}", response_model=SubscriptionStatusResponse)
+async def check_subscription_status(subscription_id: int, db: AsyncSession = Depends(get_async_db)):
     logger.info(f"Checking status for subscription {subscription_id}")
 
     try:
         # Ищем подписку по ID
-        subscription = db.query(Subscription).filter(Subscription.id == subscription_id).first()
+        result = await db.execute(select(Subscription).where(Subscription.id == subscription_id))
+        subscription = result.scalars().first()
         if not subscription:
             logger.error(f"Subscription not found for ID {subscription_id}")
             raise HTTPException(status_code=404, detail="Subscription not found")
@@ -115,7 +127,8 @@ def check_subscription_status(subscription_id: int, db: Session = Depends(get_db
             subscription.status = "expired"
 
         # Ищем платеж для подписки
-        payment = db.query(Payment).filter(Payment.subscription_id == subscription_id).first()
+        result = await db.execute(select(Payment).where(Payment.subscription_id == subscription_id))
+        payment = result.scalars().first()
         if payment:
             # Проверка статуса платежа
             if payment.status != "confirmed":
@@ -123,7 +136,8 @@ def check_subscription_status(subscription_id: int, db: Session = Depends(get_db
         else:
             logger.info(f"No payment found for subscription {subscription_id}")
 
-        db.commit()  # Сохраняем изменения в базе данных
+        await refresh_summaries(db, [subscription.user_id])
+        await db.commit()  # Сохраняем изменения в базе данных
 
         logger.info(f"Subscription {subscription_id} status updated to {subscription.status}")
 
@@ -136,19 +150,20 @@ def check_subscription_status(subscription_id: int, db: Session = Depends(get_db
 def role_required(role: str):
     def wrapper(fn):
         @wraps(fn)
-        async def inner(*args, current_user: User = Depends(get_current_user), **kwargs):
+        async def inner(*args, current_user: TokenClaims = Depends(get_token_claims), **kwargs):
             if current_user.role != role:
                 raise HTTPException(status_code=403, detail="You don't have permission")
             return await fn(*args, **kwargs)
         return inner
     return wrapper
 
-@router.post("/cancel_subscription")
+@router.post("/cancel_subscription", response_model=SubscriptionCancelledResponse)
 @role_required("admin")
-async def cancel_subscription(subscription_data: SubscriptionCancelRequest, db: Session = Depends(get_db),
-                              current_user: User = Depends(get_current_user), token: str = Depends(oauth2_scheme)):
+async def cancel_subscription(subscription_data: SubscriptionCancelRequest, db: AsyncSession = Depends(get_async_db),
+                              current_user: TokenClaims = Depends(get_token_claims), token: str = Depends(oauth2_scheme)):
     # Можно отменить подписку как администратор для любого пользователя
-    subscription = db.query(Subscription).filter(Subscription.id == subscription_data.subscription_id).first()
+    result = await db.execute(select(Subscription).where(Subscription.id == subscription_data.subscription_id))
+    subscription = result.scalars().first()
 
     if not subscription:
         raise HTTPException(status_code=404, detail="Subscription not found")
@@ -156,182 +171,176 @@ async def cancel_subscription(subscription_data: SubscriptionCancelRequest, db:
     # Если подписка активна, отменяем
     if subscription.status == "active":
         subscription.status = "cancelled"
-        db.commit()
+        await refresh_summaries(db, [subscription.user_id])
+        await db.commit()
         return {"msg": "Subscription cancelled successfully"}
 
     raise HTTPException(status_code=400, detail="Subscription already cancelled")
 
-def update_subscription_statuses(db: Session):
-    current_date = datetime.utcnow().date()
-    subscriptions = db.query(Subscription).filter(Subscription.status == "active").all()
-    for subscription in subscriptions:
-        if subscription.end_date < current_date:
-            subscription.status = "expired"
-    db.commit()
+# Колонки для списков подписок: проекция вместо ORM-объектов, имя платформы через JOIN
+def subscription_listing_query(user_id: int, status: str):
+    return (
+        select(
+            Subscription.id,
+            Subscription.plan_name,
+            Subscription.start_date,
+            Subscription.end_date,
+            Subscription.status,
+            Platform.name.label("platform_name"),
+        )
+        .outerjoin(Platform, Platform.id == Subscription.platform_id)
+        .where(Subscription.user_id == user_id, Subscription.status == status)
+    )
 
-@router.get("/active")
-def get_active_subscriptions(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    print(f"Fetching active subscriptions for user: {current_user.id}")
-    update_subscription_statuses(db)
-    subscriptions = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id,
-        Subscription.status == "active"
-    ).all()
-
-    result = []
-    for sub in subscriptions:
-        result.append({
-            "id": sub.id,
-            "plan_name": sub.plan_name,
-            "start_date": sub.start_date,
-            "end_date": sub.end_date,
-            "status": sub.status,
-            "platform_name": sub.platform.name if sub.platform else "N/A"  # Извлечение имени платформы
-        })
-    return {"subscriptions": result}
-
-@router.get("/expired")
-def get_expired_subscriptions(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    update_subscription_statuses(db)
-    expired_subscriptions = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id,
-        Subscription.status == "expired"
-    ).all()
+@router.get("/active", response_model=ActiveSubscriptionsResponse)
+async def get_active_subscriptions(db: AsyncSession = Depends(get_read_db), current_user: TokenClaims = Depends(get_token_claims)):
+    logger.debug(f"Fetching active subscriptions for user: {current_user.id}")
+    result = await db.execute(subscription_listing_query(current_user.id, "active"))
+
+    return {
+        "subscriptions": [
+            {
+                "id": row.id,
+                "plan_name": row.plan_name,
+                "start_date": row.start_date,
+                "end_date": row.end_date,
+                "status": row.status,
+                "platform_name": row.platform_name or "N/A"
+            }
+            for row in result
+        ]
+    }
+
+@router.get("/expired", response_model=ExpiredSubscriptionsResponse)
+async def get_expired_subscriptions(current_user: TokenClaims = Depends(get_token_claims), db: AsyncSession = Depends(get_read_db)):
+    result = await db.execute(subscription_listing_query(current_user.id, "expired"))
 
     return {
         "expired_subscriptions": [
             {
-                "id": sub.id,
-                "plan_name": sub.plan_name,
-                "start_date": sub.start_date,
-                "end_date": sub.end_date,
-                "platform_name": sub.platform.name if sub.platform else None,  # Добавлено
-                "status": sub.status
+                "id": row.id,
+                "plan_name": row.plan_name,
+                "start_date": row.start_date,
+                "end_date": row.end_date,
+                "platform_name": row.platform_name,
+                "status": row.status
             }
-            for sub in expired_subscriptions
+            for row in result
         ]
     }
 
-@router.post("/extend")
-def extend_subscription(subscription_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    subscription = db.query(Subscription).filter(
+@router.post("/extend", response_model=SubscriptionExtendedResponse)
+async def extend_subscription(subscription_id: int, db: AsyncSession = Depends(get_async_db), current_user: TokenClaims = Depends(get_token_claims)):
+    result = await db.execute(select(Subscription).where(
         Subscription.id == subscription_id,
         Subscription.user_id == current_user.id
-    ).first()
+    ))
+    subscription = result.scalars().first()
     if not subscription or subscription.status != "active":
         raise HTTPException(status_code=404, detail="Subscription not found or not active")
 
     # Продлеваем срок действия подписки
     subscription.end_date += timedelta(days=30)
-    db.commit()
-    return {"message": "Subscription extended successfully", "subscription": subscription}
+    await refresh_summaries(db, [subscription.user_id])
+    await db.commit()
+    return {"message": "Subscription extended successfully", "subscription": SubscriptionResponse.model_validate(subscription)}
 
-@router.post("/platforms/{platform_id}/subscribe")
-def subscribe_to_platform(
+@router.post("/platforms/{platform_id}/subscribe", response_model=PlatformSubscriptionResponse)
+async def subscribe_to_platform(
     platform_id: int,
     request: PlatformSubscriptionRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: TokenClaims = Depends(get_token_claims),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    platform = db.query(Platform).filter(Platform.id == platform_id).first()
-    if not platform:
+    # Повтор запроса с тем же ключом возвращает уже созданную подписку и платеж
+    validate_key(idempotency_key)
+    request_hash = request_fingerprint(platform_id, request)
+    stored = await get_stored_response(db, "subscribe", idempotency_key, current_user.id, request_hash)
+    if stored is not None:
+        return stored
+
+    catalog = await catalog_cache.get()
+    if platform_id not in catalog.platforms_by_id:
         raise HTTPException(status_code=404, detail="Platform not found")
 
-    # Проверяем существующую активную подписку
-    existing_subscription = db.query(Subscription).filter(
-        Subscription.user_id == current_user.id,
-        Subscription.platform_id == platform_id,
-        Subscription.status == "active"
-    ).first()
-
-    if existing_subscription:
-        # Меняем статус существующей подписки на 'cancelled'
-        existing_subscription.status = "cancelled"
-        db.commit()
-        logger.info(f"Subscription (ID: {existing_subscription.id}) for user {current_user.id} cancelled")
-
-    # Создаем новую подписку
-    start_date = datetime.utcnow()
-    end_date = start_date + timedelta(days=request.duration_days)
-    new_subscription = Subscription(
-        user_id=current_user.id,
-        platform_id=platform_id,
-        plan_name=request.plan_name,
-        start_date=start_date,
-        end_date=end_date,
-        status="pending"
-    )
-    db.add(new_subscription)
-    db.commit()
-    db.refresh(new_subscription)
-
-    # Создаем платеж
-    payment_amount = request.duration_days * 10  # Пример расчета суммы
-    payment_request = PaymentRequest(
-        user_id=current_user.id,
-        plan_name=request.plan_name,
-        amount=payment_amount,
-        subscription_id=new_subscription.id
-    )
-
+    # Отмена текущей активной подписки, новая подписка и платеж - одна транзакция
     try:
-        # Вызов метода create_checkout_session для создания платежа
-        from app.routers.payments import create_checkout_session  # Импортируем метод платежа
-        payment_response = create_checkout_session(payment_request, db)
+        # Меняем статус существующей активной подписки на 'cancelled'
+        result = await db.execute(
+            update(Subscription)
+            .where(
+                Subscription.user_id == current_user.id,
+                Subscription.platform_id == platform_id,
+                Subscription.status == "active"
+            )
+            .values(status="cancelled")
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            logger.info(f"Active subscription on platform {platform_id} for user {current_user.id} cancelled")
+
+        # Создаем новую подписку
+        start_date = datetime.utcnow().date()
+        end_date = start_date + timedelta(days=request.duration_days)
+        new_subscription = Subscription(
+            user_id=current_user.id,
+            platform_id=platform_id,
+            plan_name=request.plan_name,
+            start_date=start_date,
+            end_date=end_date,
+            status="pending"
+        )
+        db.add(new_subscription)
+        await db.flush()
+
+        # Создаем платеж
+        payment_amount = request.duration_days * 10  # Пример расчета суммы
+        payment = await add_payment(db, current_user.id, request.plan_name, payment_amount, new_subscription.id)
+        await refresh_summaries(db, [current_user.id])
 
-        return {
+        return await commit_with_key(db, "subscribe", idempotency_key, {
             "message": "Subscription created",
-            "subscription": new_subscription,
-            "payment_url": payment_response["url"]
-        }
+            "subscription": {
+                "id": new_subscription.id,
+                "user_id": new_subscription.user_id,
+                "platform_id": new_subscription.platform_id,
+                "plan_name": new_subscription.plan_name,
+                "start_date": new_subscription.start_date,
+                "end_date": new_subscription.end_date,
+                "status": new_subscription.status
+            },
+            "payment_url": checkout_url(payment)
+        }, current_user.id, request_hash)
+    except HTTPException:
+        # Ошибки ключа идемпотентности (422) отдаются клиенту как есть
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to create payment: {str(e)}")
 
-@router.get("/platforms/{platform_id}")
-def get_platform_details(platform_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    platform = db.query(Platform).filter(Platform.id == platform_id).first()
+@router.get("/platforms/{platform_id}", response_model=PlatformDetailsResponse)
+async def get_platform_details(platform_id: int, request: Request, db: AsyncSession = Depends(get_read_db), current_user: TokenClaims = Depends(get_token_claims)):
+    catalog = await catalog_cache.get()
+    platform = catalog.platforms_by_id.get(platform_id)
     if not platform:
         raise HTTPException(status_code=404, detail="Platform not found")
 
-    # Получение активных подписок пользователя для этой платформы
-    current_subscription = db.query(Subscription).filter(
+    # Получение активной подписки пользователя для этой платформы
+    result = await db.execute(select(Subscription.plan_name, Subscription.end_date).where(
         Subscription.user_id == current_user.id,
         Subscription.platform_id == platform_id,
         Subscription.status == "active"
-    ).first()
-
-    # Описания планов подписки
-    plans_dict = {
-        1: [
-            {"name": "Базовый", "price": 1000, "duration_days": 30, "description": "Основные функции управления облачными ресурсами.", "is_active": current_subscription and current_subscription.plan_name == "Базовый"},
-            {"name": "Профессиональный", "price": 2000, "duration_days": 30, "description": "Расширенные функции, включая автоматизацию процессов.", "is_active": current_subscription and current_subscription.plan_name == "Профессиональный"},
-            {"name": "Премиум", "price": 3000, "duration_days": 30, "description": "Все функции, приоритетная поддержка и аналитические отчеты.", "is_active": current_subscription and current_subscription.plan_name == "Премиум"},
-        ],
-        2: [
-            {"name": "Стартовый", "price": 1500, "duration_days": 30, "description": "Базовые инструменты управления продажами.", "is_active": current_subscription and current_subscription.plan_name == "Стартовый"},
-            {"name": "Продвинутый", "price": 2500, "duration_days": 30, "description": "Дополнительные функции аналитики и интеграции.", "is_active": current_subscription and current_subscription.plan_name == "Продвинутый"},
-            {"name": "Экспертный", "price": 4000, "duration_days": 30, "description": "Полный набор инструментов и персональная поддержка.", "is_active": current_subscription and current_subscription.plan_name == "Экспертный"},
-        ],
-        3: [
-            {"name": "Аналитик", "price": 2000, "duration_days": 30, "description": "Доступ к основным аналитическим данным.", "is_active": current_subscription and current_subscription.plan_name == "Аналитик"},
-            {"name": "Стратег", "price": 3500, "duration_days": 30, "description": "Расширенные данные и прогнозы.", "is_active": current_subscription and current_subscription.plan_name == "Стратег"},
-            {"name": "Гуру", "price": 5000, "duration_days": 30, "description": "Полный доступ ко всем данным и индивидуальные отчеты.", "is_active": current_subscription and current_subscription.plan_name == "Гуру"},
-        ],
-        4: [
-            {"name": "Команда", "price": 1200, "duration_days": 30, "description": "Основные функции управления проектами для небольших команд.", "is_active": current_subscription and current_subscription.plan_name == "Команда"},
-            {"name": "Бизнес", "price": 2500, "duration_days": 30, "description": "Расширенные функции для средних компаний.", "is_active": current_subscription and current_subscription.plan_name == "Бизнес"},
-            {"name": "Корпоративный", "price": 4000, "duration_days": 30, "description": "Полный функционал для крупных организаций.", "is_active": current_subscription and current_subscription.plan_name == "Корпоративный"},
-        ],
-        5: [
-            {"name": "Рекрутер", "price": 1000, "duration_days": 30, "description": "Инструменты для найма и отслеживания кандидатов.", "is_active": current_subscription and current_subscription.plan_name == "Рекрутер"},
-            {"name": "Менеджер", "price": 2000, "duration_days": 30, "description": "Дополнительные функции адаптации и обучения.", "is_active": current_subscription and current_subscription.plan_name == "Менеджер"},
-            {"name": "Директор", "price": 3500, "duration_days": 30, "description": "Полный спектр HR-инструментов и аналитики.", "is_active": current_subscription and current_subscription.plan_name == "Директор"},
-        ]
-    }
+    ))
+    current_subscription = result.first()
 
-    plans = plans_dict.get(platform.id, [])
-    return {
+    # Описания планов подписки берутся из кэша каталога
+    plans = [
+        {**plan, "is_active": bool(current_subscription and current_subscription.plan_name == plan["name"])}
+        for plan in catalog.plans_by_platform.get(platform_id, [])
+    ]
+    content = {
         "platform": platform,
         "plans": plans,
         "current_subscription": {
@@ -339,29 +348,118 @@ def get_platform_details(platform_id: int, db: Session = Depends(get_db), curren
             "end_date": current_subscription.end_date
         } if current_subscription else None
     }
+    # Ответ зависит от пользователя: кэшировать может только браузер, с проверкой ETag
+    return cached_json_response(request, content, make_etag(content), "private, no-cache")
+
+# Замена планов платформы (только для администраторов), сбрасывает кэш каталога во всех воркерах
+@router.put("/platforms/{platform_id}/plans", response_model=PlansUpdatedResponse)
+async def replace_platform_plans(
+    platform_id: int,
+    plans: List[PlanItem],
+    db: AsyncSession = Depends(get_async_db),
+    current_user: TokenClaims = Depends(require_role("admin"))
+):
+    platform = await db.get(Platform, platform_id)
+    if not platform:
+        raise HTTPException(status_code=404, detail="Platform not found")
 
-@router.get("/platforms")
-def get_platforms(db: Session = Depends(get_db)):
-    platforms = db.query(Platform).all()
-    return {"platforms": platforms}
+    await db.execute(delete(Plan).where(Plan.platform_id == platform_id))
+    db.add_all(Plan(platform_id=platform_id, **plan.model_dump()) for plan in plans)
+    await notify_catalog_changed(db)
+    await db.commit()
+    catalog_cache.invalidate()
+
+    return {"message": f"Plans of platform {platform_id} updated", "plans": len(plans)}
+
+@router.get("/platforms", response_model=PlatformsResponse)
+async def get_platforms(request: Request):
+    catalog = await catalog_cache.get()
+    # Клиент проверяет ETag при каждом запросе (304 без тела), чтобы не показывать старый каталог
+    return cached_json_response(request, {"platforms": catalog.platforms}, catalog.etag, "public, no-cache")
+
+# Подписки пользователя вместе со статусом последнего платежа одним запросом
+def subscriptions_with_latest_payment_query(user_id: int):
+    # Последний платеж каждой подписки (оконная функция вместо запроса на каждую подписку)
+    latest_payment = (
+        select(
+            Payment.subscription_id,
+            Payment.status,
+            func.row_number().over(partition_by=Payment.subscription_id, order_by=Payment.id.desc()).label("rn"),
+        )
+        .where(Payment.subscription_id.in_(select(Subscription.id).where(Subscription.user_id == user_id)))
+        .subquery()
+    )
+    return (
+        select(Subscription, latest_payment.c.status)
+        .outerjoin(latest_payment, and_(latest_payment.c.subscription_id == Subscription.id, latest_payment.c.rn == 1))
+        .where(Subscription.user_id == user_id)
+        .order_by(Subscription.id)
+    )
 
-@router.get("/{user_id}")
-def get_subscriptions(user_id: int, db: Session = Depends(get_db)):
-    # Получение всех подписок пользователя
-    subscriptions = db.query(Subscription).filter(Subscription.user_id == user_id).all()
-    if not subscriptions:
+# Вся информация для страницы профиля одним чтением сводки
+@router.get("/summary", response_model=SubscriptionSummaryResponse)
+async def get_subscription_summary(db: AsyncSession = Depends(get_read_db), current_user: TokenClaims = Depends(get_token_claims)):
+    summary = await load_summary(db, current_user.id)
+    catalog = await catalog_cache.get()
+
+    # Названия платформ берутся из каталога, чтобы переименование не требовало пересчета сводок
+    for section in ("active", "expired", "pending_payments"):
+        for item in summary[section]:
+            platform = catalog.platforms_by_id.get(item["platform_id"])
+            item["platform_name"] = platform["name"] if platform else "N/A"
+    return summary
+
+# Массовая отмена, продление или истечение подписок (только для администраторов):
+# пачки по BULK_CHUNK_SIZE строк, dry_run возвращает только число подходящих подписок
+@router.post("/bulk/{action}", response_model=BulkSubscriptionResponse)
+async def bulk_subscription_action(
+    action: Literal["cancel", "extend", "expire"],
+    request: BulkSubscriptionRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: TokenClaims = Depends(require_role("admin"))
+):
+    logger.info(f"Admin {current_user.id} requested bulk {action} (dry_run={request.dry_run})")
+    return await bulk_update_subscriptions(db, action, request)
+
+@router.get("/{user_id}", response_model=SubscriptionListResponse)
+async def get_subscriptions(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(subscriptions_with_latest_payment_query(user_id))
+    rows = result.all()
+    if not rows:
         raise HTTPException(status_code=404, detail="No subscriptions found for this user")
 
-    for subscription in subscriptions:
+    today = datetime.utcnow().date()
+    new_statuses = {}
+    for subscription, payment_status in rows:
+        status = subscription.status
         # Проверка истечения срока подписки
-        if subscription.end_date < datetime.utcnow().date():
-            subscription.status = "expired"
-
-        # Проверка подтверждения платежа (предполагаем, что у подписки есть платеж)
-        payment = db.query(Payment).filter(Payment.subscription_id == subscription.id).first()
-        if payment and payment.status != "confirmed":
-            subscription.status = "active"
-
-        db.commit()  # Сохраняем изменения в базе данных
-
-    return {"subscriptions": [SubscriptionResponse.from_orm(sub) for sub in subscriptions]}
\ No newline at end of file
+        if subscription.end_date < today:
+            status = "expired"
+        # Проверка подтверждения платежа
+        if payment_status is not None and payment_status != "confirmed":
+            status = "active"
+        if status != subscription.status:
+            new_statuses[subscription.id] = status
+
+    # Все изменения статусов одним UPDATE и одним коммитом
+    if new_statuses:
+        await db.execute(
+            update(Subscription)
+            .where(Subscription.id.in_(new_statuses))
+            .values(status=case(new_statuses, value=Subscription.id))
+            .execution_options(synchronize_session=False)
+        )
+        await refresh_summaries(db, [user_id])
+        await db.commit()
+
+    return {"subscriptions": [
+        SubscriptionResponse(
+            id=subscription.id,
+            user_id=subscription.user_id,
+            plan_name=subscription.plan_name,
+            start_date=subscription.start_date,
+            end_date=subscription.end_date,
+            status=new_statuses.get(subscription.id, subscription.status),
+        )
+        for subscription, _ in rows
+    ]}
@@ -0,0 +1,6 @@
+from uvicorn.workers import UvicornWorker
+
+
+class ProductionWorker(UvicornWorker):
+    # Воркер gunicorn с uvloop и httptools (uvicorn[standard]); keep-alive и лимиты задает gunicorn.conf.py
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
@@ -0,0 +1,164 @@
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.analytics import build_stats, record_rollup_deltas, empty_stats, stats_queries
+from app.database import upsert
+from app.models import Payment, Subscription, SubscriptionSummary, User
+
+# Сколько последних истекших подписок хранится в сводке
+EXPIRED_HISTORY_LIMIT = 20
+REBUILD_BATCH_SIZE = 1000
+
+summaries_table = SubscriptionSummary.__table__
+
+
+def empty_summary() -> dict:
+    # stats - счетчики пользователя для сводных таблиц аналитики (app/analytics.py)
+    return {"active": [], "expired": [], "pending_payments": [], "stats": empty_stats()}
+
+
+def summary_queries(user_ids):
+    # Два запроса на любой набор пользователей: подписки и ожидающие оплаты платежи
+    subscriptions = select(
+        Subscription.id,
+        Subscription.user_id,
+        Subscription.platform_id,
+        Subscription.plan_name,
+        Subscription.start_date,
+        Subscription.end_date,
+        Subscription.status,
+    ).where(Subscription.user_id.in_(user_ids), Subscription.status.in_(("active", "expired")))
+    pending_payments = (
+        select(
+            Payment.id,
+            Payment.user_id,
+            Payment.public_token,
+            Payment.subscription_id,
+            Payment.plan_name,
+            Payment.amount,
+            Subscription.platform_id,
+        )
+        .join(Subscription, Subscription.id == Payment.subscription_id)
+        .where(Payment.user_id.in_(user_ids), Payment.status == "pending", Subscription.status == "pending")
+        .order_by(Payment.id)
+    )
+    return subscriptions, pending_payments
+
+
+def build_summaries(user_ids, subscription_rows, payment_rows, stats=None) -> dict:
+    summaries = {user_id: empty_summary() for user_id in user_ids}
+    active_by_platform = {user_id: {} for user_id in user_ids}
+    for row in subscription_rows:
+        item = {
+            "subscription_id": row.id,
+            "platform_id": row.platform_id,
+            "plan_name": row.plan_name,
+            "start_date": row.start_date,
+            "end_date": row.end_date,
+        }
+        if row.status == "active":
+            # Активный план по платформе: если активных несколько, берется самый поздний
+            current = active_by_platform[row.user_id].get(row.platform_id)
+            if current is None or (row.end_date, row.id) > (current["end_date"], current["subscription_id"]):
+                active_by_platform[row.user_id][row.platform_id] = item
+        else:
+            summaries[row.user_id]["expired"].append(item)
+
+    for user_id, summary in summaries.items():
+        summary["active"] = sorted(active_by_platform[user_id].values(), key=lambda item: (item["platform_id"] or 0))
+        summary["expired"] = sorted(
+            summary["expired"], key=lambda item: (item["end_date"], item["subscription_id"]), reverse=True
+        )[:EXPIRED_HISTORY_LIMIT]
+
+    for row in payment_rows:
+        summaries[row.user_id]["pending_payments"].append({
+            "payment_id": row.id,
+            "token": row.public_token,
+            "subscription_id": row.subscription_id,
+            "platform_id": row.platform_id,
+            "plan_name": row.plan_name,
+            "amount": row.amount,
+        })
+    if stats is not None:
+        for user_id, summary in summaries.items():
+            summary["stats"] = stats[user_id]
+    return jsonable_encoder(summaries)
+
+
+async def compute_summaries(db: AsyncSession, user_ids) -> dict:
+    subscriptions, pending_payments = summary_queries(user_ids)
+    subscription_rows = (await db.execute(subscriptions)).all()
+    payment_rows = (await db.execute(pending_payments)).all()
+    subscription_stats, payment_stats = stats_queries(user_ids)
+    stats = build_stats(
+        user_ids, (await db.execute(subscription_stats)).all(), (await db.execute(payment_stats)).all()
+    )
+    return build_summaries(user_ids, subscription_rows, payment_rows, stats)
+
+
+async def refresh_summaries(db: AsyncSession, user_ids):
+    # Пересчет сводок в текущей транзакции, до коммита изменений, которые их затрагивают.
+    # Строки сводок блокируются (FOR UPDATE), поэтому параллельные транзакции одного
+    # пользователя пересчитывают сводку по очереди и видят изменения друг друга.
+    # Разница старых и новых счетчиков stats записывается как приращение сводных таблиц аналитики.
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    await db.flush()
+    now = datetime.utcnow()
+    dialect_name = (await db.connection()).dialect.name
+    await db.execute(upsert(
+        dialect_name, summaries_table,
+        [{"user_id": user_id, "data": empty_summary(), "updated_at": now} for user_id in user_ids],
+        ["user_id"],
+    ))
+    locked = await db.execute(
+        select(SubscriptionSummary.user_id, SubscriptionSummary.data)
+        .where(SubscriptionSummary.user_id.in_(user_ids))
+        .order_by(SubscriptionSummary.user_id)
+        .with_for_update()
+    )
+    old_stats = {user_id: data.get("stats") for user_id, data in locked.all()}
+    summaries = await compute_summaries(db, user_ids)
+    await record_rollup_deltas(db, old_stats, {user_id: data["stats"] for user_id, data in summaries.items()})
+    await db.execute(
+        summaries_table.update()
+        .where(summaries_table.c.user_id == bindparam("b_user_id"))
+        .values(data=bindparam("b_data"), updated_at=now),
+        [{"b_user_id": user_id, "b_data": data} for user_id, data in summaries.items()],
+    )
+
+
+def rebuild_summaries(conn, batch_size: int = REBUILD_BATCH_SIZE):
+    # Полный пересчет сводок всех пользователей вместе со счетчиками (синхронное соединение)
+    last_id = 0
+    while True:
+        user_ids = conn.execute(
+            select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            break
+        subscriptions, pending_payments = summary_queries(user_ids)
+        subscription_stats, payment_stats = stats_queries(user_ids)
+        summaries = build_summaries(
+            user_ids, conn.execute(subscriptions).all(), conn.execute(pending_payments).all(),
+            build_stats(user_ids, conn.execute(subscription_stats).all(), conn.execute(payment_stats).all()),
+        )
+        conn.execute(upsert(
+            conn.dialect.name, summaries_table,
+            [{"user_id": user_id, "data": data, "updated_at": datetime.utcnow()} for user_id, data in summaries.items()],
+            ["user_id"],
+            update_columns=["data", "updated_at"],
+        ))
+        last_id = user_ids[-1]
+
+
+async def load_summary(db: AsyncSession, user_id: int) -> dict:
+    # Одно чтение по первичному ключу; для пользователей без сводки - расчет на лету
+    data = await db.scalar(select(SubscriptionSummary.data).where(SubscriptionSummary.user_id == user_id))
+    if data is None:
+        data = (await compute_summaries(db, [user_id]))[user_id]
+    return data
@@ -0,0 +1,113 @@
+# Нагрузочный тест эндпоинтов страницы профиля (profile.html).
+#
+# Запуск против работающего бэкенда:
+#   python -m benchmarks.profile_load --base-url http://127.0.0.1:8000 --output after.json
+# Сравнение с прошлым прогоном (например, до перехода на asyncpg):
+#   python -m benchmarks.profile_load --baseline before.json
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+
+PROFILE_ENDPOINTS = [
+    "/api/subscriptions/platforms",
+    "/api/subscriptions/active",
+    "/api/subscriptions/expired",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def get_token(client: httpx.AsyncClient) -> str:
+    name = f"bench_{uuid.uuid4().hex[:10]}"
+    email = f"{name}@example.com"
+    password = "bench-password"
+    await client.post("/api/auth/register", json={"username": name, "email": email, "password": password})
+    response = await client.post("/api/auth/login", json={"email": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def run_endpoint(client, path, headers, concurrency, requests_count):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(requests_count):
+        queue.put_nowait(None)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            started = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests_count,
+        "errors": errors,
+        "rps": round(requests_count / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run(base_url, concurrency, requests_count):
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        headers = {"Authorization": f"Bearer {await get_token(client)}"}
+        results = {}
+        for path in PROFILE_ENDPOINTS:
+            results[path] = await run_endpoint(client, path, headers, concurrency, requests_count)
+        return results
+
+
+def print_report(results, baseline=None):
+    for path, stats in results.items():
+        line = f"{path:35} {stats['rps']:>9} req/s  p50 {stats['p50_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms"
+        if baseline and path in baseline:
+            before = baseline[path]
+            line += f"  (было {before['rps']} req/s, p99 {before['p99_ms']} ms)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile page load benchmark")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.base_url, args.concurrency, args.requests))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
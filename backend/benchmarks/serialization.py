@@ -0,0 +1,172 @@
+# Микробенчмарк сериализации ответов по эндпоинтам, без HTTP и БД:
+#   before - путь без response_model: jsonable_encoder + JSONResponse (json.dumps)
+#   after  - текущий путь приложения: проверка по модели ответа маршрута + его класс ответа (orjson)
+# Эндпоинты с ETag (cached_json_response) модель не проходят: для них сравнивается только рендеринг.
+#   python -m benchmarks.serialization --rows 100 --iterations 2000 --output serialization.json
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+
+def subscription_rows(rows: int, status: str):
+    today = date.today()
+    return [
+        {
+            "id": i,
+            "plan_name": "Профессиональный",
+            "start_date": today - timedelta(days=30 + i),
+            "end_date": today - timedelta(days=i) if status == "expired" else today + timedelta(days=i),
+            "status": status,
+            "platform_name": f"Platform {i % 5 + 1}",
+        }
+        for i in range(1, rows + 1)
+    ]
+
+
+def summary_payload(rows: int):
+    # Так сводка лежит в БД: уже JSON-типы, даты строками
+    today = date.today()
+    item = lambda i: {
+        "subscription_id": i, "platform_id": i % 5 + 1, "platform_name": f"Platform {i % 5 + 1}",
+        "plan_name": "Базовый", "start_date": (today - timedelta(days=30)).isoformat(), "end_date": today.isoformat(),
+    }
+    return {
+        "active": [item(i) for i in range(1, 6)],
+        "expired": [item(i) for i in range(6, min(rows, 20) + 6)],
+        "pending_payments": [
+            {"payment_id": i, "token": uuid.uuid4().hex, "subscription_id": i, "platform_id": 1,
+             "platform_name": "Platform 1", "plan_name": "Базовый", "amount": 300}
+            for i in range(1, 4)
+        ],
+    }
+
+
+def build_cases(rows: int):
+    from app.catalog import DEFAULT_PLANS, GENERIC_PLANS
+    from app.models import SubscriptionResponse
+
+    today = date.today()
+    platforms = [
+        {"id": i, "name": f"Platform {i}", "description": "Описание платформы " * 5, "image_url": f"/images/{i}.png"}
+        for i in DEFAULT_PLANS
+    ]
+    subscription = {"id": 1, "user_id": 1, "platform_id": 1, "plan_name": "Базовый",
+                    "start_date": today, "end_date": today + timedelta(days=30), "status": "pending"}
+
+    # (метод, путь маршрута) -> (ответ обработчика, идет ли ответ мимо модели через cached_json_response)
+    return {
+        ("POST", "/api/auth/login"): (
+            {"access_token": "x" * 180, "refresh_token": "x" * 260, "token_type": "bearer", "user_id": 1, "role": "user"},
+            False),
+        ("GET", "/api/auth/users"): (
+            {"users": [{"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "role": "user"}
+                       for i in range(1, rows + 1)], "next_cursor": "eyJpZCI6IDEwMH0"}, False),
+        ("GET", "/api/subscriptions/plans"): ({"plans": GENERIC_PLANS}, True),
+        ("GET", "/api/subscriptions/platforms"): ({"platforms": platforms}, True),
+        ("GET", "/api/subscriptions/platforms/{platform_id}"): ({
+            "platform": platforms[0],
+            "plans": [{**plan, "is_active": i == 0} for i, plan in enumerate(DEFAULT_PLANS[1])],
+            "current_subscription": {"plan_name": DEFAULT_PLANS[1][0]["name"], "end_date": today},
+        }, True),
+        ("POST", "/api/subscriptions/platforms/{platform_id}/subscribe"): ({
+            "message": "Subscription created", "subscription": subscription,
+            "payment_url": f"http://localhost/checkout.html?token={uuid.uuid4().hex}",
+        }, False),
+        ("POST", "/api/payments/confirm-payment"): (
+            {"message": "Payment confirmed, subscription activation pending", "payment_id": 1}, False),
+        ("GET", "/api/subscriptions/active"): ({"subscriptions": subscription_rows(rows, "active")}, False),
+        ("GET", "/api/subscriptions/expired"): (
+            {"expired_subscriptions": subscription_rows(rows, "expired")}, False),
+        ("GET", "/api/subscriptions/summary"): (summary_payload(rows), False),
+        ("GET", "/api/subscriptions/{user_id}"): ({"subscriptions": [
+            SubscriptionResponse(id=i, user_id=1, plan_name="Базовый", start_date=today,
+                                 end_date=today + timedelta(days=i), status="active")
+            for i in range(1, rows + 1)
+        ]}, False),
+        ("GET", "/api/payments/"): ({"payments": [
+            {"id": i, "user_id": i, "subscription_id": i, "plan_name": "Базовый", "amount": 300, "status": "confirmed"}
+            for i in range(1, rows + 1)
+        ], "next_cursor": None}, False),
+    }
+
+
+def find_route(app, method: str, path: str) -> APIRoute:
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.path == path and method in route.methods:
+            return route
+    raise LookupError(f"{method} {path} is not a route of the app")
+
+
+async def render_before(route, payload, cached: bool) -> bytes:
+    if cached:
+        return JSONResponse(jsonable_encoder(payload)).body
+    content = await serialize_response(field=None, response_content=payload)
+    return JSONResponse(content).body
+
+
+async def render_after(route, payload, cached: bool) -> bytes:
+    if cached:
+        return route.response_class(payload).body
+    content = await serialize_response(field=route.response_field, response_content=payload)
+    return route.response_class(content).body
+
+
+async def measure(render, route, payload, cached: bool, iterations: int):
+    body = await render(route, payload, cached)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await render(route, payload, cached)
+    return (time.perf_counter() - started) / iterations * 1e6, len(body)
+
+
+async def run(rows: int, iterations: int) -> dict:
+    from app.main import app
+
+    results = {}
+    for (method, path), (payload, cached) in build_cases(rows).items():
+        route = find_route(app, method, path)
+        before_us, before_bytes = await measure(render_before, route, payload, cached, iterations)
+        after_us, after_bytes = await measure(render_after, route, payload, cached, iterations)
+        # Тела должны совпадать по содержимому (orjson пишет без пробелов)
+        assert json.loads(await render_before(route, payload, cached)) == json.loads(
+            await render_after(route, payload, cached)), f"{method} {path}: bodies differ"
+        results[f"{method} {path}"] = {
+            "before_us": round(before_us, 2),
+            "after_us": round(after_us, 2),
+            "speedup": round(before_us / after_us, 2),
+            "before_bytes": before_bytes,
+            "after_bytes": after_bytes,
+            "response_model": None if cached else route.response_model.__name__,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response serialization micro-benchmark")
+    parser.add_argument("--rows", type=int, default=100, help="строк в списковых ответах")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    results = asyncio.run(run(args.rows, args.iterations))
+    for endpoint, stats in results.items():
+        print(f"{endpoint:58} {stats['before_us']:>9} us -> {stats['after_us']:>9} us  x{stats['speedup']:<5} "
+              f"{stats['before_bytes']:>7} -> {stats['after_bytes']:>7} bytes")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"rows": args.rows, "iterations": args.iterations, "started_at": datetime.utcnow().isoformat(),
+                       "endpoints": results}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
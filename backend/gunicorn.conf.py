@@ -0,0 +1,27 @@
+# Продакшен-запуск: gunicorn -c gunicorn.conf.py app.main:app
+# Миграции выполняются один раз до старта (python -m app.migrations upgrade), а не в каждом воркере.
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "app.server.ProductionWorker"
+# Воркеров по числу ядер; у каждого свой пул соединений (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+backlog = int(os.getenv("BACKLOG", "2048"))
+
+# Keep-alive чуть больше, чем у прокси перед приложением, чтобы прокси не получал обрыв соединения
+keepalive = int(os.getenv("KEEP_ALIVE_SECONDS", "75"))
+# Зависший воркер перезапускается; при остановке текущие запросы дорабатывают до graceful_timeout
+timeout = int(os.getenv("WORKER_TIMEOUT_SECONDS", "60"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "30"))
+# Плавная ротация воркеров (утечки памяти), с разбросом, чтобы они не перезапускались одновременно
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+
+# Адреса прокси, которым доверяется X-Forwarded-For: по нему определяется IP клиента для лимитов входа
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+# Логи приложения пишет app.logging_config; access-лог gunicorn не нужен
+accesslog = None
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
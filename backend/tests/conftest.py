@@ -0,0 +1,60 @@
+import os
+import tempfile
+import uuid
+
+# Временная SQLite-база и отключенные фоновые задачи: переменные читаются при импорте app
+TEST_DB_DIR = tempfile.mkdtemp(prefix="saas_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DB_DIR, 'test.db')}"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["EXPIRY_SCHEDULER_ENABLED"] = "0"
+os.environ["OUTBOX_WORKER_ENABLED"] = "0"
+os.environ["REVOCATION_SYNC_ENABLED"] = "0"
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.database import SessionLocal
+from app.main import app
+from app.migrations import run_migrations
+from app.models import Platform, User
+from app.routers.auth import create_access_token
+
+
+@pytest.fixture(scope="session")
+def client():
+    run_migrations()
+    with SessionLocal() as db:
+        db.add_all(Platform(id=i, name=f"Platform {i}", description="test", image_url="") for i in range(1, 4))
+        db.commit()
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def db(client):
+    with SessionLocal() as session:
+        yield session
+
+
+def create_user(db, role: str = "user") -> User:
+    name = f"user_{uuid.uuid4().hex[:10]}"
+    user = User(username=name, email=f"{name}@example.com", password_hash="-", role=role)
+    db.add(user)
+    db.commit()
+    return user
+
+
+def auth_headers(user: User) -> dict:
+    token = create_access_token({"sub": user.username, "user_id": user.id, "role": user.role})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def user(db):
+    return create_user(db)
+
+
+@pytest.fixture
+def admin(db):
+    return create_user(db, role="admin")
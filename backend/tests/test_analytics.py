@@ -0,0 +1,66 @@
+import asyncio
+import uuid
+from datetime import date
+from types import SimpleNamespace
+
+from conftest import auth_headers
+
+from app.analytics import fold_deltas
+from app.instrumentation import count_queries
+from app.models import PaymentTotal, RollupDelta, SubscriptionCount
+from app.outbox import drain_rollup_deltas
+
+ROLLUP_TABLES = ("analytics_subscription_counts", "analytics_payment_totals",
+                 "analytics_revenue_daily", "analytics_churn_daily")
+
+
+def test_subscribe_writes_deltas_and_worker_folds_them(client, db, user):
+    plan = f"plan_{uuid.uuid4().hex[:8]}"
+    headers = auth_headers(user)
+
+    with count_queries() as queries:
+        response = client.post("/api/subscriptions/platforms/1/subscribe", headers=headers,
+                               json={"plan_name": plan, "duration_days": 30})
+
+    assert response.status_code == 200
+    # Транзакция запроса не трогает строки сводных таблиц: одна вставка приращений
+    assert not [statement for statement in queries.statements if any(table in statement for table in ROLLUP_TABLES)]
+    assert len([statement for statement in queries.statements if "analytics_rollup_deltas" in statement]) == 1
+    deltas = db.query(RollupDelta).filter(RollupDelta.plan_name == plan).all()
+    assert {(delta.kind, delta.status, delta.count, delta.amount) for delta in deltas} == {
+        ("subscriptions", "pending", 1, 0), ("payments", "pending", 1, 300),
+    }
+    assert db.query(SubscriptionCount).filter(SubscriptionCount.plan_name == plan).count() == 0
+
+    asyncio.run(drain_rollup_deltas())
+
+    db.expire_all()
+    assert db.query(RollupDelta).filter(RollupDelta.plan_name == plan).count() == 0
+    count = db.query(SubscriptionCount).filter_by(platform_id=1, plan_name=plan, status="pending").one()
+    assert count.subscriptions == 1
+    total = db.query(PaymentTotal).filter_by(platform_id=1, plan_name=plan, status="pending").one()
+    assert (total.payments, total.amount) == (1, 300)
+
+
+def test_fold_deltas_counts_churn_and_revenue_per_delta():
+    day = date(2026, 1, 5)
+
+    def delta(kind, status, count, amount=0):
+        return SimpleNamespace(kind=kind, day=day, platform_id=1, plan_name="basic", status=status,
+                               count=count, amount=amount)
+
+    subscriptions, payments, churn, revenue = fold_deltas([
+        delta("subscriptions", "active", 1),
+        delta("subscriptions", "active", -1),
+        delta("subscriptions", "cancelled", 1),
+        delta("subscriptions", "cancelled", 1),
+        delta("payments", "pending", 1, 300),
+        delta("payments", "pending", -1, -300),
+        delta("payments", "confirmed", 1, 300),
+    ])
+
+    # Взаимно погашенные приращения не порождают строк
+    assert subscriptions == {(1, "basic", "cancelled"): 2}
+    assert payments == {(1, "basic", "confirmed"): (1, 300)}
+    assert churn == {(day, 1, "basic", "cancelled"): 2}
+    assert revenue == {(day, 1, "basic"): (1, 300)}
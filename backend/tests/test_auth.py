@@ -0,0 +1,186 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from conftest import auth_headers
+from jose import jwt
+from sqlalchemy import event
+
+from app.database import AsyncSessionLocal, async_engine
+from app.expiry import run_expiry_sweep
+from app.hashing import password_hasher
+from app.instrumentation import count_queries
+from app.models import AuthSession, RevokedToken
+from app.revocation import revocation_list
+
+
+@pytest.fixture
+def checked_out():
+    # Число соединений async_engine, выданных из пула и еще не возвращенных
+    state = {"count": 0}
+
+    def on_checkout(*args):
+        state["count"] += 1
+
+    def on_checkin(*args):
+        state["count"] -= 1
+
+    pool = async_engine.sync_engine.pool
+    event.listen(pool, "checkout", on_checkout)
+    event.listen(pool, "checkin", on_checkin)
+    yield state
+    event.remove(pool, "checkout", on_checkout)
+    event.remove(pool, "checkin", on_checkin)
+
+
+def register(client, password="secret"):
+    name = f"auth_{uuid.uuid4().hex[:10]}"
+    response = client.post("/api/auth/register", json={"username": name, "email": f"{name}@example.com",
+                                                       "password": password})
+    assert response.status_code == 200
+    return f"{name}@example.com"
+
+
+def test_password_hashing_does_not_hold_a_connection(client, checked_out, monkeypatch):
+    held = []
+    original_hash, original_verify = password_hasher.hash, password_hasher.verify_and_update
+
+    async def hash(password):
+        held.append(checked_out["count"])
+        return await original_hash(password)
+
+    async def verify_and_update(password, password_hash):
+        held.append(checked_out["count"])
+        return await original_verify(password, password_hash)
+
+    monkeypatch.setattr(password_hasher, "hash", hash)
+    monkeypatch.setattr(password_hasher, "verify_and_update", verify_and_update)
+
+    email = register(client)
+    response = client.post("/api/auth/login", json={"email": email, "password": "secret"})
+
+    assert response.status_code == 200
+    assert held == [0, 0]
+
+
+def login(client, email, password="secret") -> dict:
+    response = client.post("/api/auth/login", json={"email": email, "password": password})
+    assert response.status_code == 200
+    return response.json()
+
+
+def me(client, tokens):
+    return client.get("/api/auth/me/", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+
+
+def session_id(tokens) -> str:
+    return jwt.get_unverified_claims(tokens["access_token"])["sid"]
+
+
+def test_refresh_rotates_token_and_reuse_revokes_session(client):
+    tokens = login(client, register(client))
+
+    response = client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    rotated = response.json()
+    assert me(client, rotated).status_code == 200
+
+    # Повтор уже замененного refresh-токена - признак кражи: отзывается вся сессия
+    reused = client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert reused.status_code == 401
+    assert me(client, rotated).status_code == 401
+    assert client.post("/api/auth/refresh", json={"refresh_token": rotated["refresh_token"]}).status_code == 401
+
+
+def test_access_token_is_not_accepted_as_refresh_token(client):
+    tokens = login(client, register(client))
+    response = client.post("/api/auth/refresh", json={"refresh_token": tokens["access_token"]})
+    assert response.status_code == 403
+
+
+def test_logout_revokes_only_its_session(client):
+    email = register(client)
+    first, second = login(client, email), login(client, email)
+
+    response = client.post("/api/auth/logout", headers={"Authorization": f"Bearer {first['access_token']}"})
+
+    assert response.status_code == 200
+    assert me(client, first).status_code == 401
+    assert client.post("/api/auth/refresh", json={"refresh_token": first["refresh_token"]}).status_code == 401
+    assert me(client, second).status_code == 200
+
+
+def test_admin_revokes_all_user_sessions(client, db, admin):
+    email = register(client)
+    first, second = login(client, email), login(client, email)
+    user_id = jwt.get_unverified_claims(first["access_token"])["user_id"]
+
+    response = client.post(f"/api/auth/users/{user_id}/revoke-tokens", headers=auth_headers(admin))
+
+    assert response.status_code == 200
+    assert response.json()["message"].startswith("2 sessions")
+    assert me(client, first).status_code == 401
+    assert me(client, second).status_code == 401
+
+
+def test_revocation_from_another_worker_is_picked_up_by_sync(client, db):
+    tokens = login(client, register(client))
+    sid = session_id(tokens)
+    # Отзыв в другом воркере: строка в БД есть, в фильтре этого процесса ее еще нет
+    db.add(RevokedToken(token_id=sid, expires_at=datetime.utcnow() + timedelta(days=1)))
+    db.commit()
+    assert me(client, tokens).status_code == 200
+
+    async def sync():
+        async with AsyncSessionLocal() as session:
+            await revocation_list.sync(session)
+
+    asyncio.run(sync())
+    assert me(client, tokens).status_code == 401
+
+
+def test_bloom_false_positive_falls_back_to_database(client):
+    tokens = login(client, register(client))
+    sid = session_id(tokens)
+    # Ложное срабатывание: sid есть в фильтре, но не в revoked_tokens
+    revocation_list.filter.add(sid)
+    checks, false_positives = revocation_list.db_checks_total, revocation_list.false_positives_total
+
+    with count_queries() as queries:
+        assert me(client, tokens).status_code == 200
+    assert queries.count == 1
+    assert revocation_list.db_checks_total == checks + 1
+    assert revocation_list.false_positives_total == false_positives + 1
+
+    # Проверенное ложное срабатывание запоминается до пересборки фильтра
+    with count_queries() as queries:
+        assert me(client, tokens).status_code == 200
+    assert queries.count == 0
+
+    # Настоящий отзыв того же sid снимает запомненное ложное срабатывание
+    response = client.post("/api/auth/logout", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+    assert response.status_code == 200
+    assert me(client, tokens).status_code == 401
+
+
+def test_expired_revocations_are_purged_by_sweep_not_by_rebuild(client, db, user):
+    past = datetime.utcnow() - timedelta(minutes=1)
+    expired_sid = uuid.uuid4().hex
+    db.add(AuthSession(id=expired_sid, user_id=user.id, refresh_jti="-", expires_at=past, revoked_at=past))
+    db.add(RevokedToken(token_id=expired_sid, expires_at=past))
+    db.commit()
+
+    async def rebuild():
+        async with AsyncSessionLocal() as session:
+            await revocation_list.rebuild(session)
+
+    asyncio.run(rebuild())
+    # Воркер API только читает: истекшая запись остается в БД, но не попадает в фильтр
+    assert db.query(RevokedToken).filter_by(token_id=expired_sid).count() == 1
+    assert expired_sid not in revocation_list.filter
+
+    asyncio.run(run_expiry_sweep())
+    db.expire_all()
+    assert db.query(RevokedToken).filter_by(token_id=expired_sid).count() == 0
+    assert db.get(AuthSession, expired_sid) is None
@@ -0,0 +1,25 @@
+from conftest import auth_headers
+
+from app.catalog import CATALOG_CHANNEL
+from app.models import Plan
+from app.payment_events import on_catalog_changed
+
+
+def plan_names(client, headers) -> list:
+    response = client.get("/api/subscriptions/platforms/3", headers=headers)
+    assert response.status_code == 200
+    return [plan["name"] for plan in response.json()["plans"]]
+
+
+def test_catalog_notification_from_another_worker_invalidates_cache(client, db, user):
+    headers = auth_headers(user)
+    before = plan_names(client, headers)
+
+    # Изменение каталога другим воркером: этот процесс узнает о нем только по уведомлению
+    db.add(Plan(platform_id=3, name="notified", price=100, duration_days=30, description="test"))
+    db.commit()
+    assert plan_names(client, headers) == before
+
+    on_catalog_changed(None, 0, CATALOG_CHANNEL, "")
+
+    assert plan_names(client, headers) == before + ["notified"]
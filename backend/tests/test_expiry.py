@@ -0,0 +1,28 @@
+import asyncio
+from datetime import date, timedelta
+
+from conftest import auth_headers
+
+from app.expiry import expiry_metrics, run_expiry_sweep
+from app.models import Subscription
+
+
+def test_sweep_results_are_served_from_the_database(client, db, user, admin):
+    yesterday = date.today() - timedelta(days=1)
+    db.add_all(Subscription(user_id=user.id, platform_id=1, plan_name="basic", start_date=yesterday - timedelta(days=30),
+                            end_date=yesterday, status="active") for _ in range(2))
+    db.commit()
+    headers = auth_headers(admin)
+    before = client.get("/api/internal/expiry", headers=headers).json()
+
+    asyncio.run(run_expiry_sweep())
+    # Как в воркере API, который сам проход не выполняет: в памяти процесса итогов нет
+    expiry_metrics.update(dict.fromkeys(expiry_metrics, 0))
+    after = client.get("/api/internal/expiry", headers=headers).json()
+
+    assert after["sweeps_total"] == before["sweeps_total"] + 1
+    assert after["expired_total"] == before["expired_total"] + 2
+    assert after["last_sweep_expired"] == 2
+    assert after["last_sweep_at"] is not None
+    metrics = client.get("/metrics").text
+    assert f"expiry_expired_total {after['expired_total']}" in metrics
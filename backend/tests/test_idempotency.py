@@ -0,0 +1,86 @@
+import uuid
+from datetime import date, timedelta
+
+from fastapi import HTTPException
+
+from conftest import auth_headers, create_user
+
+from app.models import Payment, Subscription
+from app.routers import payments
+
+
+def subscribe(client, user, key, plan_name="basic", platform_id=1):
+    return client.post(f"/api/subscriptions/platforms/{platform_id}/subscribe",
+                       headers={**auth_headers(user), "Idempotency-Key": key},
+                       json={"plan_name": plan_name, "duration_days": 30})
+
+
+def test_subscribe_replay_returns_stored_response(client, db, user):
+    key = uuid.uuid4().hex
+
+    first = subscribe(client, user, key)
+    second = subscribe(client, user, key)
+
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert db.query(Subscription).filter(Subscription.user_id == user.id).count() == 1
+
+
+def test_subscribe_key_with_different_payload_is_rejected(client, db, user):
+    key = uuid.uuid4().hex
+    assert subscribe(client, user, key, plan_name="basic").status_code == 200
+
+    assert subscribe(client, user, key, plan_name="premium").status_code == 422
+    assert subscribe(client, user, key, platform_id=2).status_code == 422
+    assert db.query(Subscription).filter(Subscription.user_id == user.id).count() == 1
+
+
+def test_subscribe_key_of_another_user_is_rejected(client, db, user):
+    key = uuid.uuid4().hex
+    assert subscribe(client, user, key).status_code == 200
+
+    other = create_user(db)
+    response = subscribe(client, other, key)
+
+    assert response.status_code == 422
+    assert db.query(Subscription).filter(Subscription.user_id == other.id).count() == 0
+
+
+def pending_payment(db, user) -> Payment:
+    subscription = Subscription(user_id=user.id, platform_id=1, plan_name="basic", start_date=date.today(),
+                                end_date=date.today() + timedelta(days=30), status="pending")
+    db.add(subscription)
+    db.flush()
+    payment = Payment(user_id=user.id, subscription_id=subscription.id, plan_name="basic", amount=300)
+    db.add(payment)
+    db.commit()
+    return payment
+
+
+def test_confirm_key_reused_for_another_payment_is_rejected(client, db, user):
+    first, second = pending_payment(db, user), pending_payment(db, user)
+    key = uuid.uuid4().hex
+
+    replayed = [client.post("/api/payments/confirm-payment", headers={"Idempotency-Key": key},
+                            json={"token": first.public_token}) for _ in range(2)]
+    other = client.post("/api/payments/confirm-payment", headers={"Idempotency-Key": key},
+                        json={"token": second.public_token})
+
+    assert [response.status_code for response in replayed] == [200, 200]
+    assert replayed[0].json() == replayed[1].json()
+    assert other.status_code == 422
+    db.expire_all()
+    assert db.get(Payment, second.id).status == "pending"
+
+
+def test_checkout_passes_idempotency_errors_through(client, db, user, monkeypatch):
+    pending_payment(db, user)
+
+    async def conflicting_key(*args, **kwargs):
+        raise HTTPException(status_code=422, detail="Idempotency-Key was used by another user")
+
+    monkeypatch.setattr(payments, "commit_with_key", conflicting_key)
+    response = client.post("/api/payments/create-checkout-session", headers={"Idempotency-Key": uuid.uuid4().hex},
+                           json={"user_id": user.id, "plan_name": "basic", "amount": 300, "subscription_id": 0})
+
+    assert response.status_code == 422
@@ -0,0 +1,13 @@
+import pytest
+
+from conftest import auth_headers
+
+INTERNAL_PATHS = ["/expiry", "/pool", "/replicas", "/revocation", "/payment-events", "/outbox"]
+
+
+@pytest.mark.parametrize("path", INTERNAL_PATHS)
+def test_internal_requires_admin(client, user, admin, path):
+    url = f"/api/internal{path}"
+    assert client.get(url).status_code in (401, 403)
+    assert client.get(url, headers=auth_headers(user)).status_code == 403
+    assert client.get(url, headers=auth_headers(admin)).status_code == 200
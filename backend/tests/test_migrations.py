@@ -0,0 +1,72 @@
+import ast
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+import app.migrations as migrations
+from app.analytics import rebuild_rollups
+from app.migrations import m0007_analytics_rollups, run_migrations
+from app.models import Payment, Platform, Subscription, User
+from app.summaries import rebuild_summaries
+
+MIGRATIONS_DIR = Path(migrations.__file__).parent
+ROLLUP_TABLES = [m0007_analytics_rollups.subscription_counts, m0007_analytics_rollups.payment_totals,
+                 m0007_analytics_rollups.revenue_daily, m0007_analytics_rollups.churn_daily]
+
+
+def test_migrations_do_not_import_live_models():
+    # Миграции описывают таблицы и заполнение сами: изменения app.models их не меняют
+    for path in MIGRATIONS_DIR.glob("m*.py"):
+        for node in ast.walk(ast.parse(path.read_text())):
+            if isinstance(node, ast.ImportFrom):
+                names = [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+                assert not any(name in ("app.models", "app.summaries", "app.analytics") for name in names), path.name
+
+
+def snapshot(conn):
+    summaries = dict(conn.execute(select(m0007_analytics_rollups.summaries_table.c.user_id,
+                                         m0007_analytics_rollups.summaries_table.c.data)).all())
+    rollups = [sorted(conn.execute(select(table)).all()) for table in ROLLUP_TABLES]
+    return summaries, rollups
+
+
+def test_frozen_backfill_matches_current_rebuild(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    run_migrations(engine)
+    today = date.today()
+    with Session(engine) as db:
+        db.add(Platform(id=1, name="Platform 1", description="test", image_url=""))
+        users = [User(username=f"m{i}", email=f"m{i}@example.com", password_hash="-") for i in range(3)]
+        db.add_all(users)
+        db.flush()
+        for i, user in enumerate(users):
+            active = Subscription(user_id=user.id, platform_id=1, plan_name="basic", status="active",
+                                  start_date=today, end_date=today + timedelta(days=30))
+            expired = Subscription(user_id=user.id, platform_id=1, plan_name="pro", status="expired",
+                                   start_date=today - timedelta(days=60), end_date=today - timedelta(days=30))
+            pending = Subscription(user_id=user.id, platform_id=None, plan_name="trial", status="pending",
+                                   start_date=today, end_date=today + timedelta(days=7))
+            db.add_all([active, expired, pending])
+            db.flush()
+            db.add_all([
+                Payment(user_id=user.id, subscription_id=active.id, plan_name="basic", amount=300 + i,
+                        status="confirmed", confirmed_at=datetime.utcnow()),
+                Payment(user_id=user.id, subscription_id=expired.id, plan_name="pro", amount=900, status="confirmed"),
+                Payment(user_id=user.id, subscription_id=pending.id, plan_name="trial", amount=100),
+            ])
+        db.commit()
+
+    with engine.begin() as conn:
+        m0007_analytics_rollups.rebuild_summaries(conn)
+        m0007_analytics_rollups.rebuild_rollups(conn)
+        frozen = snapshot(conn)
+    with engine.begin() as conn:
+        rebuild_summaries(conn)
+        rebuild_rollups(conn)
+        current = snapshot(conn)
+
+    assert len(frozen[0]) == 3 and all(frozen[1])
+    assert frozen == current
+    engine.dispose()
@@ -0,0 +1,61 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from app import outbox
+from app.database import AsyncSessionLocal
+from app.models import OutboxEvent
+
+
+def add_events(db, count, **values):
+    events = [OutboxEvent(event_type="test.slow", payload={"n": i}, status="pending", attempts=0,
+                          available_at=datetime.utcnow(), **values) for i in range(count)]
+    db.add_all(events)
+    db.commit()
+    return [event.id for event in events]
+
+
+def test_events_past_the_lease_deadline_are_released(client, db, monkeypatch):
+    # События предыдущих тестов (и порожденные ими уведомления) обрабатываются заранее
+    while asyncio.run(outbox.drain_outbox()):
+        pass
+    handled = []
+
+    async def slow_handler(session, payload):
+        handled.append(payload["n"])
+        await asyncio.sleep(0.3)
+
+    monkeypatch.setitem(outbox.OUTBOX_HANDLERS, "test.slow", slow_handler)
+    # До конца аренды после взятия пачки остается 0.2 с: успевает начаться только первое событие
+    monkeypatch.setattr(outbox, "OUTBOX_LEASE_MARGIN_SECONDS", outbox.OUTBOX_LEASE_SECONDS - 0.2)
+    ids = add_events(db, 3)
+
+    assert asyncio.run(outbox.drain_outbox()) == 1
+
+    assert handled == [0]
+    events = {event.id: event for event in db.query(OutboxEvent).filter(OutboxEvent.id.in_(ids))}
+    assert events[ids[0]].status == "processed"
+    for event_id in ids[1:]:
+        assert events[event_id].status == "pending"
+        assert events[event_id].attempts == 0
+        assert events[event_id].available_at <= datetime.utcnow()
+
+
+def test_purge_removes_only_old_processed_events(client, db):
+    old = datetime.utcnow() - timedelta(hours=outbox.OUTBOX_RETENTION_HOURS + 1)
+    old_processed = add_events(db, 2, processed_at=old)
+    recent_processed = add_events(db, 1, processed_at=datetime.utcnow())
+    old_failed = add_events(db, 1, processed_at=old)
+    db.query(OutboxEvent).filter(OutboxEvent.id.in_(old_processed + recent_processed)).update(
+        {"status": "processed"}, synchronize_session=False)
+    db.query(OutboxEvent).filter(OutboxEvent.id.in_(old_failed)).update(
+        {"status": "failed"}, synchronize_session=False)
+    db.commit()
+
+    async def purge():
+        async with AsyncSessionLocal() as session:
+            return await outbox.purge_processed_events(session, batch_size=1)
+
+    assert asyncio.run(purge()) == 2
+    remaining = {event_id for (event_id,) in db.query(OutboxEvent.id).filter(
+        OutboxEvent.id.in_(old_processed + recent_processed + old_failed))}
+    assert remaining == set(recent_processed + old_failed)
@@ -0,0 +1,113 @@
+import asyncio
+import base64
+import json
+from datetime import date
+
+import pytest
+from conftest import auth_headers, create_user
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.models import Payment, Subscription
+from app.pagination import decode_cursor, encode_cursor, paginate
+
+
+def list_payments(client, admin, **params):
+    response = client.get("/api/payments/", headers=auth_headers(admin), params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_pages_cover_all_rows_in_stable_order(client, db, admin, user):
+    db.add_all(Payment(user_id=user.id, plan_name="basic", amount=100 + i) for i in range(15))
+    db.commit()
+    headers = auth_headers(admin)  # до подсчета страниц, чтобы не обновлять атрибуты admin
+    expected = [payment_id for (payment_id,) in db.query(Payment.id).order_by(Payment.id)]
+
+    ids, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 7, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/api/payments/", headers=headers, params=params).json()
+        assert len(page["payments"]) <= 7
+        ids.extend(payment["id"] for payment in page["payments"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert ids == expected
+    # Последняя страница не пустая: курсор не выдается, если строк больше нет
+    assert pages == -(-len(expected) // 7)
+
+
+def test_cursor_past_the_end_returns_empty_page(client, db, admin):
+    last_id = db.query(Payment.id).order_by(Payment.id.desc()).limit(1).scalar() or 0
+    page = list_payments(client, admin, cursor=encode_cursor(last_id))
+    assert page == {"payments": [], "next_cursor": None}
+
+
+def test_exact_multiple_of_limit_has_no_trailing_empty_page(client, db, admin, user):
+    before = db.query(Payment.id).order_by(Payment.id.desc()).limit(1).scalar() or 0
+    payments = [Payment(user_id=user.id, plan_name="basic", amount=100) for _ in range(2)]
+    db.add_all(payments)
+    db.commit()
+    # Ровно две строки после курсора при limit=2: одна страница без next_cursor
+    page = list_payments(client, admin, limit=2, cursor=encode_cursor(before))
+    assert [payment["id"] for payment in page["payments"]] == [payment.id for payment in payments]
+    assert page["next_cursor"] is None
+
+
+def tampered(cursor: str) -> str:
+    payload, signature = cursor.split(".")
+    forged = base64.urlsafe_b64encode(json.dumps({"id": 0}).encode()).decode().rstrip("=")
+    return f"{forged}.{signature}"
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-a-cursor", "%%%", "e30", tampered(encode_cursor(10)), encode_cursor(10) + "x",
+    encode_cursor(10).split(".")[0],
+])
+def test_invalid_or_tampered_cursor_is_rejected(client, admin, cursor):
+    response = client.get("/api/payments/", headers=auth_headers(admin), params={"cursor": cursor, "limit": 1})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_cursor_roundtrip():
+    assert decode_cursor(encode_cursor(42)) == {"id": 42}
+    assert decode_cursor(encode_cursor(42, "basic")) == {"id": 42, "key": "basic"}
+    with pytest.raises(HTTPException):
+        decode_cursor(tampered(encode_cursor(42)))
+
+
+def test_ties_on_sort_key_are_broken_by_id(client, db):
+    owner = create_user(db)
+    plans = ["b", "a", "b", "a", "b", "c", "a", "b"]
+    db.add_all(Subscription(user_id=owner.id, plan_name=plan, start_date=date.today(), status="active")
+               for plan in plans)
+    db.commit()
+    expected = [(row.plan_name, row.id) for row in db.query(Subscription.plan_name, Subscription.id)
+                .filter(Subscription.user_id == owner.id).order_by(Subscription.plan_name, Subscription.id)]
+    query = select(Subscription.id, Subscription.plan_name).where(Subscription.user_id == owner.id)
+
+    async def walk(limit):
+        seen, cursor = [], None
+        async with AsyncSessionLocal() as session:
+            while True:
+                rows, cursor = await paginate(session, query, Subscription.id, limit, cursor,
+                                              sort_column=Subscription.plan_name)
+                seen.extend((row.plan_name, row.id) for row in rows)
+                if cursor is None:
+                    return seen
+
+    # Граница страницы попадает внутрь группы одинаковых ключей: строки не теряются и не повторяются
+    for limit in (1, 2, 3):
+        assert asyncio.run(walk(limit)) == expected
+
+    async def id_only_cursor():
+        async with AsyncSessionLocal() as session:
+            await paginate(session, query, Subscription.id, 2, encode_cursor(1), sort_column=Subscription.plan_name)
+
+    with pytest.raises(HTTPException):
+        asyncio.run(id_only_cursor())
@@ -0,0 +1,65 @@
+from datetime import date, timedelta
+
+from app.models import OutboxEvent, Payment, Subscription, generate_payment_token
+
+
+def create_payment(db, user, status="pending", subscription_status="pending") -> Payment:
+    subscription = Subscription(user_id=user.id, platform_id=1, plan_name="basic", start_date=date.today(),
+                                end_date=date.today() + timedelta(days=30), status=subscription_status)
+    db.add(subscription)
+    db.flush()
+    payment = Payment(user_id=user.id, subscription_id=subscription.id, plan_name="basic", amount=300, status=status)
+    db.add(payment)
+    db.commit()
+    return payment
+
+
+def test_payment_tokens_are_random_and_unique():
+    tokens = {generate_payment_token() for _ in range(1000)}
+    assert len(tokens) == 1000
+    # 16 случайных байт: перебор токенов вместо последовательных id невозможен
+    assert all(len(token) >= 22 for token in tokens)
+
+
+def test_confirm_by_token(client, db, user):
+    payment = create_payment(db, user)
+
+    response = client.post("/api/payments/confirm-payment", json={"token": payment.public_token})
+
+    assert response.status_code == 200
+    assert response.json()["payment_id"] == payment.id
+    db.expire_all()
+    assert db.get(Payment, payment.id).status == "confirmed"
+    events = db.query(OutboxEvent).filter(OutboxEvent.event_type == "payment.confirmed").all()
+    assert payment.id in [event.payload["payment_id"] for event in events]
+
+
+def test_confirm_rejects_sequential_id_and_unknown_token(client, db, user):
+    payment = create_payment(db, user)
+
+    by_id = client.post("/api/payments/confirm-payment", json={"payment_id": payment.id})
+    by_id_as_token = client.post("/api/payments/confirm-payment", json={"token": str(payment.id)})
+    unknown = client.post("/api/payments/confirm-payment", json={"token": generate_payment_token()})
+
+    assert by_id.status_code == 422
+    assert by_id_as_token.status_code == 404
+    assert unknown.status_code == 404
+    db.expire_all()
+    assert db.get(Payment, payment.id).status == "pending"
+
+
+def test_payment_events_require_matching_id_and_token(client, db, user):
+    payment = create_payment(db, user, status="confirmed", subscription_status="active")
+    other = create_payment(db, user)
+
+    # Подтвержденный платеж с активной подпиской: поток отдает статус и закрывается
+    response = client.get(f"/api/payments/{payment.id}/events", params={"token": payment.public_token})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert '"status": "confirmed", "subscription_status": "active"' in response.text
+
+    # Следующий по порядку id с известным токеном, id вместо токена и id без токена не дают статуса
+    assert other.id == payment.id + 1
+    assert client.get(f"/api/payments/{other.id}/events", params={"token": payment.public_token}).status_code == 404
+    assert client.get(f"/api/payments/{payment.id}/events", params={"token": str(payment.id)}).status_code == 404
+    assert client.get(f"/api/payments/{payment.id}/events").status_code == 422
@@ -0,0 +1,52 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app.instrumentation import assert_max_queries
+from app.models import Subscription
+
+from conftest import auth_headers
+
+
+@pytest.fixture
+def subscribed_user(db, user):
+    # По несколько активных и истекших подписок на разных платформах: N+1 по платформам даст лишние запросы
+    today = date.today()
+    db.add_all(
+        Subscription(user_id=user.id, platform_id=i % 3 + 1, plan_name=f"plan{i}",
+                     start_date=today - timedelta(days=60),
+                     end_date=today + timedelta(days=10) if status == "active" else today - timedelta(days=i + 1),
+                     status=status)
+        for status in ("active", "expired")
+        for i in range(6)
+    )
+    db.commit()
+    return user
+
+
+def test_active_subscriptions_single_query(client, subscribed_user):
+    headers = auth_headers(subscribed_user)
+    with assert_max_queries(1):
+        response = client.get("/api/subscriptions/active", headers=headers)
+    assert response.status_code == 200
+    subscriptions = response.json()["subscriptions"]
+    assert len(subscriptions) == 6
+    assert {subscription["platform_name"] for subscription in subscriptions} == {"Platform 1", "Platform 2", "Platform 3"}
+
+
+def test_expired_subscriptions_single_query(client, subscribed_user):
+    headers = auth_headers(subscribed_user)
+    with assert_max_queries(1):
+        response = client.get("/api/subscriptions/expired", headers=headers)
+    assert response.status_code == 200
+    subscriptions = response.json()["expired_subscriptions"]
+    assert len(subscriptions) == 6
+    assert {subscription["platform_name"] for subscription in subscriptions} == {"Platform 1", "Platform 2", "Platform 3"}
+
+
+def test_admin_user_subscriptions_single_query(client, admin, subscribed_user):
+    url, headers = f"/api/auth/users/{subscribed_user.id}/subscriptions", auth_headers(admin)
+    with assert_max_queries(1):
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()["subscriptions"]) == 12
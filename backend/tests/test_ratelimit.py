@@ -0,0 +1,119 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+from app import ratelimit
+from app.ratelimit import BucketLimit, MemoryTokenBucketStore, RateLimiter, RateLimitMiddleware, rate_limiter
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    # В тестах ограничение выключено (conftest); здесь включается с маленькими корзинами
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limiter, "ip_limit", BucketLimit(2, 60))
+    monkeypatch.setattr(rate_limiter, "account_limit", BucketLimit(2, 60))
+    rate_limiter.store.clear()
+    yield rate_limiter
+    rate_limiter.store.clear()
+
+
+def echo_app(limiter: RateLimiter):
+    # Обработчик возвращает IP клиента и тело запроса, чтобы проверить, что middleware их не меняет
+    async def login(request):
+        return JSONResponse({"ip": request.client.host, "size": len(await request.body())})
+
+    app = Starlette(routes=[Route("/api/auth/login", login, methods=["POST"])])
+    return RateLimitMiddleware(app, limiter=limiter)
+
+
+def connect_from(app, host: str) -> TestClient:
+    # TestClient всегда подключается с адреса "testclient"; здесь адрес подменяется в scope
+    async def with_client(scope, receive, send):
+        await app({**scope, "client": (host, 1000)}, receive, send)
+
+    return TestClient(with_client)
+
+
+def test_login_is_rejected_with_retry_after_before_the_database(client, limits):
+    body = {"email": f"{uuid.uuid4().hex}@example.com", "password": "wrong"}
+
+    statuses = [client.post("/api/auth/login", json=body).status_code for _ in range(3)]
+
+    assert statuses == [401, 401, 429]
+    response = client.post("/api/auth/login", json=body)
+    assert response.status_code == 429
+    # Корзина пополняется токеном в секунду (60 в минуту)
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_account_bucket_is_shared_across_ips(limits):
+    limits.ip_limit = BucketLimit(100, 60)
+    app = echo_app(limits)
+    body = {"email": " Someone@Example.com ", "password": "x"}
+
+    statuses = [
+        connect_from(app, f"10.0.0.{i}").post("/api/auth/login", json=body).status_code
+        for i in range(3)
+    ]
+
+    assert statuses == [200, 200, 429]
+
+
+def test_bucket_refills_over_time(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    store = MemoryTokenBucketStore()
+    limit = BucketLimit(2, 30)  # токен раз в 2 секунды
+
+    async def take():
+        return await store.take("login:ip:1.2.3.4", limit)
+
+    assert [asyncio.run(take()) for _ in range(2)] == [0.0, 0.0]
+    assert asyncio.run(take()) == pytest.approx(2.0)
+    now[0] += 1
+    # За секунду накопилось полтокена (в том числе от отклоненной попытки)
+    assert asyncio.run(take()) == pytest.approx(1.0)
+    now[0] += 1
+    assert asyncio.run(take()) == 0.0
+    now[0] += 60
+    # Корзина не копит больше capacity
+    assert [asyncio.run(take()) for _ in range(3)] == [0.0, 0.0, pytest.approx(2.0)]
+
+
+def test_body_over_limit_is_rejected_and_smaller_body_is_passed_through(limits):
+    client = TestClient(echo_app(limits))
+
+    large = client.post("/api/auth/login", content=b"x" * (ratelimit.MAX_BODY_BYTES + 1),
+                        headers={"Content-Type": "application/json"})
+    small = client.post("/api/auth/login", content=b"y" * ratelimit.MAX_BODY_BYTES,
+                        headers={"Content-Type": "application/json"})
+
+    assert large.status_code == 413
+    assert small.status_code == 200
+    assert small.json()["size"] == ratelimit.MAX_BODY_BYTES
+
+
+def test_client_ip_is_taken_from_trusted_proxy_only(limits):
+    # Как в docker-compose: uvicorn доверяет X-Forwarded-For только от адреса nginx (FORWARDED_ALLOW_IPS)
+    app = ProxyHeadersMiddleware(echo_app(limits), trusted_hosts="172.28.0.10")
+    proxy = connect_from(app, "172.28.0.10")
+    direct = connect_from(app, "203.0.113.9")
+
+    # За прокси у каждого клиента своя корзина IP
+    for ip in ("198.51.100.1", "198.51.100.2", "198.51.100.3"):
+        response = proxy.post("/api/auth/login", json={}, headers={"X-Forwarded-For": ip})
+        assert response.status_code == 200
+        assert response.json()["ip"] == ip
+    # Заголовок от недоверенного адреса игнорируется: корзина его собственного IP
+    statuses = [
+        direct.post("/api/auth/login", json={}, headers={"X-Forwarded-For": f"198.51.100.{i}"}).status_code
+        for i in range(10, 13)
+    ]
+    assert statuses == [200, 200, 429]
+    assert limits.store._buckets.keys() >= {"login:ip:198.51.100.1", "login:ip:203.0.113.9"}
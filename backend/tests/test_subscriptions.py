@@ -0,0 +1,57 @@
+from datetime import date, timedelta
+
+from app.instrumentation import count_queries
+from app.models import Payment, Subscription
+
+
+def statements_of(queries, verb: str) -> list:
+    return [statement for statement in queries.statements if statement.lstrip().upper().startswith(verb)]
+
+
+def add_subscriptions(db, user, end_dates, status="active"):
+    today = date.today()
+    subscriptions = [
+        Subscription(user_id=user.id, platform_id=i % 3 + 1, plan_name=f"plan{i}",
+                     start_date=today - timedelta(days=30), end_date=end_date, status=status)
+        for i, end_date in enumerate(end_dates)
+    ]
+    db.add_all(subscriptions)
+    db.flush()
+    # У каждой подписки есть подтвержденный платеж: статус меняется только по сроку
+    db.add_all(Payment(user_id=user.id, subscription_id=subscription.id, plan_name=subscription.plan_name,
+                       amount=100, status="confirmed") for subscription in subscriptions)
+    db.commit()
+    return subscriptions
+
+
+def test_get_subscriptions_unchanged_is_one_select(client, db, user):
+    today = date.today()
+    add_subscriptions(db, user, [today + timedelta(days=10), today + timedelta(days=20), today + timedelta(days=30)])
+    client.get(f"/api/subscriptions/{user.id}")
+
+    with count_queries() as queries:
+        response = client.get(f"/api/subscriptions/{user.id}")
+
+    assert response.status_code == 200
+    assert len(response.json()["subscriptions"]) == 3
+    assert queries.count == 1, queries.statements
+    assert len(statements_of(queries, "SELECT")) == 1
+
+
+def test_get_subscriptions_status_changes_are_one_update(client, db, user):
+    today = date.today()
+    add_subscriptions(db, user, [today - timedelta(days=1), today - timedelta(days=2), today + timedelta(days=5)])
+
+    with count_queries() as queries:
+        response = client.get(f"/api/subscriptions/{user.id}")
+
+    assert response.status_code == 200
+    statuses = [subscription["status"] for subscription in response.json()["subscriptions"]]
+    assert statuses == ["expired", "expired", "active"]
+    # Все изменения статусов - один UPDATE подписок (остальные запросы - пересчет сводки)
+    assert len([statement for statement in statements_of(queries, "UPDATE")
+                if "UPDATE subscriptions" in statement]) == 1
+
+    with count_queries() as queries:
+        client.get(f"/api/subscriptions/{user.id}")
+    assert queries.count == 1, queries.statements